@@ -0,0 +1,47 @@
+"""
+Rebuild the rollup tables (rollup_daily / rollup_hourly) from callbacks.db.
+
+Run once after upgrading a server whose database predates the rollups; the
+server does not archive old months until it has. It is safe to re-run at any
+time, also while the server is running: the tables are recomputed from
+scratch (archived months included) in shadow tables that are swapped in at
+the end, and the server does not archive while a rebuild is in progress.
+``--compress-payloads`` additionally converts payloads stored as JSON text to
+compressed blobs, and ``--search`` rebuilds the full-text search index.
+
+Usage:
+    python backfill_rollups.py [--db path/to/callbacks.db] [--compress-payloads] [--search]
+"""
+import argparse
+import time
+
+from callback_store import CallbackStore, DB_PATH
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild callback rollup tables')
+    parser.add_argument('--db', default=DB_PATH, help='path to callbacks.db')
+    parser.add_argument('--chunk-size', type=int, default=5000, help='callbacks read per batch')
+    parser.add_argument('--compress-payloads', action='store_true', help='also compress old text payloads')
+    parser.add_argument('--search', action='store_true', help='also rebuild the search index')
+    args = parser.parse_args()
+
+    store = CallbackStore(args.db)
+    started = time.perf_counter()
+    try:
+        scanned = store.rebuild_rollups(chunk_size=args.chunk_size)
+    except RuntimeError as e:
+        raise SystemExit(f"Cannot rebuild rollups now: {e}")
+    print(f"Rebuilt rollups from {scanned} callbacks in {time.perf_counter() - started:.1f}s")
+    if args.compress_payloads:
+        started = time.perf_counter()
+        converted = store.compress_payloads()
+        print(f"Compressed {converted} payloads in {time.perf_counter() - started:.1f}s")
+    if args.search:
+        started = time.perf_counter()
+        indexed = store.rebuild_search(chunk_size=args.chunk_size)
+        print(f"Indexed {indexed} callbacks for search in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
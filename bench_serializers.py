@@ -0,0 +1,116 @@
+"""
+Compare JSON and MessagePack for Socket.IO notification packets.
+
+For a typical STK and C2B callback, both as the compact notification and
+with the raw Daraja payload attached (?raw=1), this measures:
+
+ - bytes on the wire (the Socket.IO packet)
+ - encode time (server side: payload -> Socket.IO packet)
+ - decode time (client side: Socket.IO packet -> dict)
+
+``json`` is the default packet, ``msgpack`` the MessagePack packet sent to
+clients that negotiated it (see utils.wire_format). Decoding uses the same
+packet class as the GUI clients.
+
+Requires msgpack (``pip install msgpack``).
+
+Usage:
+    python bench_serializers.py [--iterations 20000]
+"""
+import argparse
+import sys
+import time
+
+from socketio import packet
+
+from utils import wire_format
+from utils.callback_parser import build_notification, normalize_callback
+
+STK_CALLBACK = {
+    'Body': {'stkCallback': {
+        'MerchantRequestID': '29115-34620561-1',
+        'CheckoutRequestID': 'ws_CO_191220191020363925',
+        'ResultCode': 0,
+        'ResultDesc': 'The service request is processed successfully.',
+        'CallbackMetadata': {'Item': [
+            {'Name': 'Amount', 'Value': 1500.00},
+            {'Name': 'MpesaReceiptNumber', 'Value': 'NLJ7RT61SV'},
+            {'Name': 'TransactionDate', 'Value': 20251026102115},
+            {'Name': 'PhoneNumber', 'Value': 254708374149},
+        ]},
+    }},
+    'merchant_id': '600977',
+}
+
+C2B_CONFIRMATION = {
+    'TransactionType': 'Pay Bill',
+    'TransID': 'RKTQDM7W6S',
+    'TransTime': '20251026102115',
+    'TransAmount': '250.00',
+    'BusinessShortCode': '600977',
+    'BillRefNumber': 'INV-20931',
+    'InvoiceNumber': '',
+    'OrgAccountBalance': '49197.00',
+    'ThirdPartyTransID': '',
+    'MSISDN': '254708374149',
+    'FirstName': 'JOHN',
+    'MiddleName': 'KAMAU',
+    'LastName': 'DOE',
+}
+
+EVENTS = (('stk', STK_CALLBACK), ('c2b_confirmation', C2B_CONFIRMATION))
+
+
+def _messages():
+    for cb_type, data in EVENTS:
+        msg = build_notification(123456, normalize_callback(cb_type, data, '2025-10-26T07:21:15+00:00'), '600977')
+        yield cb_type, msg
+        yield f'{cb_type} +raw', dict(msg, data=data)
+
+
+def _wire_size(encoded):
+    return len(encoded.encode('utf-8')) if isinstance(encoded, str) else len(encoded)
+
+
+def _codecs():
+    """name -> (encode(msg), decode(encoded)), as the server encodes and WSClient decodes"""
+    client_packet = wire_format.client_serializer()
+    codecs = {}
+    for codec in (wire_format.JSON, wire_format.MSGPACK):
+        packet_class = wire_format.packet_class(codec) or packet.Packet
+        codecs[codec] = (
+            lambda msg, cls=packet_class: cls(packet.EVENT, namespace='/', data=['notification', msg]).encode(),
+            lambda encoded: client_packet(encoded_packet=encoded).data[1],
+        )
+    return codecs
+
+
+def _time_per_op(fn, arg, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn(arg)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark JSON vs MessagePack notification packets')
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    if not wire_format._HAS_MSGPACK:
+        print('msgpack is required for this benchmark. Install with: pip install msgpack', file=sys.stderr)
+        sys.exit(1)
+
+    codecs = _codecs()
+    print(f"{'event':<24}{'codec':<16}{'bytes':>7}{'encode us':>11}{'decode us':>11}")
+    for label, msg in _messages():
+        for name, (encode, decode) in codecs.items():
+            encoded = encode(msg)
+            assert decode(encoded) == msg, f'{name} did not roundtrip {label}'
+            print(f"{label:<24}{name:<16}{_wire_size(encoded):>7}"
+                  f"{_time_per_op(encode, msg, args.iterations):>11.2f}"
+                  f"{_time_per_op(decode, encoded, args.iterations):>11.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,869 @@
+"""
+Storage for the callback server: the raw ``callbacks`` table plus rollups.
+
+Every callback written through :class:`CallbackStore` also updates two rollup
+tables (per shortcode x hour and per shortcode x day: successful count, sum,
+min, max and failed count) in the same transaction, so range summaries read
+one row per shop per period instead of scanning transactions.
+
+Payloads are kept as the raw request bytes, zlib-compressed against a preset
+dictionary of M-Pesa field names (``payload_blob``); rows from before that
+still have JSON text in ``payload``. Read them back with :func:`decode_payload`,
+which handles both.
+
+Run ``python backfill_rollups.py`` once to build the rollups for callbacks
+stored before they existed (``--compress-payloads`` also compresses their
+payloads). Archiving stays paused on such a database until it has run.
+
+The database only holds recent months. :meth:`CallbackStore.archive` (run
+periodically by :meth:`CallbackStore.start_archiver`) moves older callbacks
+to one gzipped JSONL file per month and deletes short-lived types (such as
+``c2b_validation``) once they pass their retention. The rollups are kept,
+and :meth:`CallbackStore.iter_callbacks` / :meth:`CallbackStore.latest` read
+the archive files as well, so callers do not need to know where a row is.
+
+Payments are also indexed at ingest in an FTS5 table (customer name, bill
+reference, receipt and phone number variants) for :meth:`CallbackStore.search`.
+Search entries carry the fields needed to show a result, so they stay valid
+after a callback is archived.
+"""
+import ast
+import bisect
+import gzip
+import heapq
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone, UTC
+
+from utils.callback_parser import normalize_callback
+from utils.log import get_logger
+
+log = get_logger(__name__)
+
+DB_PATH = os.path.join(os.path.dirname(__file__), 'callbacks.db')
+
+# Rollup periods are calendar hours/days in the server's local time unless a
+# fixed offset is configured (e.g. ROLLUP_UTC_OFFSET_HOURS=3 for EAT). Daraja
+# times (TransTime, TransactionDate) carry no zone and are read as local time.
+_ROLLUP_OFFSET = os.getenv('ROLLUP_UTC_OFFSET_HOURS')
+ROLLUP_TZ = timezone(timedelta(hours=float(_ROLLUP_OFFSET))) if _ROLLUP_OFFSET else None
+
+ROLLUP_TABLES = {'day': 'rollup_daily', 'hour': 'rollup_hourly'}
+# rebuild_rollups fills these and swaps them in when done
+_REBUILD_TABLES = {grain: f'{table}_rebuild' for grain, table in ROLLUP_TABLES.items()}
+_PERIOD_FORMATS = {'day': '%Y-%m-%d', 'hour': '%Y-%m-%d %H'}
+
+# Callback types that are not payments in their own right
+_NOT_PAYMENTS = ('c2b_validation',)
+
+# Months kept in the database (the current one included); older months are archived
+HOT_MONTHS = int(os.getenv('CALLBACK_HOT_MONTHS', '2'))
+
+
+def _parse_retention(spec):
+    """``"c2b_validation=7,stk=400"`` -> ``{'c2b_validation': 7, 'stk': 400}``"""
+    out = {}
+    for item in spec.split(','):
+        cb_type, _, days = item.partition('=')
+        if cb_type.strip() and days.strip():
+            out[cb_type.strip()] = int(days)
+    return out
+
+
+# Types deleted after this many days instead of being archived
+RETENTION_DAYS = _parse_retention(os.getenv('CALLBACK_RETENTION_DAYS', 'c2b_validation=7'))
+
+ARCHIVE_INDEX = 'index.json'
+
+# Decoded archive months kept in memory for paging back through history
+ARCHIVE_CACHE_MONTHS = int(os.getenv('CALLBACK_ARCHIVE_CACHE_MONTHS', '2'))
+
+# store_meta key set once the rollups cover every stored callback (a new
+# database, or after rebuild_rollups). Until then nothing is archived or
+# expired, so a database that predates the rollups keeps every row for
+# backfill_rollups.py to fold in.
+ROLLUPS_COMPLETE = 'rollups_complete'
+
+# store_meta key held by archive() and rebuild_rollups() while they run, so
+# the server's archiver and backfill_rollups.py (another process) never
+# overlap. Holders renew it as they go; a crashed holder's lease expires.
+MAINTENANCE_LEASE = 'maintenance_lease'
+LEASE_SECONDS = 300
+
+# Select this instead of ``payload``: the compressed blob, or the legacy text
+PAYLOAD_COLUMN = 'coalesce(payload_blob, payload)'
+
+# Preset dictionary for payload compression: the boilerplate of Daraja
+# callbacks, both as sent (compact) and as json.dumps writes it. The most
+# common strings go last, where zlib reaches them with the shortest distances.
+# Never edit a dictionary in place: stored blobs name theirs by Adler-32 (the
+# zlib DICTID), so add a new one and point _ZDICT at it instead.
+_ZDICT_V1 = (
+    b'"ResultDesc": "The service request is processed successfully.", "CallbackMetadata": {"Item": ['
+    b'{"Name": "Amount", "Value": }, {"Name": "MpesaReceiptNumber", "Value": "'
+    b'{"Name": "Balance"}, {"Name": "TransactionDate", "Value": 2025}, {"Name": "PhoneNumber", "Value": 2547'
+    b'"ResultDesc":"Request Cancelled by user.""ResultDesc":"DS timeout user cannot be reached"'
+    b'{"TransactionType": "Pay Bill", "TransID": "", "TransTime": "2025", "TransAmount": ".00", '
+    b'"BusinessShortCode": "", "BillRefNumber": "", "InvoiceNumber": "", "OrgAccountBalance": "", '
+    b'"ThirdPartyTransID": "", "MSISDN": "", "FirstName": "", "MiddleName": "", "LastName": ""}'
+    b'{"Body":{"stkCallback":{"MerchantRequestID":"","CheckoutRequestID":"ws_CO_","ResultCode":0,'
+    b'"ResultDesc":"The service request is processed successfully.","CallbackMetadata":{"Item":['
+    b'{"Name":"Amount","Value":},{"Name":"MpesaReceiptNumber","Value":"'
+    b'{"Name":"Balance"},{"Name":"TransactionDate","Value":2025},{"Name":"PhoneNumber","Value":2547}]}}}}'
+    b'{"TransactionType":"Pay Bill","TransactionType":"Buy Goods","TransID":"","TransTime":"2025",'
+    b'"TransAmount":".00","BusinessShortCode":"","BillRefNumber":"","InvoiceNumber":"",'
+    b'"OrgAccountBalance":"","ThirdPartyTransID":"","MSISDN":"","FirstName":"","MiddleName":"","LastName":""}'
+)
+_ZDICT = _ZDICT_V1
+_ZDICTS = {zlib.adler32(d): d for d in (_ZDICT_V1,)}
+CODEC = 'zlib'
+
+
+def compress_payload(raw):
+    """Compress raw payload bytes for ``payload_blob``."""
+    comp = zlib.compressobj(level=6, zdict=_ZDICT)
+    return comp.compress(raw) + comp.flush()
+
+
+def raw_payload(stored):
+    """Return a stored payload as text, decompressing it if needed."""
+    if isinstance(stored, (bytes, memoryview)):
+        blob = bytes(stored)
+        # zlib header: FDICT (bit 5 of the flags byte) means a 4-byte DICTID follows
+        if len(blob) > 6 and blob[1] & 0x20:
+            decomp = zlib.decompressobj(zdict=_ZDICTS[int.from_bytes(blob[2:6], 'big')])
+        else:
+            decomp = zlib.decompressobj()
+        return (decomp.decompress(blob) + decomp.flush()).decode('utf-8', 'replace')
+    return stored
+
+
+def decode_payload(payload_text):
+    """Decode a stored payload (the ``PAYLOAD_COLUMN`` value) into an object.
+
+    Compressed blobs are inflated first. Older rows were sometimes written
+    with ``str(data)`` (a Python repr) instead of JSON, so fall back to
+    ``ast.literal_eval``.
+    """
+    if not payload_text:
+        return {}
+    payload_text = raw_payload(payload_text)
+    try:
+        return json.loads(payload_text)
+    except Exception:
+        pass
+    try:
+        return ast.literal_eval(payload_text)
+    except Exception:
+        return payload_text
+
+
+def _periods(ts):
+    dt = datetime.fromtimestamp(ts, ROLLUP_TZ)
+    return {grain: dt.strftime(fmt) for grain, fmt in _PERIOD_FORMATS.items()}
+
+
+def period_of(ts, granularity='day'):
+    """Rollup period label (``YYYY-MM-DD`` or ``YYYY-MM-DD HH``) for an epoch time."""
+    return datetime.fromtimestamp(ts, ROLLUP_TZ).strftime(_PERIOD_FORMATS[granularity])
+
+
+def _phone_terms(phone):
+    """Index text for a phone number: its 2547.., 07.. and 7.. forms, plus the
+    digits reversed so that searching the last digits is a prefix match.
+
+    Hashed MSISDNs (newer C2B callbacks) are not indexed.
+    """
+    phone = str(phone or '').strip().lstrip('+')
+    if not phone.isdigit() or len(phone) > 15:
+        return '', ''
+    local = phone[3:] if phone.startswith('254') else phone.lstrip('0')
+    return ' '.join(dict.fromkeys((phone, '254' + local, '0' + local, local))), phone[::-1]
+
+
+def _fts_query(text):
+    """Turn free text into an FTS5 query: every word must prefix-match.
+
+    Digit runs match the start of a phone number, receipt or reference, or the
+    end of a phone number (``5678`` finds ``0712345678``).
+    """
+    terms = []
+    for word in re.findall(r'\w+', text):
+        if word.isdigit():
+            terms.append(f'({{phone receipt bill_ref}} : "{word}"* OR phone_rev : "{word[::-1]}"*)')
+        else:
+            terms.append(f'{{name bill_ref receipt}} : "{word}"*')
+    return ' AND '.join(terms)
+
+
+def _month_start(now, months_back):
+    """``YYYY-MM-01`` of the month ``months_back`` months before ``now``'s."""
+    index = now.year * 12 + now.month - 1 - months_back
+    return f'{index // 12:04d}-{index % 12 + 1:02d}-01'
+
+
+def _next_day(day):
+    return (datetime.strptime(day, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+
+
+class CallbackStore:
+    """SQLite callback store. Each call opens its own connection (thread-safe).
+
+    Archived months live in ``archive_dir`` (default: ``<db name>_archive``
+    next to the database, or ``$CALLBACK_ARCHIVE_DIR``).
+    """
+
+    def __init__(self, path=DB_PATH, archive_dir=None):
+        self.path = path
+        self.archive_dir = (archive_dir or os.getenv('CALLBACK_ARCHIVE_DIR')
+                            or os.path.splitext(path)[0] + '_archive')
+        self._archive_lock = threading.Lock()
+        self._archiver = None
+        # month -> (file mtime, ids, rows); see _archived_month
+        self._month_cache = OrderedDict()
+        self._month_cache_lock = threading.Lock()
+        self._warned_rollups = False
+        self.fts = False
+        # Called as on_write(write_seconds, commit_seconds) after each insert
+        self.on_write = None
+        self._init_db()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        try:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS callbacks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                merchant_id TEXT,
+                type TEXT,
+                payload TEXT,
+                created_at TEXT
+            )
+            ''')
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(callbacks)')}
+            if 'payload_blob' not in columns:
+                conn.execute('ALTER TABLE callbacks ADD COLUMN payload_blob BLOB')
+            if 'codec' not in columns:
+                conn.execute('ALTER TABLE callbacks ADD COLUMN codec TEXT')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_callbacks_created_at ON callbacks (created_at)')
+            conn.execute('CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value TEXT)')
+            # Nothing stored yet: every callback from now on is rolled up at insert
+            if (conn.execute('SELECT 1 FROM callbacks LIMIT 1').fetchone() is None
+                    and not self.archive_index()):
+                conn.execute('INSERT OR IGNORE INTO store_meta (key, value) VALUES (?, ?)',
+                             (ROLLUPS_COMPLETE, datetime.now(UTC).isoformat()))
+            for table in ROLLUP_TABLES.values():
+                self._create_rollup_table(conn, table)
+                conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_period ON {table} (period)')
+            try:
+                # rowid = callbacks.id; the UNINDEXED columns are only returned with results
+                conn.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS callbacks_fts USING fts5(
+                    name, bill_ref, receipt, phone, phone_rev,
+                    shortcode UNINDEXED, type UNINDEXED, amount UNINDEXED, ts UNINDEXED,
+                    tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+                )
+                ''')
+                self.fts = True
+            except sqlite3.OperationalError as e:
+                log.warning("FTS5 unavailable, /api/search disabled: %s", e)
+            conn.commit()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _create_rollup_table(conn, table):
+        conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            shortcode TEXT NOT NULL,
+            period TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            total REAL NOT NULL DEFAULT 0,
+            min_amount REAL,
+            max_amount REAL,
+            failed INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (shortcode, period)
+        ) WITHOUT ROWID
+        ''')
+
+    # --- maintenance lease ---
+
+    def _acquire_lease(self, owner, seconds=LEASE_SECONDS):
+        """Take (or renew) the maintenance lease for ``owner``; False if someone else holds it."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.isolation_level = None
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT value FROM store_meta WHERE key = ?', (MAINTENANCE_LEASE,)).fetchone()
+                if row is not None:
+                    holder, _, expires = row[0].partition(' ')
+                    if holder != owner and float(expires or 0) > now:
+                        return False
+                conn.execute('INSERT OR REPLACE INTO store_meta (key, value) VALUES (?, ?)',
+                             (MAINTENANCE_LEASE, f'{owner} {now + seconds}'))
+                return True
+            finally:
+                conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+    def _release_lease(self, owner):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM store_meta WHERE key = ? AND value LIKE ? || ' %'",
+                             (MAINTENANCE_LEASE, owner))
+        finally:
+            conn.close()
+
+    # --- writing ---
+
+    def insert(self, merchant_id, cb_type, data, created_at=None, raw=None, rec=None):
+        """Store one callback, fold it into the rollups and index it; returns its id.
+
+        ``data`` is the parsed payload (used for the rollups). Pass the request
+        body as ``raw`` to store it as received instead of re-encoding ``data``,
+        and ``rec`` if the caller already ran ``normalize_callback`` on it.
+        """
+        created_at = created_at or datetime.now(UTC).isoformat()
+        if raw is None:
+            try:
+                raw = json.dumps(data).encode('utf-8')
+            except Exception:
+                raw = str(data).encode('utf-8')
+        conn = self._connect()
+        try:
+            started = time.perf_counter()
+            try:
+                cur = conn.execute('INSERT INTO callbacks (merchant_id, type, payload_blob, codec, created_at) '
+                                   'VALUES (?, ?, ?, ?, ?)',
+                                   (merchant_id, cb_type, compress_payload(raw), CODEC, created_at))
+                if cb_type not in _NOT_PAYMENTS:
+                    rec = rec or normalize_callback(cb_type, data, created_at)
+                    self._add_to_rollups(conn, merchant_id, rec)
+                    self._add_to_search(conn, cur.lastrowid, merchant_id, rec)
+                written = time.perf_counter()
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            if self.on_write is not None:
+                self.on_write(written - started, time.perf_counter() - written)
+            return cur.lastrowid
+        finally:
+            conn.close()
+
+    def _add_to_rollups(self, conn, merchant_id, rec, tables=ROLLUP_TABLES):
+        if rec['timestamp'] is None:
+            return
+        shortcode = rec['shortcode'] or str(merchant_id or '')
+        if rec['ok'] and rec['amount'] is not None:
+            values = (1, rec['amount'], rec['amount'], rec['amount'], 0)
+        elif not rec['ok']:
+            values = (0, 0.0, None, None, 1)
+        else:
+            return
+        for grain, period in _periods(rec['timestamp']).items():
+            table = tables[grain]
+            conn.execute(f'''
+            INSERT INTO {table} (shortcode, period, count, total, min_amount, max_amount, failed)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (shortcode, period) DO UPDATE SET
+                count = count + excluded.count,
+                total = total + excluded.total,
+                min_amount = min(coalesce(min_amount, excluded.min_amount), coalesce(excluded.min_amount, min_amount)),
+                max_amount = max(coalesce(max_amount, excluded.max_amount), coalesce(excluded.max_amount, max_amount)),
+                failed = failed + excluded.failed
+            ''', (shortcode, period) + values)
+
+    def rebuild_rollups(self, chunk_size=5000):
+        """Recompute both rollup tables from every stored callback (archived months included).
+
+        The totals are built in separate tables, committing every chunk, so
+        live inserts are never blocked for long. They are swapped in at the
+        end in one short transaction, which also folds in callbacks stored
+        while the rebuild ran; readers never see half-built totals. Holds the
+        maintenance lease throughout, so no rows are archived mid-scan, even
+        by a server running in another process. Marks the rollups complete,
+        which lets :meth:`archive` run.
+
+        Returns the number of callbacks scanned. Raises RuntimeError if an
+        archive run or another rebuild holds the lease.
+        """
+        owner = f'rebuild-{uuid.uuid4().hex}'
+        if not self._acquire_lease(owner):
+            raise RuntimeError('another archive run or rollup rebuild is in progress; try again later')
+        scanned = 0
+        conn = self._connect()
+        try:
+            with conn:
+                for table in _REBUILD_TABLES.values():
+                    conn.execute(f'DROP TABLE IF EXISTS {table}')
+                    self._create_rollup_table(conn, table)
+                # Highest id ever assigned (AUTOINCREMENT), archived rows included
+                row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'callbacks'").fetchone()
+                high = row[0] if row else 0
+            for rows in self.iter_callbacks(chunk_size=chunk_size):
+                rows = [row for row in rows if row[0] <= high]
+                if not rows:
+                    break
+                with conn:
+                    self._fold_into_rebuild(conn, rows)
+                scanned += len(rows)
+                self._acquire_lease(owner)
+
+            conn.isolation_level = None
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Stored since the scan started; already in the live tables, not in ours
+                late = conn.execute(f'SELECT id, merchant_id, type, {PAYLOAD_COLUMN}, created_at FROM callbacks '
+                                    'WHERE id > ? ORDER BY id', (high,)).fetchall()
+                self._fold_into_rebuild(conn, late)
+                scanned += len(late)
+                for grain, table in ROLLUP_TABLES.items():
+                    conn.execute(f'DELETE FROM {table}')
+                    conn.execute(f'INSERT INTO {table} SELECT * FROM {_REBUILD_TABLES[grain]}')
+                    conn.execute(f'DROP TABLE {_REBUILD_TABLES[grain]}')
+                conn.execute('INSERT OR REPLACE INTO store_meta (key, value) VALUES (?, ?)',
+                             (ROLLUPS_COMPLETE, datetime.now(UTC).isoformat()))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        finally:
+            conn.close()
+            self._release_lease(owner)
+        return scanned
+
+    def _fold_into_rebuild(self, conn, rows):
+        for _rid, merchant_id, cb_type, payload_text, created_at in rows:
+            if cb_type not in _NOT_PAYMENTS:
+                rec = normalize_callback(cb_type, decode_payload(payload_text), created_at)
+                self._add_to_rollups(conn, merchant_id, rec, _REBUILD_TABLES)
+
+    def rollups_complete(self):
+        """True once the rollups cover every stored callback (see :data:`ROLLUPS_COMPLETE`)."""
+        conn = self._connect()
+        try:
+            return conn.execute('SELECT 1 FROM store_meta WHERE key = ?', (ROLLUPS_COMPLETE,)).fetchone() is not None
+        finally:
+            conn.close()
+
+    def _add_to_search(self, conn, rid, merchant_id, rec):
+        if not self.fts:
+            return
+        phone, phone_rev = _phone_terms(rec['phone'])
+        if not (rec['name'] or rec['bill_ref'] or rec['transaction_id'] or phone):
+            return
+        conn.execute('INSERT INTO callbacks_fts (rowid, name, bill_ref, receipt, phone, phone_rev, '
+                     'shortcode, type, amount, ts) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                     (rid, rec['name'], rec['bill_ref'], rec['transaction_id'], phone, phone_rev,
+                      rec['shortcode'] or str(merchant_id or ''), rec['type'], rec['amount'], rec['timestamp']))
+
+    def rebuild_search(self, chunk_size=5000):
+        """Re-index every stored payment (archived months included) for search.
+
+        Runs in a single transaction; returns the number of callbacks scanned.
+        """
+        if not self.fts:
+            return 0
+        scanned = 0
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM callbacks_fts')
+                for rows in self.iter_callbacks(chunk_size=chunk_size):
+                    for rid, merchant_id, cb_type, payload_text, created_at in rows:
+                        if cb_type not in _NOT_PAYMENTS:
+                            rec = normalize_callback(cb_type, decode_payload(payload_text), created_at)
+                            self._add_to_search(conn, rid, merchant_id, rec)
+                    scanned += len(rows)
+                conn.execute("INSERT INTO callbacks_fts (callbacks_fts) VALUES ('optimize')")
+        finally:
+            conn.close()
+        return scanned
+
+    def compress_payloads(self, chunk_size=1000):
+        """Compress payloads still stored as text; returns the number converted.
+
+        Commits per chunk, so it can run against a live server and resume.
+        """
+        converted = 0
+        last_id = 0
+        conn = self._connect()
+        try:
+            while True:
+                rows = conn.execute('SELECT id, payload FROM callbacks WHERE id > ? AND payload_blob IS NULL '
+                                    'AND payload IS NOT NULL ORDER BY id LIMIT ?', (last_id, chunk_size)).fetchall()
+                if not rows:
+                    break
+                with conn:
+                    conn.executemany('UPDATE callbacks SET payload_blob = ?, codec = ?, payload = NULL WHERE id = ?',
+                                     [(compress_payload(text.encode('utf-8')), CODEC, rid) for rid, text in rows])
+                converted += len(rows)
+                last_id = rows[-1][0]
+        finally:
+            conn.close()
+        return converted
+
+    # --- archive ---
+
+    def archive_index(self):
+        """``{'YYYY-MM': {'first_id', 'last_id', 'count'}}`` for archived months."""
+        try:
+            with open(os.path.join(self.archive_dir, ARCHIVE_INDEX), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_archive_index(self, index):
+        path = os.path.join(self.archive_dir, ARCHIVE_INDEX)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(index, f, indent=1, sort_keys=True)
+        os.replace(path + '.tmp', path)
+
+    def _archive_path(self, month):
+        return os.path.join(self.archive_dir, f'callbacks-{month}.jsonl.gz')
+
+    def _read_archive(self, month):
+        """Yield archived rows of one month in id order."""
+        last_id = 0
+        with gzip.open(self._archive_path(month), 'rt', encoding='utf-8') as f:
+            for line in f:
+                r = json.loads(line)
+                # An interrupted archive run can leave rows twice; ids only ever increase
+                if r['id'] <= last_id:
+                    continue
+                last_id = r['id']
+                yield r['id'], r['merchant_id'], r['type'], r['payload'], r['created_at']
+
+    def _archived_month(self, month):
+        """``(ids, rows)`` of one archived month, decoded once and kept in a small LRU.
+
+        Entries are keyed on the file's mtime, so a month that the archiver
+        appends to is read again.
+        """
+        path = self._archive_path(month)
+        mtime = os.path.getmtime(path)
+        with self._month_cache_lock:
+            cached = self._month_cache.get(month)
+            if cached is not None and cached[0] == mtime:
+                self._month_cache.move_to_end(month)
+                return cached[1], cached[2]
+        rows = list(self._read_archive(month))
+        ids = [row[0] for row in rows]
+        with self._month_cache_lock:
+            self._month_cache[month] = (mtime, ids, rows)
+            self._month_cache.move_to_end(month)
+            while len(self._month_cache) > max(ARCHIVE_CACHE_MONTHS, 1):
+                self._month_cache.popitem(last=False)
+        return ids, rows
+
+    def archive(self, now=None, chunk_size=5000):
+        """Apply retention and move months older than ``HOT_MONTHS`` to the archive.
+
+        Each month is appended to ``callbacks-YYYY-MM.jsonl.gz`` (as a new
+        gzip member) and the index is saved before the rows are deleted, so
+        an interrupted run loses nothing and the next run picks up where it
+        stopped. Returns ``(archived, expired)`` row counts.
+
+        Does nothing until the rollups are complete (run ``backfill_rollups.py``
+        on a database that predates them), so no month leaves the database
+        before its totals are in the rollup tables. It is also skipped while
+        a rollup rebuild in another process holds the maintenance lease.
+        """
+        if not self.rollups_complete():
+            if not self._warned_rollups:
+                log.warning("rollups have not been backfilled; archiving is paused until "
+                            "backfill_rollups.py has run")
+                self._warned_rollups = True
+            return 0, 0
+        owner = f'archive-{uuid.uuid4().hex}'
+        if not self._acquire_lease(owner):
+            log.info("skipping archive run: a rollup rebuild is in progress")
+            return 0, 0
+        now = now or datetime.now(UTC)
+        with self._archive_lock:
+            conn = self._connect()
+            try:
+                expired = 0
+                with conn:
+                    for cb_type, days in RETENTION_DAYS.items():
+                        cutoff = (now - timedelta(days=days)).isoformat()
+                        expired += conn.execute('DELETE FROM callbacks WHERE type = ? AND created_at < ?',
+                                                (cb_type, cutoff)).rowcount
+                archived = self._archive_months(conn, _month_start(now, HOT_MONTHS - 1), chunk_size, owner)
+            finally:
+                conn.close()
+                self._release_lease(owner)
+        return archived, expired
+
+    def _archive_months(self, conn, cutoff, chunk_size, lease_owner):
+        kept = list(RETENTION_DAYS)
+        not_kept = f"AND type NOT IN ({','.join('?' * len(kept))})" if kept else ''
+        index = self.archive_index()
+        files = {}
+        archived = 0
+        max_id = 0
+        os.makedirs(self.archive_dir, exist_ok=True)
+        try:
+            while True:
+                rows = conn.execute(f'SELECT id, merchant_id, type, {PAYLOAD_COLUMN}, created_at FROM callbacks '
+                                    f'WHERE id > ? AND created_at < ? {not_kept} ORDER BY id LIMIT ?',
+                                    [max_id, cutoff] + kept + [chunk_size]).fetchall()
+                if not rows:
+                    break
+                for rid, merchant_id, cb_type, payload, created_at in rows:
+                    month = created_at[:7]
+                    info = index.setdefault(month, {'first_id': rid, 'last_id': 0, 'count': 0})
+                    if rid > info['last_id']:
+                        f = files.get(month)
+                        if f is None:
+                            f = files[month] = gzip.open(self._archive_path(month), 'at', encoding='utf-8')
+                        f.write(json.dumps({'id': rid, 'merchant_id': merchant_id, 'type': cb_type,
+                                            'payload': raw_payload(payload), 'created_at': created_at},
+                                           ensure_ascii=False) + '\n')
+                        info['first_id'] = min(info['first_id'], rid)
+                        info['last_id'] = rid
+                        info['count'] += 1
+                        archived += 1
+                max_id = rows[-1][0]
+                self._acquire_lease(lease_owner)
+        finally:
+            for f in files.values():
+                f.close()
+        if not max_id:
+            return 0
+        self._save_archive_index(index)
+        with conn:
+            conn.execute(f'DELETE FROM callbacks WHERE id <= ? AND created_at < ? {not_kept}',
+                         [max_id, cutoff] + kept)
+        return archived
+
+    def start_archiver(self, interval=3600):
+        """Run :meth:`archive` every ``interval`` seconds on a daemon thread."""
+        if self._archiver is not None:
+            return self._archiver
+
+        def run():
+            while True:
+                try:
+                    archived, expired = self.archive()
+                    if archived or expired:
+                        log.info("archived %d callbacks, expired %d", archived, expired)
+                except Exception:
+                    log.exception("archiving failed")
+                time.sleep(interval)
+
+        self._archiver = threading.Thread(target=run, name='callback-archiver', daemon=True)
+        self._archiver.start()
+        return self._archiver
+
+    # --- reading ---
+
+    def iter_callbacks(self, start=None, end=None, shortcodes=None, types=None, chunk_size=1000, after_id=0):
+        """Yield lists of ``(id, merchant_id, type, payload, created_at)`` in id order.
+
+        ``start``/``end`` are inclusive ``YYYY-MM-DD`` dates matched against
+        ``created_at`` (UTC); ``after_id`` skips rows already processed by an
+        incremental job. Archived months in range and the database are merged
+        by id: rows the archiver keeps in the database (types with a retention
+        period) can be older than archived ones. The database is read in
+        keyset-paginated chunks, so memory stays constant and no read
+        transaction is held between chunks. A row found in both places (an
+        interrupted archive run) is yielded once.
+        Payloads are returned as stored; decode them with :func:`decode_payload`.
+        """
+        after_id = after_id or 0
+        keep = self._row_filter(start, end, shortcodes, types)
+        sources = [
+            (row for row in self._read_archive(month) if row[0] > after_id and keep(row))
+            for month, info in sorted(self.archive_index().items())
+            if info['last_id'] > after_id and not (start and month < start[:7]) and not (end and month > end[:7])
+        ]
+        sources.append(self._iter_db(after_id, start, end, shortcodes, types, chunk_size))
+        chunk = []
+        last_id = None
+        for row in heapq.merge(*sources, key=lambda row: row[0]):
+            if row[0] == last_id:
+                continue
+            last_id = row[0]
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _iter_db(self, after_id, start, end, shortcodes, types, chunk_size):
+        where, params = self._where(start, end, shortcodes, types)
+        sql = (f'SELECT id, merchant_id, type, {PAYLOAD_COLUMN}, created_at FROM callbacks '
+               f'WHERE {" AND ".join(["id > ?"] + where)} ORDER BY id LIMIT ?')
+        last_id = after_id
+        conn = self._connect()
+        try:
+            while True:
+                rows = conn.execute(sql, [last_id] + params + [chunk_size]).fetchall()
+                if not rows:
+                    break
+                yield from rows
+                last_id = rows[-1][0]
+        finally:
+            conn.close()
+
+    def latest(self, limit=100, before_id=None, since_id=None, shortcodes=None, types=None, exclude_types=None):
+        """Newest-first ``(id, merchant_id, type, payload, created_at)`` rows.
+
+        Pages back into the archive when the database has fewer than
+        ``limit`` matching rows older than ``before_id``.
+        """
+        where, params = self._where(None, None, shortcodes, types)
+        if exclude_types:
+            where.append(f"type NOT IN ({','.join('?' * len(exclude_types))})")
+            params.extend(exclude_types)
+        if before_id:
+            where.append('id < ?')
+            params.append(int(before_id))
+        if since_id:
+            where.append('id > ?')
+            params.append(int(since_id))
+        conn = self._connect()
+        try:
+            rows = conn.execute(f'SELECT id, merchant_id, type, {PAYLOAD_COLUMN}, created_at FROM callbacks '
+                                f'WHERE {" AND ".join(where) or "1"} ORDER BY id DESC LIMIT ?',
+                                params + [limit]).fetchall()
+        finally:
+            conn.close()
+        if len(rows) >= limit:
+            return rows
+
+        keep = self._row_filter(None, None, shortcodes, types)
+        excluded = set(exclude_types or ())
+        upper = rows[-1][0] if rows else (int(before_id) if before_id else None)
+        lower = int(since_id) if since_id else 0
+        for month, info in sorted(self.archive_index().items(), reverse=True):
+            if info['last_id'] <= lower or (upper is not None and info['first_id'] >= upper):
+                continue
+            ids, month_rows = self._archived_month(month)
+            # Rows are in id order: step back from just below ``upper``
+            i = (bisect.bisect_left(ids, upper) if upper is not None else len(ids)) - 1
+            while i >= 0 and len(rows) < limit and ids[i] > lower:
+                row = month_rows[i]
+                if row[2] not in excluded and keep(row):
+                    rows.append(row)
+                i -= 1
+            if len(rows) >= limit:
+                break
+        return rows
+
+    @staticmethod
+    def _where(start, end, shortcodes, types):
+        where = []
+        params = []
+        if start:
+            where.append('created_at >= ?')
+            params.append(start)
+        if end:
+            where.append('created_at < ?')
+            params.append(_next_day(end))
+        if shortcodes:
+            where.append(f"merchant_id IN ({','.join('?' * len(shortcodes))})")
+            params.extend(shortcodes)
+        if types:
+            where.append(f"type IN ({','.join('?' * len(types))})")
+            params.extend(types)
+        return where, params
+
+    @staticmethod
+    def _row_filter(start, end, shortcodes, types):
+        """Python equivalent of :meth:`_where`, for archived rows."""
+        end = _next_day(end) if end else None
+        shortcodes = set(shortcodes or ())
+        types = set(types or ())
+
+        def keep(row):
+            _rid, merchant_id, cb_type, _payload, created_at = row
+            return ((not start or created_at >= start) and (not end or created_at < end)
+                    and (not shortcodes or merchant_id in shortcodes) and (not types or cb_type in types))
+        return keep
+
+    def search(self, text, limit=20, shortcodes=None):
+        """Payments matching ``text`` (name, bill ref, receipt or phone), best first.
+
+        Every word is a prefix match; results are ranked with BM25, weighting
+        receipt and phone hits above names.
+        """
+        query = _fts_query(text)
+        if not self.fts or not query:
+            return []
+        sql = ('SELECT rowid, name, bill_ref, receipt, phone_rev, shortcode, type, amount, ts, '
+               'bm25(callbacks_fts, 2.0, 4.0, 10.0, 8.0, 8.0) AS score '
+               'FROM callbacks_fts WHERE callbacks_fts MATCH ?')
+        params = [query]
+        if shortcodes:
+            sql += f" AND shortcode IN ({','.join('?' * len(shortcodes))})"
+            params.extend(shortcodes)
+        sql += ' ORDER BY score, rowid DESC LIMIT ?'
+        params.append(limit)
+        cols = ('id', 'name', 'bill_ref', 'transaction_id', 'phone', 'shortcode', 'type', 'amount', 'timestamp',
+                'score')
+        conn = self._connect()
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+        out = []
+        for row in rows:
+            rec = dict(zip(cols, row))
+            rec['phone'] = rec['phone'][::-1]
+            out.append(rec)
+        return out
+
+    def summary(self, start, end, shortcodes=None, granularity='day'):
+        """Totals per shortcode and period for ``start``..``end`` (``YYYY-MM-DD``, inclusive).
+
+        Returns ``(rows, totals)``: one dict per shortcode x period, and one
+        dict per shortcode over the whole range.
+        """
+        table = ROLLUP_TABLES[granularity]
+        if granularity == 'hour':
+            lo, hi = f'{start} 00', f'{end} 23'
+        else:
+            lo, hi = start, end
+        where = 'period BETWEEN ? AND ?'
+        params = [lo, hi]
+        if shortcodes:
+            where += f" AND shortcode IN ({','.join('?' * len(shortcodes))})"
+            params.extend(shortcodes)
+        cols = ('count', 'total', 'min', 'max', 'failed')
+        conn = self._connect()
+        try:
+            rows = [
+                dict(zip(('shortcode', 'period') + cols, r))
+                for r in conn.execute(f'SELECT shortcode, period, count, total, min_amount, max_amount, failed '
+                                      f'FROM {table} WHERE {where} ORDER BY period, shortcode', params)
+            ]
+            totals = [
+                dict(zip(('shortcode',) + cols, r))
+                for r in conn.execute(f'SELECT shortcode, SUM(count), SUM(total), MIN(min_amount), MAX(max_amount), '
+                                      f'SUM(failed) FROM {table} WHERE {where} GROUP BY shortcode ORDER BY shortcode',
+                                      params)
+            ]
+        finally:
+            conn.close()
+        return rows, totals
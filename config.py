@@ -21,6 +21,8 @@ C2B_CALLBACK_URL = os.getenv('C2B_CALLBACK_URL')
 SERVER_URL = os.getenv('SERVER_URL')
 LOGIN_URL = os.getenv('LOGIN_URL')
 WEBSOCKET_URL = os.getenv('WEBSOCKET_URL')
+# Where the desktop client keeps its per-shop transaction cache
+CACHE_DIR = os.getenv('CACHE_DIR') or str(Path.home() / '.mpesa_manager')
 
 # Shop configuration mapping shop names to their till numbers
 SHOP_MAP = {
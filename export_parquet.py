@@ -0,0 +1,198 @@
+"""
+Incremental columnar snapshot of callbacks.db for analytics.
+
+Callbacks are flattened once (the same normalization the server uses) into
+typed columns and written as files partitioned by day and shortcode:
+
+    <out>/day=2025-10-26/shortcode=600977/part-000123-000456.parquet
+
+Each run only converts callbacks newer than the last exported id (kept in
+``<out>/_export_state.json``) and adds new part files, so existing partitions
+are never rewritten. The layout is hive-style, so it loads directly with
+``pyarrow.dataset`` / ``pandas.read_parquet(<out>)``. Use ``--format arrow``
+for uncompressed Arrow IPC files that can be memory-mapped.
+
+Only payments are exported (STK results and C2B confirmations, not C2B
+validations). A callback whose time cannot be parsed at all goes to the
+``day=unknown`` partition with a null timestamp rather than being left out.
+
+Requires pyarrow (``pip install pyarrow``); it is not in requirements.txt
+since only this script needs it.
+
+Usage:
+    python export_parquet.py --out exports/callbacks [--db callbacks.db] [--format parquet|arrow]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+    _HAS_PYARROW = True
+except Exception:
+    _HAS_PYARROW = False
+
+from callback_store import CallbackStore, DB_PATH, decode_payload, period_of
+from utils.callback_parser import normalize_callback
+
+STATE_FILE = '_export_state.json'
+
+# Callback types exported; c2b_validation requests are not payments
+PAYMENT_TYPES = ('stk', 'c2b_confirmation')
+
+# Partition for callbacks without a usable time
+UNKNOWN_DAY = 'unknown'
+
+# Rows buffered in memory before part files are written
+FLUSH_ROWS = 200_000
+
+COLUMNS = ('id', 'created_at', 'type', 'shortcode', 'transaction_id', 'timestamp',
+           'amount', 'phone', 'name', 'bill_ref', 'status', 'ok')
+
+
+def _schema():
+    return pa.schema([
+        ('id', pa.int64()),
+        ('created_at', pa.string()),
+        ('type', pa.dictionary(pa.int8(), pa.string())),
+        ('shortcode', pa.dictionary(pa.int32(), pa.string())),
+        ('transaction_id', pa.string()),
+        ('timestamp', pa.timestamp('ms', tz='UTC')),
+        ('amount', pa.float64()),
+        ('phone', pa.string()),
+        ('name', pa.string()),
+        ('bill_ref', pa.string()),
+        ('status', pa.dictionary(pa.int32(), pa.string())),
+        ('ok', pa.bool_()),
+    ])
+
+
+def load_state(out_dir):
+    try:
+        with open(os.path.join(out_dir, STATE_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'last_id': 0}
+
+
+def save_state(out_dir, state):
+    path = os.path.join(out_dir, STATE_FILE)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+class _Partition:
+    """Column lists for one day x shortcode partition."""
+
+    def __init__(self):
+        self.cols = {name: [] for name in COLUMNS}
+
+    def append(self, rid, created_at, cb_type, shortcode, rec):
+        c = self.cols
+        c['id'].append(rid)
+        c['created_at'].append(created_at)
+        c['type'].append(cb_type)
+        c['shortcode'].append(shortcode)
+        c['transaction_id'].append(rec['transaction_id'])
+        ts = rec['timestamp']
+        c['timestamp'].append(int(ts * 1000) if ts is not None else None)
+        c['amount'].append(rec['amount'])
+        c['phone'].append(rec['phone'])
+        c['name'].append(rec['name'])
+        c['bill_ref'].append(rec['bill_ref'])
+        c['status'].append(rec['status'])
+        c['ok'].append(rec['ok'])
+
+    def __len__(self):
+        return len(self.cols['id'])
+
+
+def _safe(value):
+    return ''.join(ch if ch.isalnum() or ch in '-_.' else '_' for ch in value) or 'unknown'
+
+
+def _write_partitions(out_dir, partitions, fmt):
+    schema = _schema()
+    written = 0
+    for (day, shortcode), part in partitions.items():
+        ids = part.cols['id']
+        directory = os.path.join(out_dir, f'day={day}', f'shortcode={_safe(shortcode)}')
+        os.makedirs(directory, exist_ok=True)
+        table = pa.table({name: part.cols[name] for name in COLUMNS}, schema=schema)
+        name = f'part-{ids[0]:09d}-{ids[-1]:09d}'
+        if fmt == 'arrow':
+            # Uncompressed so readers can memory-map it without copying
+            feather.write_feather(table, os.path.join(directory, name + '.arrow'), compression='uncompressed')
+        else:
+            pq.write_table(table, os.path.join(directory, name + '.parquet'), compression='zstd')
+        written += len(part)
+    return written
+
+
+def export(db_path, out_dir, fmt='parquet', chunk_size=5000):
+    """Export callbacks newer than the saved state; returns the number of rows written.
+
+    Raises RuntimeError when pyarrow is not installed.
+    """
+    if not _HAS_PYARROW:
+        raise RuntimeError('pyarrow is required for this export. Install with: pip install pyarrow')
+    os.makedirs(out_dir, exist_ok=True)
+    state = load_state(out_dir)
+    store = CallbackStore(db_path)
+    partitions = {}
+    buffered = 0
+    total = 0
+    last_id = state.get('last_id', 0)
+
+    def flush():
+        nonlocal partitions, buffered, total
+        if partitions:
+            total += _write_partitions(out_dir, partitions, fmt)
+        state['last_id'] = last_id
+        save_state(out_dir, state)
+        partitions = {}
+        buffered = 0
+
+    for rows in store.iter_callbacks(types=PAYMENT_TYPES, chunk_size=chunk_size, after_id=last_id):
+        for rid, merchant_id, cb_type, payload_text, created_at in rows:
+            # The record's time falls back to created_at when the payload has none
+            rec = normalize_callback(cb_type, decode_payload(payload_text), created_at)
+            shortcode = rec['shortcode'] or str(merchant_id or '')
+            day = period_of(rec['timestamp']) if rec['timestamp'] is not None else UNKNOWN_DAY
+            key = (day, shortcode)
+            part = partitions.get(key)
+            if part is None:
+                part = partitions[key] = _Partition()
+            part.append(rid, created_at, cb_type, shortcode, rec)
+            buffered += 1
+        last_id = rows[-1][0]
+        if buffered >= FLUSH_ROWS:
+            flush()
+    flush()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export callbacks to partitioned Parquet/Arrow files')
+    parser.add_argument('--db', default=DB_PATH, help='path to callbacks.db')
+    parser.add_argument('--out', required=True, help='output directory')
+    parser.add_argument('--format', choices=('parquet', 'arrow'), default='parquet')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    try:
+        written = export(args.db, args.out, args.format)
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    print(f"Exported {written} callbacks to {args.out} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -7,10 +7,17 @@ from dotenv import load_dotenv
 import requests
 import base64
 import threading
+import time
 from config import CONSUMER_KEY, CONSUMER_SECRET, SHORTCODE, PASSKEY, CALLBACK_URL, C2B_CALLBACK_URL, SERVER_URL, LOGIN_URL, WEBSOCKET_URL, get
 import mpesa_client
 import importlib
 import config
+from utils.callback_parser import format_time, mask_phone, normalize_notification
+from utils.audit_log import describe_exchange, get_audit_log
+from utils.log import get_logger, setup_logging
+from utils.delivery import SeenIds, acknowledge, delivery_params, new_client_id
+from utils.wire_format import client_serializer, codec_params
+from utils.sales_stats import SalesAggregator, ALL_TILLS, format_kes
 try:
     from plyer import notification as plyer_notification
 except Exception:
@@ -18,6 +25,8 @@ except Exception:
 
 # Ensure .env loaded by config.py already
 
+log = get_logger('gui')
+
 # Modern Color Palette
 PRIMARY = "#2563eb"
 SECONDARY = "#1e40af"
@@ -195,21 +204,30 @@ class Dashboard(Card):
         stats_frame = tk.Frame(self.content, bg=SURFACE)
         stats_frame.pack(fill="x", padx=20, pady=(20, 0))
         
+        # Filled in by render_stats() from the manager's SalesAggregator
         stats = [
-            ("Total Sent", "KES 45,230", SUCCESS),
-            ("Today's Tx", "12", PRIMARY),
-            ("Success Rate", "98%", WARNING)
+            ("count", "Today's Payments", PRIMARY),
+            ("gross", "Gross Today", SUCCESS),
+            ("average", "Avg Ticket", WARNING),
+            ("per_minute", "Per Minute", SECONDARY)
         ]
         
-        for i, (label, value, color) in enumerate(stats):
-            col = i % 3
+        self.stat_labels = {}
+        for col, (key, label, color) in enumerate(stats):
             stat_card = tk.Frame(stats_frame, bg=SURFACE_VARIANT, relief="solid", bd=1)
             stat_card.grid(row=0, column=col, padx=10, pady=10, sticky="ew")
             
-            tk.Label(stat_card, text=value, font=(FONT_FAMILY, 24, "bold"), 
-                    fg=color, bg=SURFACE_VARIANT).pack(pady=10)
+            value = tk.Label(stat_card, text="–", font=(FONT_FAMILY, 24, "bold"), 
+                    fg=color, bg=SURFACE_VARIANT)
+            value.pack(pady=10)
             tk.Label(stat_card, text=label, font=(FONT_FAMILY, FONT_SIZE), 
                     fg=TEXT_SECONDARY, bg=SURFACE_VARIANT).pack()
+            self.stat_labels[key] = value
+
+        # Per-till breakdown
+        self.till_label = tk.Label(stats_frame, text="", font=("Consolas", FONT_SIZE), justify="left",
+                                   fg=TEXT_PRIMARY, bg=SURFACE, anchor="w")
+        self.till_label.grid(row=1, column=0, columnspan=len(stats), sticky="w", padx=10)
 
         # Simple history list
         hist_frame = tk.Frame(self.content, bg=SURFACE)
@@ -218,6 +236,20 @@ class Dashboard(Card):
         self.history_list = tk.Listbox(hist_frame, height=4, bg=SURFACE, bd=0, fg=TEXT_SECONDARY)
         self.history_list.pack(fill="x", pady=(6, 0))
 
+    def render_stats(self, snap):
+        """Show a SalesAggregator.snapshot()"""
+        total = snap.get(ALL_TILLS, {})
+        self.stat_labels['count'].config(text=f"{total.get('count', 0):,}")
+        self.stat_labels['gross'].config(text=format_kes(total.get('gross', 0.0)))
+        self.stat_labels['average'].config(text=format_kes(round(total.get('average', 0.0))))
+        self.stat_labels['per_minute'].config(text=f"{total.get('per_minute', 0.0):.1f}")
+        lines = []
+        for till in sorted(t for t in snap if t is not ALL_TILLS):
+            st = snap[till]
+            lines.append(f"Till {till or '?'}: {st['count']:,} payments, {format_kes(st['gross'])}, "
+                         f"avg {format_kes(round(st['average']))}, {st['per_minute']:.1f}/min")
+        self.till_label.config(text='\n'.join(lines))
+
     def add_history(self, text):
         try:
             t = datetime.now().strftime('%Y-%m-%d %H:%M:%S') + ' — ' + str(text)
@@ -789,6 +821,7 @@ class LoginPage(Card):
                         self.manager._server_url = server
                     except Exception:
                         pass
+                    self.manager.seed_stats(server, shop_codes)
                     messagebox.showinfo('Connected', 'Connected to server for notifications')
                 self.manager.after(0, on_success)
 
@@ -808,6 +841,10 @@ class MpesaManager(tk.Tk):
         self.geometry("1400x900")
         self.configure(bg=LIGHT)
         
+        # Today's sales per till: fed per payment, rendered once a second
+        self.stats = SalesAggregator()
+        self._stats_rendered = None
+        
         # Create UI
         self.sidebar = Sidebar(self, self.switch_page)
         self.create_pages()
@@ -815,6 +852,55 @@ class MpesaManager(tk.Tk):
         
         # Focus on phone entry
         self.after(100, lambda: self.pages["dashboard"].phone_entry.focus())
+        self.after(1000, self._tick_stats)
+
+    def _tick_stats(self):
+        try:
+            # Rates change as minutes pass even without new payments
+            state = (self.stats.version, int(time.time() // 60))
+            if state != self._stats_rendered:
+                self._stats_rendered = state
+                self.pages["dashboard"].render_stats(self.stats.snapshot())
+        except Exception as e:
+            log.warning("stats render error: %s", e)
+        self.after(1000, self._tick_stats)
+
+    def seed_stats(self, server_url, shop_codes=None):
+        """Seed today's sales from the server's transaction history (last 24h)"""
+        if not server_url:
+            return
+
+        def worker():
+            payments = []
+            cutoff = time.time() - 86400
+            before_id = None
+            url = server_url.rstrip('/') + '/api/transactions'
+            try:
+                with requests.Session() as session:
+                    while True:
+                        params = {'limit': 1000}
+                        if before_id:
+                            params['before_id'] = before_id
+                        if shop_codes:
+                            codes = shop_codes if isinstance(shop_codes, (list, tuple)) else [shop_codes]
+                            params['shortcode'] = ','.join(str(c) for c in codes)
+                        resp = session.get(url, params=params, timeout=10)
+                        resp.raise_for_status()
+                        data = resp.json()
+                        if not data:
+                            break
+                        for tx in data:
+                            payments.append((tx.get('shortcode'), tx.get('amount'), tx.get('timestamp')))
+                        oldest = data[-1].get('timestamp')
+                        ids = [tx.get('id') for tx in data if tx.get('id')]
+                        if len(data) < 1000 or not ids or (oldest and oldest < cutoff):
+                            break
+                        before_id = min(ids)
+            except Exception as e:
+                log.warning("could not load sales history: %s", e)
+            self.after(0, lambda: self.stats.seed(payments))
+
+        threading.Thread(target=worker, daemon=True).start()
     
     def create_pages(self):
         main_frame = tk.Frame(self, bg=LIGHT)
@@ -867,49 +953,23 @@ class MpesaManager(tk.Tk):
         except Exception:
             shortcode_to_use = None
         
-        # Add a quick log entry that Send was clicked
-        try:
-            log_path = os.path.join(os.path.dirname(__file__), 'stk_debug.log')
-            with open(log_path, 'a', encoding='utf-8') as f:
-                f.write(f"\n[{datetime.utcnow().isoformat()}] Send STK clicked - phone={phone} amount={amount} merchant={merchant_id}\n")
-        except Exception:
-            pass
+        # One audit record per push, written by the audit log's own thread
+        audit = {'event': 'stk_push', 'phone': phone, 'amount': amount,
+                 'merchant_id': merchant_id, 'shortcode': shortcode_to_use}
 
         # Send STK push in background to avoid blocking the GUI
         def worker():
+            started = time.perf_counter()
             try:
                 # Use the reusable client module to perform STK push
                 # If a shop shortcode is selected, pass it as the shortcode/PartyB
                 if shortcode_to_use:
-                    resp = mpesa_client.lipa_na_mpesa_online(phone, int(amount), merchant_id=merchant_id, shortcode=shortcode_to_use)
+                    resp = mpesa_client.lipa_na_mpesa_online(phone, int(amount), merchant_id=merchant_id,
+                                                             shortcode=shortcode_to_use, timings=audit)
                 else:
-                    resp = mpesa_client.lipa_na_mpesa_online(phone, int(amount), merchant_id=merchant_id)
-                print(resp)
+                    resp = mpesa_client.lipa_na_mpesa_online(phone, int(amount), merchant_id=merchant_id, timings=audit)
                 stk_resp_text = getattr(resp, 'text', '')
-
-                # Log request/response where possible
-                try:
-                    log_path = os.path.join(os.path.dirname(__file__), 'stk_debug.log')
-                    with open(log_path, 'a', encoding='utf-8') as f:
-                        f.write('\n--- STK PUSH RUN ' + datetime.utcnow().isoformat() + ' ---\n')
-                        # resp.request may be a PreparedRequest
-                        try:
-                            req = resp.request
-                            f.write('STK REQUEST URL: ' + str(getattr(req, 'url', '')) + '\n')
-                            f.write('STK REQ HEADERS: ' + str(getattr(req, 'headers', {})) + '\n')
-                            body = getattr(req, 'body', '')
-                            if isinstance(body, bytes):
-                                try:
-                                    body = body.decode('utf-8')
-                                except Exception:
-                                    body = str(body)
-                            f.write('STK REQ BODY: ' + str(body) + '\n')
-                        except Exception:
-                            pass
-                        f.write('STK STATUS: ' + str(getattr(resp, 'status_code', '')) + '\n')
-                        f.write('STK RESPONSE TEXT:\n' + stk_resp_text + '\n')
-                except Exception:
-                    pass
+                audit.update(describe_exchange(resp))
 
                 # Interpret response
                 data = None
@@ -926,6 +986,7 @@ class MpesaManager(tk.Tk):
                     except Exception:
                         pass
                     raise RuntimeError(f'STK request failed: {ex} - response: {stk_resp_text}')
+                audit['checkout_request_id'] = data.get('CheckoutRequestID')
 
                 # Update GUI on main thread
                 def on_success():
@@ -937,12 +998,16 @@ class MpesaManager(tk.Tk):
 
             except Exception as e:
                 err = str(e)
+                audit['error'] = err
                 def on_error(err=err):
                     dash = self.pages.get('dashboard')
                     if dash:
                         dash.add_history(f"STK Push error: {err}")
                     messagebox.showerror('STK Push Error', err)
                 self.after(0, on_error)
+            finally:
+                audit['total_ms'] = round((time.perf_counter() - started) * 1000, 1)
+                get_audit_log().write(audit)
 
         threading.Thread(target=worker, daemon=True).start()
         # Add to transactions table here in real implementation
@@ -962,6 +1027,12 @@ class MpesaManager(tk.Tk):
             messagebox.showerror('Missing Dependency', 'python-socketio is required. Install with: pip install python-socketio')
             return
 
+        # One client id per app run: after a reconnect the server redelivers
+        # whatever this app had not acknowledged yet
+        if not getattr(self, '_delivery_client_id', None):
+            self._delivery_client_id = new_client_id()
+            self._seen_ids = SeenIds()
+
         # If a client already exists, disconnect it first
         try:
             if hasattr(self, '_sio') and self._sio:
@@ -978,8 +1049,10 @@ class MpesaManager(tk.Tk):
             reconnection_attempts=5,
             reconnection_delay=1,
             reconnection_delay_max=5,
-            logger=True,
-            engineio_logger=True
+            logger=get_logger('socketio.client'),
+            engineio_logger=get_logger('engineio.client'),
+            # MessagePack notifications when the server agrees (?codec=msgpack)
+            serializer=client_serializer()
         )
 
         @self._sio.event
@@ -1034,32 +1107,33 @@ class MpesaManager(tk.Tk):
                 pass
 
         @self._sio.on('notification')
-        def on_notification(msg):
+        def on_notification(msg, ack=True):
             try:
-                # Normalize incoming payloads. Server may send a dict like
-                # {"type": "c2b_confirmation", "data": {...}} or a list
-                # like ["notification", { ... }]. Try to find the dict that
-                # contains the payload and continue.
+                # The server sends a compact record ({"id", "type", "shortcode",
+                # "amount", "phone", "receipt", ...}); older servers send
+                # {"type": ..., "data": {...}}, sometimes list-wrapped.
+                # normalize_notification understands all of them.
                 if isinstance(msg, list):
                     for it in msg:
                         if isinstance(it, dict):
                             msg = it
                             break
 
+                # Acknowledge receipt; a redelivered notification is not shown twice
+                if isinstance(msg, dict):
+                    first_time = self._seen_ids.add(msg.get('id'))
+                    if ack:
+                        acknowledge(self._sio, msg)
+                    if not first_time:
+                        return
+
                 # Proceed if we have a dict with a 'type' field
                 if isinstance(msg, dict) and 'type' in msg:
-                    d = msg.get('data', {}) or {}
+                    rec = normalize_notification(msg)
 
-                    # OPTIONAL: Filter notifications by shop code if configured. Many C2B
-                    # callbacks include 'BusinessShortCode' or 'ShortCode' to indicate the till.
+                    # OPTIONAL: Filter notifications by shop code if configured
                     try:
-                        notification_shop = None
-                        # Common places where the till/shortcode appears
-                        if isinstance(d, dict):
-                            notification_shop = d.get('BusinessShortCode') or d.get('ShortCode') or d.get('Shortcode')
-                        # Also check top-level payload keys as fallback
-                        if not notification_shop and isinstance(msg.get('data'), dict):
-                            notification_shop = msg.get('data').get('BusinessShortCode') or msg.get('data').get('ShortCode')
+                        notification_shop = rec['shortcode']
 
                         # If app has a selected shop and notification identifies a shop but it doesn't match, ignore
                         if hasattr(self, '_current_shop_codes') and self._current_shop_codes and notification_shop:
@@ -1074,93 +1148,23 @@ class MpesaManager(tk.Tk):
                     except Exception:
                         pass
 
-                    # Default display values
-                    ttime = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    amount = ''
-                    phone = ''
-                    status = 'Received'
-                    txid = ''
-
-                    # Process different callback types
-                    callback_type = msg.get('type', '')
-                    
-                    if callback_type == 'c2b_confirmation':
-                        # C2B callback structure
-                        try:
-                            # Extract common fields
-                            txid = d.get('TransID', '')
-                            amount = d.get('TransAmount', '')
-                            phone = d.get('MSISDN', '')
-                            
-                            # Format time from TransTime (YYYYMMDDHHmmss)
-                            trans_time = d.get('TransTime', '')
-                            if trans_time and len(trans_time) >= 14:
-                                ttime = datetime.strptime(trans_time, '%Y%m%d%H%M%S').strftime('%Y-%m-%d %H:%M:%S')
-                            
-                            # Create status from transaction info
-                            name = d.get('FirstName', '')
-                            ref = d.get('BillRefNumber', '')
-                            status = f"✅ {d.get('TransactionType', '')} | Ref: {ref}"
-                            if name:
-                                status += f" | {name}"
-                        except Exception:
-                            pass
-                            
-                    elif 'stkCallback' in str(d):
-                        # STK callback structure
-                        try:
-                            stk = d.get('Body', {}).get('stkCallback') if isinstance(d, dict) else None
-                            if stk:
-                                # Result fields
-                                res_desc = stk.get('ResultDesc') or ''
-                                res_code = stk.get('ResultCode')
-                                status = f"{'✅' if res_code == 0 else '❌'} {res_desc}" if res_desc else (f"Code {res_code}" if res_code is not None else status)
-
-                                # CheckoutRequestID or MerchantRequestID
-                                txid = stk.get('MpesaReceiptNumber') or stk.get('CheckoutRequestID') or stk.get('MerchantRequestID') or ''
-
-                                # CallbackMetadata contains Item list
-                                cb = stk.get('CallbackMetadata') or stk.get('Callback') or {}
-                                items = cb.get('Item') if isinstance(cb, dict) else None
-                                if not items and isinstance(cb, list):
-                                    items = cb
-
-                                if items and isinstance(items, list):
-                                    for it in items:
-                                        name = it.get('Name') or it.get('name')
-                                        val = it.get('Value')
-                                        if not name:
-                                            continue
-                                        if name.lower() == 'amount':
-                                            amount = str(val)
-                                        elif name.lower() in ('phonenumber', 'phone'):
-                                            phone = str(val)
-                                        elif name.lower() in ('mpesareceiptnumber',):
-                                            txid = val or txid
-                                        elif name.lower() in ('transactiondate',):
-                                            try:
-                                                s = str(val)
-                                                if len(s) >= 14:
-                                                    ttime = datetime.strptime(s[:14], '%Y%m%d%H%M%S').strftime('%Y-%m-%d %H:%M:%S')
-                                            except Exception:
-                                                pass
-                        except Exception:
-                            pass
-
-                    # Add currency symbol if amount is present
-                    if amount and not amount.startswith('KES'):
-                        amount = f"KES {amount}"
-
-                    # Mask phone number for privacy
-                    if phone and len(phone) > 4:
-                        masked_digits = '*' * (len(phone) - 4)
-                        phone = masked_digits + phone[-4:] 
+                    ttime = format_time(rec['timestamp'])
+                    amount = f"KES {rec['amount']:.2f}" if rec['amount'] is not None else ''
+                    # Mask phone number for privacy (compact messages arrive masked already)
+                    phone = mask_phone(rec['phone'])
+                    status = rec['status'] or 'Received'
+                    txid = rec['transaction_id']
+                    callback_type = rec['type']
 
                     # Add to transactions table
                     tx_page = self.pages.get('transactions')
                     if tx_page:
                         tx_page.add_transaction(ttime, amount, phone, status, txid)
 
+                    # Count it in today's sales (O(1); the dashboard re-renders on a timer)
+                    if rec['ok']:
+                        self.stats.add(rec['shortcode'], rec['amount'], rec['timestamp'])
+
                     # Non-blocking popup with useful info
                     def show_popup():
                         try:
@@ -1169,12 +1173,12 @@ class MpesaManager(tk.Tk):
 
                             if callback_type == 'c2b_confirmation':
                                 lines.extend([
-                                    f"Transaction Type: {d.get('TransactionType', 'C2B')}",
+                                    f"Status: {status}",
                                     f"Amount: {amount}",
-                                    f"Reference: {d.get('BillRefNumber', '')}",
+                                    f"Reference: {rec['bill_ref']}",
                                     f"Phone: {phone}",
                                     f"Transaction ID: {txid}",
-                                    f"Name: {d.get('FirstName', '')} {d.get('LastName', '')}"
+                                    f"Name: {rec['name']}"
                                 ])
                             else:
                                 lines.extend([
@@ -1293,8 +1297,18 @@ class MpesaManager(tk.Tk):
                         pass
                 self.after(0, show_error)
 
+        @self._sio.on('notification_batch')
+        def on_notification_batch(msgs):
+            # A burst in one packet (?batch=1): handle each entry, acknowledge them together
+            msgs = msgs if isinstance(msgs, list) else []
+            for msg in msgs:
+                on_notification(msg, ack=False)
+            acknowledge(self._sio, *msgs)
+
         # Build connect URL (socketio client will add /socket.io if needed)
-        connect_params = {}
+        connect_params = delivery_params(self._delivery_client_id)
+        connect_params.update(codec_params())
+        connect_params['batch'] = '1'
         if token:
             connect_params['token'] = token
         if merchant_id:
@@ -1330,5 +1344,6 @@ class MpesaManager(tk.Tk):
         self._sio_thread.start()
 
 if __name__ == "__main__":
+    setup_logging()
     app = MpesaManager()
     app.mainloop()
\ No newline at end of file
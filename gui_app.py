@@ -1,7 +1,7 @@
 import tkinter as tk
 import threading
+import time
 from datetime import datetime
-import os
 import socketio
 import sys
 import ctypes
@@ -17,6 +17,11 @@ from gui import (
     LIGHT, PRIMARY
 )
 import mpesa_client
+from utils.callback_parser import format_time, mask_phone, normalize_notification
+from utils.audit_log import describe_exchange, get_audit_log
+from utils.log import get_logger, setup_logging
+from utils.delivery import SeenIds, acknowledge, delivery_params, new_client_id
+from utils.wire_format import client_serializer, codec_params
 from config import SERVER_URL, WEBSOCKET_URL, LOGIN_URL
 
 class MpesaManager(tk.Tk):
@@ -85,47 +90,24 @@ class MpesaManager(tk.Tk):
         except Exception:
             shortcode_to_use = None
 
-        # Add quick log entry
-        try:
-            log_path = os.path.join(os.path.dirname(__file__), 'stk_debug.log')
-            with open(log_path, 'a', encoding='utf-8') as f:
-                f.write(f"\n[{datetime.utcnow().isoformat()}] Send STK clicked - phone={phone} amount={amount} merchant={merchant_id}\n")
-        except Exception:
-            pass
+        # One audit record per push, written by the audit log's own thread
+        audit = {'event': 'stk_push', 'phone': phone, 'amount': amount,
+                 'merchant_id': merchant_id, 'shortcode': shortcode_to_use}
 
         def worker():
+            started = time.perf_counter()
             try:
                 # Use shop shortcode if available
                 if shortcode_to_use:
                     resp = mpesa_client.lipa_na_mpesa_online(phone, int(amount), 
                                                            merchant_id=merchant_id,
-                                                           shortcode=shortcode_to_use)
+                                                           shortcode=shortcode_to_use,
+                                                           timings=audit)
                 else:
                     resp = mpesa_client.lipa_na_mpesa_online(phone, int(amount),
-                                                           merchant_id=merchant_id)
-
-                # Log request/response
-                try:
-                    log_path = os.path.join(os.path.dirname(__file__), 'stk_debug.log')
-                    with open(log_path, 'a', encoding='utf-8') as f:
-                        f.write('\n--- STK PUSH RUN ' + datetime.utcnow().isoformat() + ' ---\n')
-                        try:
-                            req = resp.request
-                            f.write('STK REQUEST URL: ' + str(getattr(req, 'url', '')) + '\n')
-                            f.write('STK REQ HEADERS: ' + str(getattr(req, 'headers', {})) + '\n')
-                            body = getattr(req, 'body', '')
-                            if isinstance(body, bytes):
-                                try:
-                                    body = body.decode('utf-8')
-                                except Exception:
-                                    body = str(body)
-                            f.write('STK REQ BODY: ' + str(body) + '\n')
-                        except Exception:
-                            pass
-                        f.write('STK STATUS: ' + str(getattr(resp, 'status_code', '')) + '\n')
-                        f.write('STK RESPONSE TEXT:\n' + getattr(resp, 'text', '') + '\n')
-                except Exception:
-                    pass
+                                                           merchant_id=merchant_id,
+                                                           timings=audit)
+                audit.update(describe_exchange(resp))
 
                 # Process response
                 data = None
@@ -142,6 +124,7 @@ class MpesaManager(tk.Tk):
                     except Exception:
                         pass
                     raise RuntimeError(f'STK request failed: {ex} - response: {getattr(resp, "text", "")}')
+                audit['checkout_request_id'] = data.get('CheckoutRequestID')
 
                 def on_success():
                     dash = self.pages.get('dashboard')
@@ -152,12 +135,16 @@ class MpesaManager(tk.Tk):
 
             except Exception as e:
                 err = str(e)
+                audit['error'] = err
                 def on_error(err=err):
                     dash = self.pages.get('dashboard')
                     if dash:
                         dash.add_history(f"STK Push error: {err}")
                     messagebox.showerror('STK Push Error', err)
                 self.after(0, on_error)
+            finally:
+                audit['total_ms'] = round((time.perf_counter() - started) * 1000, 1)
+                get_audit_log().write(audit)
 
         threading.Thread(target=worker, daemon=True).start()
 
@@ -169,6 +156,12 @@ class MpesaManager(tk.Tk):
             messagebox.showerror('Missing Dependency', 'python-socketio is required')
             return
 
+        # One client id per app run: after a reconnect the server redelivers
+        # whatever this app had not acknowledged yet
+        if not getattr(self, '_delivery_client_id', None):
+            self._delivery_client_id = new_client_id()
+            self._seen_ids = SeenIds()
+
         # Clean up existing client
         try:
             if hasattr(self, '_sio') and self._sio:
@@ -185,8 +178,10 @@ class MpesaManager(tk.Tk):
             reconnection_attempts=5,
             reconnection_delay=1,
             reconnection_delay_max=5,
-            logger=True,
-            engineio_logger=True
+            logger=get_logger('socketio.client'),
+            engineio_logger=get_logger('engineio.client'),
+            # MessagePack notifications when the server agrees (?codec=msgpack)
+            serializer=client_serializer()
         )
 
         @self._sio.event
@@ -234,25 +229,30 @@ class MpesaManager(tk.Tk):
                 pass
 
         @self._sio.on('notification')
-        def on_notification(msg):
+        def on_notification(msg, ack=True):
             try:
-                # Normalize payload
+                # Compact records from the server, or the older {"type", "data"}
+                # envelope; normalize_notification handles both
                 if isinstance(msg, list):
                     for it in msg:
                         if isinstance(it, dict):
                             msg = it
                             break
 
+                # Acknowledge receipt; a redelivered notification is not shown twice
+                if isinstance(msg, dict):
+                    first_time = self._seen_ids.add(msg.get('id'))
+                    if ack:
+                        acknowledge(self._sio, msg)
+                    if not first_time:
+                        return
+
                 if isinstance(msg, dict) and 'type' in msg:
-                    d = msg.get('data', {}) or {}
+                    rec = normalize_notification(msg)
 
                     # Filter by shop code
                     try:
-                        notification_shop = None
-                        if isinstance(d, dict):
-                            notification_shop = d.get('BusinessShortCode') or d.get('ShortCode') or d.get('Shortcode')
-                        if not notification_shop and isinstance(msg.get('data'), dict):
-                            notification_shop = msg.get('data').get('BusinessShortCode') or msg.get('data').get('ShortCode')
+                        notification_shop = rec['shortcode']
 
                         if hasattr(self, '_current_shop_codes') and self._current_shop_codes and notification_shop:
                             try:
@@ -265,75 +265,12 @@ class MpesaManager(tk.Tk):
                         pass
 
                     # Process notification
-                    ttime = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    amount = ''
-                    phone = ''
-                    status = 'Received'
-                    txid = ''
-                    
-                    callback_type = msg.get('type', '')
-                    
-                    if callback_type == 'c2b_confirmation':
-                        try:
-                            txid = d.get('TransID', '')
-                            amount = d.get('TransAmount', '')
-                            phone = d.get('MSISDN', '')
-                            
-                            trans_time = d.get('TransTime', '')
-                            if trans_time and len(trans_time) >= 14:
-                                ttime = datetime.strptime(trans_time, '%Y%m%d%H%M%S').strftime('%Y-%m-%d %H:%M:%S')
-                            
-                            name = d.get('FirstName', '')
-                            ref = d.get('BillRefNumber', '')
-                            status = f"✅ {d.get('TransactionType', '')} | Ref: {ref}"
-                            if name:
-                                status += f" | {name}"
-                        except Exception:
-                            pass
-                            
-                    elif 'stkCallback' in str(d):
-                        try:
-                            stk = d.get('Body', {}).get('stkCallback') if isinstance(d, dict) else None
-                            if stk:
-                                res_desc = stk.get('ResultDesc') or ''
-                                res_code = stk.get('ResultCode')
-                                status = f"{'✅' if res_code == 0 else '❌'} {res_desc}" if res_desc else (f"Code {res_code}" if res_code is not None else status)
-
-                                txid = stk.get('MpesaReceiptNumber') or stk.get('CheckoutRequestID') or stk.get('MerchantRequestID') or ''
-
-                                cb = stk.get('CallbackMetadata') or stk.get('Callback') or {}
-                                items = cb.get('Item') if isinstance(cb, dict) else None
-                                if not items and isinstance(cb, list):
-                                    items = cb
-
-                                if items and isinstance(items, list):
-                                    for it in items:
-                                        name = it.get('Name') or it.get('name')
-                                        val = it.get('Value')
-                                        if not name:
-                                            continue
-                                        if name.lower() == 'amount':
-                                            amount = str(val)
-                                        elif name.lower() in ('phonenumber', 'phone'):
-                                            phone = str(val)
-                                        elif name.lower() in ('mpesareceiptnumber',):
-                                            txid = val or txid
-                                        elif name.lower() in ('transactiondate',):
-                                            try:
-                                                s = str(val)
-                                                if len(s) >= 14:
-                                                    ttime = datetime.strptime(s[:14], '%Y%m%d%H%M%S').strftime('%Y-%m-%d %H:%M:%S')
-                                            except Exception:
-                                                pass
-                        except Exception:
-                            pass
-
-                    if amount and not amount.startswith('KES'):
-                        amount = f"KES {amount}"
-
-                    if phone and len(phone) > 4:
-                        masked_digits = '*' * (len(phone) - 4)
-                        phone = masked_digits + phone[-4:] 
+                    ttime = format_time(rec['timestamp'])
+                    amount = f"KES {rec['amount']:.2f}" if rec['amount'] is not None else ''
+                    phone = mask_phone(rec['phone'])
+                    status = rec['status'] or 'Received'
+                    txid = rec['transaction_id']
+                    callback_type = rec['type']
 
                     # Update transactions
                     tx_page = self.pages.get('transactions')
@@ -348,12 +285,12 @@ class MpesaManager(tk.Tk):
 
                             if callback_type == 'c2b_confirmation':
                                 lines.extend([
-                                    f"Transaction Type: {d.get('TransactionType', 'C2B')}",
+                                    f"Status: {status}",
                                     f"Amount: {amount}",
-                                    f"Reference: {d.get('BillRefNumber', '')}",
+                                    f"Reference: {rec['bill_ref']}",
                                     f"Phone: {phone}",
                                     f"Transaction ID: {txid}",
-                                    f"Name: {d.get('FirstName', '')} {d.get('LastName', '')}"
+                                    f"Name: {rec['name']}"
                                 ])
                             else:
                                 lines.extend([
@@ -464,8 +401,18 @@ class MpesaManager(tk.Tk):
                         pass
                 self.after(0, show_error)
 
+        @self._sio.on('notification_batch')
+        def on_notification_batch(msgs):
+            # A burst in one packet (?batch=1): handle each entry, acknowledge them together
+            msgs = msgs if isinstance(msgs, list) else []
+            for msg in msgs:
+                on_notification(msg, ack=False)
+            acknowledge(self._sio, *msgs)
+
         # Connect to server
-        connect_params = {}
+        connect_params = delivery_params(self._delivery_client_id)
+        connect_params.update(codec_params())
+        connect_params['batch'] = '1'
         if token:
             connect_params['token'] = token
         if merchant_id:
@@ -499,6 +446,7 @@ class MpesaManager(tk.Tk):
         self._sio_thread.start()
 
 def main():
+    setup_logging()
     app = MpesaManager()
     app.mainloop()
 
@@ -1,22 +1,36 @@
 import sys
 import threading
+import time
 import socketio
+from collections import deque
 from datetime import datetime
 
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QLabel, QLineEdit, QPushButton, QComboBox, QMessageBox, QTextEdit, QStackedWidget,
-    QTableWidget, QTableWidgetItem, QHeaderView, QFormLayout, QFrame,
-    QGroupBox, QScrollArea, QSizePolicy, QGraphicsDropShadowEffect
+    QLabel, QLineEdit, QPushButton, QComboBox, QMessageBox, QPlainTextEdit, QStackedWidget,
+    QTableView, QHeaderView, QFormLayout, QGridLayout, QFrame,
+    QGroupBox, QScrollArea, QSizePolicy
 )
-from PyQt6.QtCore import QObject, pyqtSignal, Qt, QTimer, QPropertyAnimation, QEasingCurve, QRect
-from PyQt6.QtGui import QFont, QPalette, QColor, QIcon, QPixmap, QGuiApplication, QScreen
+from PyQt6.QtCore import QObject, pyqtSignal, Qt, QTimer, QThreadPool, QEasingCurve, QRect
+from PyQt6.QtGui import QFont, QPalette, QIcon, QPixmap, QScreen
 
 import mpesa_client
 from config import SERVER_URL, WEBSOCKET_URL, SHOP_MAP
-import ctypes
+from ui.models.transactions_model import TransactionsTableModel
+from ui.models.frame_batcher import FrameBatcher
+from ui.models.transaction_index import TransactionIndex, TransactionQuery, parse_query
+from ui.models.local_cache import LocalTransactionCache, shop_key, save_last_context, load_last_context
+from ui.network.history_loader import HistoryLoader
+from ui.widgets.notification_widget import NotificationManager, NotificationCoalescer
+from utils.callback_parser import mask_phone, normalize_notification
+from utils.log import get_logger, setup_logging
+from utils.delivery import SeenIds, acknowledge, delivery_params, new_client_id
+from utils.wire_format import client_serializer, codec_params
+from utils.sales_stats import SalesAggregator, ALL_TILLS, format_kes
 import platform
 
+log = get_logger('gui')
+
 # Optional Windows native toast notifier (for sound and system toast)
 try:
     from winotify import Notification, audio
@@ -24,294 +38,8 @@ try:
 except Exception:
     _HAS_WINOTIFY = False
 
-
-class MultiDesktopNotificationWindow(QWidget):
-    """A notification that appears on ALL virtual desktops and ALL screens"""
-    
-    def __init__(self, title: str, message: str, parent=None):
-        super().__init__(parent)
-        
-        # ULTRA-FORCEFUL window flags for multi-desktop support
-        self.setWindowFlags(
-            Qt.WindowType.WindowStaysOnTopHint |          # Always on top
-            Qt.WindowType.FramelessWindowHint |           # No title bar
-            Qt.WindowType.Tool |                          # No taskbar entry
-            Qt.WindowType.X11BypassWindowManagerHint |    # Bypass window manager (Linux)
-            Qt.WindowType.WindowDoesNotAcceptFocus |      # Don't steal focus
-            Qt.WindowType.MSWindowsFixedSizeDialogHint    # Better multi-desktop support on Windows
-        )
-        
-        # Make it truly top-most and visible on all virtual desktops
-        self.setAttribute(Qt.WidgetAttribute.WA_AlwaysStackOnTop, True)
-        self.setAttribute(Qt.WidgetAttribute.WA_ShowWithoutActivating, True)
-        self.setAttribute(Qt.WidgetAttribute.WA_TranslucentBackground, True)
-
-        # Create notification cards for ALL screens
-        self.notification_cards = []
-        self.create_notifications_for_all_screens(title, message)
-        
-        # Auto-close timer
-        self.auto_close_timer = QTimer()
-        self.auto_close_timer.setSingleShot(True)
-        self.auto_close_timer.timeout.connect(self.animate_out)
-        self.auto_close_timer.start(15000)  # 15 seconds
-        
-        # Force to top immediately on all desktops
-        QTimer.singleShot(100, self.force_to_all_desktops)
-        
-    def create_notifications_for_all_screens(self, title: str, message: str):
-        """Create notification cards for EVERY screen and virtual desktop"""
-        screens = QGuiApplication.screens()
-        print(f"[MultiDesktop] Creating notifications for {len(screens)} screens")
-        
-        for screen in screens:
-            # Create a notification card for each screen
-            card = PaymentNotificationCard(title, message, self)
-            card.dismissed.connect(self.on_card_dismissed)
-            self.notification_cards.append(card)
-            
-            # Position card at center of this specific screen
-            self.center_notification_on_screen(card, screen)
-            
-    def center_notification_on_screen(self, card, screen):
-        """Position the notification card at bottom-right of the given screen (like a toast)"""
-        geo = screen.geometry()
-        margin = 32
-        x = geo.x() + geo.width() - card.width() - margin
-        y = geo.y() + geo.height() - card.height() - margin
-
-        card.move(x, y)
-        card.show()
-        
-    def showEvent(self, event):
-        """Animate in when shown"""
-        super().showEvent(event)
-        self.force_to_all_desktops()
-        for card in self.notification_cards:
-            card.animate_in()
-        
-    def force_to_all_desktops(self):
-        """Force the window to be visible on ALL virtual desktops using platform-specific methods"""
-        try:
-            if platform.system() == 'Windows':
-                self._force_windows_all_desktops()
-            elif platform.system() == 'Linux':
-                self._force_linux_all_desktops()
-            else:  # macOS and others
-                self._force_generic_all_desktops()
-                
-            # Force all cards to be visible
-            for card in self.notification_cards:
-                card.raise_()
-                card.activateWindow()
-                card.show()
-                
-        except Exception as e:
-            print(f"[MultiDesktop] Error forcing to all desktops: {e}")
-            
-    def _force_windows_all_desktops(self):
-        """Windows-specific: Make window visible on all virtual desktops"""
-        try:
-            # Try to use Windows API to show on all virtual desktops
-            HWND_TOPMOST = -1
-            SWP_NOSIZE = 0x0001
-            SWP_NOMOVE = 0x0002
-            SWP_SHOWWINDOW = 0x0040
-            flags = SWP_NOMOVE | SWP_NOSIZE | SWP_SHOWWINDOW
-            
-            for card in self.notification_cards:
-                hwnd = int(card.winId())
-                # Set as topmost
-                ctypes.windll.user32.SetWindowPos(hwnd, HWND_TOPMOST, 0, 0, 0, 0, flags)
-                # Additional forceful methods
-                ctypes.windll.user32.BringWindowToTop(hwnd)
-                ctypes.windll.user32.SetForegroundWindow(hwnd)
-                
-                # Try to make it visible on all virtual desktops (Windows 10+)
-                try:
-                    # This is the key for virtual desktop support
-                    GWL_EXSTYLE = -20
-                    WS_EX_TOOLWINDOW = 0x00000080
-                    WS_EX_NOACTIVATE = 0x08000000
-                    
-                    # Get current style
-                    current_style = ctypes.windll.user32.GetWindowLongW(hwnd, GWL_EXSTYLE)
-                    # Add toolwindow and noactivate flags for better multi-desktop behavior
-                    new_style = current_style | WS_EX_TOOLWINDOW | WS_EX_NOACTIVATE
-                    ctypes.windll.user32.SetWindowLongW(hwnd, GWL_EXSTYLE, new_style)
-                    
-                except Exception as e:
-                    print(f"[Windows Virtual Desktop] Fallback: {e}")
-                    
-        except Exception as e:
-            print(f"[Windows All Desktops Error] {e}")
-            
-    def _force_linux_all_desktops(self):
-        """Linux-specific: Make window visible on all workspaces"""
-        try:
-            for card in self.notification_cards:
-                hwnd = int(card.winId())
-                # Use xdotool to set on all workspaces
-                import subprocess
-                wid = hex(hwnd)
-                # Try to set sticky flag (visible on all workspaces)
-                subprocess.run(['xdotool', 'set_window', '--classname', 'MPesaNotification', wid], timeout=2)
-                subprocess.run(['wmctrl', '-i', '-r', wid, '-b', 'add,sticky'], timeout=2)
-        except:
-            # Fallback - just ensure visibility
-            for card in self.notification_cards:
-                card.raise_()
-                card.show()
-            
-    def _force_generic_all_desktops(self):
-        """Generic method for other platforms"""
-        for card in self.notification_cards:
-            card.raise_()
-            card.activateWindow()
-            card.show()
-            
-    def on_card_dismissed(self):
-        """When any card is dismissed, dismiss all"""
-        self.animate_out()
-        
-    def animate_out(self):
-        """Animate out and close all cards"""
-        for card in self.notification_cards:
-            card.animate_out()
-        QTimer.singleShot(500, self.close_all)
-        
-    def close_all(self):
-        """Close all notification cards"""
-        for card in self.notification_cards:
-            card.close()
-        self.close()
-
-
-class PaymentNotificationCard(QWidget):
-    """A toast-style payment notification card (small, bottom-right, rounded, shadowed)"""
-    dismissed = pyqtSignal()
-
-    def __init__(self, title: str, message: str, parent=None):
-        super().__init__(parent)
-        self.setWindowFlags(
-            Qt.WindowType.WindowStaysOnTopHint |
-            Qt.WindowType.FramelessWindowHint |
-            Qt.WindowType.Tool
-        )
-        self.setFixedSize(340, 110)
-        self.setStyleSheet("""
-            QWidget {
-                background: rgba(30, 41, 59, 0.96);
-                border-radius: 16px;
-                border: 1.5px solid #2563eb;
-                color: #f1f5f9;
-                font-family: 'Segoe UI', 'Arial', sans-serif;
-            }
-        """)
-        layout = QVBoxLayout()
-        layout.setContentsMargins(18, 14, 18, 14)
-        layout.setSpacing(6)
-        
-        # Header: icon and title
-        header_layout = QHBoxLayout()
-        
-        icon_label = QLabel("💰")
-        icon_label.setStyleSheet("font-size: 22px; margin-right: 8px;")
-        header_layout.addWidget(icon_label)
-        
-        title_label = QLabel(title)
-        title_label.setStyleSheet("font-size: 15px; font-weight: 700; color: #f1f5f9; margin: 0px;")
-        header_layout.addWidget(title_label)
-        header_layout.addStretch()
-        
-        close_btn = QPushButton("×")
-        close_btn.setFixedSize(22, 22)
-        close_btn.setStyleSheet("""
-            QPushButton {
-                background-color: transparent;
-                color: #f1f5f9;
-                border: none;
-                border-radius: 11px;
-                font-size: 15px;
-                font-weight: bold;
-            }
-            QPushButton:hover {
-                background-color: #ef4444;
-                color: white;
-            }
-        """)
-        close_btn.clicked.connect(self.on_dismiss)
-        close_btn.setCursor(Qt.CursorShape.PointingHandCursor)
-        header_layout.addWidget(close_btn)
-        
-        layout.addLayout(header_layout)
-        
-        # Message content
-        message_label = QLabel(message)
-        message_label.setStyleSheet("font-size: 13px; color: #e0e7ef; line-height: 1.5; margin-top: 2px;")
-        message_label.setWordWrap(True)
-        layout.addWidget(message_label)
-        
-        # Timestamp
-        timestamp = QLabel(datetime.now().strftime("%H:%M:%S"))
-        timestamp.setStyleSheet("font-size: 11px; color: #a5b4fc; font-style: italic; margin-top: 2px;")
-        layout.addWidget(timestamp)
-        
-        self.setLayout(layout)
-        
-        # Fade in effect
-        self.setWindowOpacity(0.0)
-        self.fade_anim = QPropertyAnimation(self, b"windowOpacity")
-        self.fade_anim.setDuration(350)
-        self.fade_anim.setStartValue(0.0)
-        self.fade_anim.setEndValue(1.0)
-        self.fade_anim.start()
-        
-        # Add drop shadow effect
-        shadow = QGraphicsDropShadowEffect(self)
-        shadow.setBlurRadius(20)
-        shadow.setXOffset(0)
-        shadow.setYOffset(4)
-        shadow.setColor(QColor(31, 38, 135, 90))
-        self.setGraphicsEffect(shadow)
-        
-        # Play sound if available
-        self._play_notification_sound()
-        
-    def _play_notification_sound(self):
-        """Play a notification sound on ALL platforms"""
-        try:
-            if platform.system() == 'Windows':
-                import winsound
-                winsound.PlaySound("SystemExclamation", winsound.SND_ALIAS)
-            elif platform.system() == 'Darwin':  # macOS
-                import os
-                os.system('afplay /System/Library/Sounds/Glass.aiff &')
-            elif platform.system() == 'Linux':
-                import os
-                os.system('paplay /usr/share/sounds/freedesktop/stereo/message.oga &')
-        except Exception as e:
-            print(f"[Toast] Sound error: {e}")
-            
-    def setup_animation(self):
-        pass  # No longer needed for toast style
-    
-    def animate_in(self):
-        # Fade in (already handled in __init__)
-        pass
-    
-    def animate_out(self):
-        """Fade out and close"""
-        fade = QPropertyAnimation(self, b"windowOpacity")
-        fade.setDuration(300)
-        fade.setStartValue(1.0)
-        fade.setEndValue(0.0)
-        fade.finished.connect(self.close)
-        fade.start()
-        
-    def on_dismiss(self):
-        self.animate_out()
-        QTimer.singleShot(400, self.dismissed.emit)
+# Dashboard activity lines kept on screen; older ones are moved to the local cache
+HISTORY_CAPACITY = 500
 
 
 class ModernButton(QPushButton):
@@ -559,6 +287,8 @@ class WSClientSignals(QObject):
     disconnected = pyqtSignal()
     error = pyqtSignal(str)
     notification = pyqtSignal(object)
+    # A list of notifications delivered together (?batch=1)
+    notification_batch = pyqtSignal(object)
 
 
 class WSClient(QObject):
@@ -570,6 +300,9 @@ class WSClient(QObject):
         self.token = token
         self.merchant_id = merchant_id
         self.shop_codes = shop_codes
+        # Stable across reconnects so the server can redeliver what we missed
+        self.client_id = new_client_id()
+        self._seen = SeenIds()
         self._sio = None
         self._thread = None
 
@@ -579,7 +312,9 @@ class WSClient(QObject):
 
     def _run(self):
         try:
-            self._sio = socketio.Client(reconnection=True, logger=False, engineio_logger=False)
+            self._sio = socketio.Client(reconnection=True, logger=get_logger('socketio.client'),
+                                        engineio_logger=get_logger('engineio.client'),
+                                        serializer=client_serializer())
 
             @self._sio.event
             def connect():
@@ -618,15 +353,32 @@ class WSClient(QObject):
             @self._sio.on('notification')
             def on_notification(msg):
                 try:
-                    print(f"[WSClient Debug] Received notification from server: {msg}")
+                    log.debug("notification %s", msg.get('id') if isinstance(msg, dict) else type(msg).__name__)
+                    if isinstance(msg, dict) and not self._seen.add(msg.get('id')):
+                        # Redelivery of one we already showed; our ack got lost
+                        acknowledge(self._sio, msg)
+                        return
                     self.signals.notification.emit(msg)
-                    print("[WSClient Debug] Notification emitted to GUI")
-                except Exception as e:
-                    print(f"[WSClient Error] Failed to handle notification: {e}")
-                    import traceback
-                    print(traceback.format_exc())
+                    acknowledge(self._sio, msg)
+                except Exception:
+                    log.exception("failed to handle notification")
+
+            @self._sio.on('notification_batch')
+            def on_notification_batch(msgs):
+                try:
+                    msgs = [m for m in (msgs or []) if isinstance(m, dict)]
+                    log.debug("batch of %d notifications", len(msgs))
+                    # Redeliveries of ones already shown are only acknowledged again
+                    fresh = [m for m in msgs if self._seen.add(m.get('id'))]
+                    if fresh:
+                        self.signals.notification_batch.emit(fresh)
+                    acknowledge(self._sio, *msgs)
+                except Exception:
+                    log.exception("failed to handle notification batch")
 
-            connect_params = {}
+            connect_params = delivery_params(self.client_id)
+            connect_params.update(codec_params())
+            connect_params['batch'] = '1'
             if self.token:
                 connect_params['token'] = self.token
             if self.merchant_id:
@@ -800,11 +552,23 @@ class DashboardWidget(QWidget):
         super().__init__(parent)
         self._merchant_id = None
         self._shop_codes = None
+        # History lines are merged into one document edit per frame tick
+        self._history_batch = FrameBatcher(self._flush_history, parent=self)
+        # Ring buffer of (timestamp, line) mirroring what the widget shows
+        self._recent = deque(maxlen=HISTORY_CAPACITY)
+        self._activity_cache = None
+        # Sales stats are read on a timer, never per payment
+        self._stats = None
+        self._stats_rendered = None
+        self._stats_timer = QTimer(self)
+        self._stats_timer.setInterval(1000)
+        self._stats_timer.timeout.connect(self._render_stats)
         self._build_ui()
 
     def set_context(self, merchant_id, shop_codes):
         self._merchant_id = merchant_id
         self._shop_codes = shop_codes
+        self._activity_cache = None
 
     def _build_ui(self):
         layout = QVBoxLayout()
@@ -858,6 +622,31 @@ class DashboardWidget(QWidget):
         stk_layout.addWidget(self.send_btn)
         
         left_column.addWidget(stk_card)
+
+        # Today's sales card
+        stats_card = CardWidget("Today's Sales")
+        stats_layout = stats_card.layout()
+
+        totals = QGridLayout()
+        totals.setHorizontalSpacing(20)
+        self._stat_values = {}
+        for col, (key, label) in enumerate((('count', 'Payments'), ('gross', 'Gross'),
+                                            ('average', 'Avg ticket'), ('per_minute', 'Per minute'))):
+            value = QLabel("–")
+            value.setStyleSheet("font-size: 20px; font-weight: 700; color: #2563eb;")
+            caption = QLabel(label)
+            caption.setStyleSheet("color: #64748b; font-size: 12px;")
+            totals.addWidget(value, 0, col)
+            totals.addWidget(caption, 1, col)
+            self._stat_values[key] = value
+        stats_layout.addLayout(totals)
+
+        self.till_stats = QLabel("")
+        self.till_stats.setStyleSheet("font-family: 'Monospace'; font-size: 12px; color: #374151;")
+        self.till_stats.setTextFormat(Qt.TextFormat.PlainText)
+        stats_layout.addWidget(self.till_stats)
+
+        left_column.addWidget(stats_card)
         left_column.addStretch()
         
         # Right column - Activity feed
@@ -868,10 +657,12 @@ class DashboardWidget(QWidget):
         activity_card = CardWidget("Recent Activity")
         activity_layout = activity_card.layout()
         
-        self.history = QTextEdit()
+        self.history = QPlainTextEdit()
         self.history.setReadOnly(True)
+        self.history.setUndoRedoEnabled(False)
+        self.history.setMaximumBlockCount(HISTORY_CAPACITY)
         self.history.setStyleSheet("""
-            QTextEdit {
+            QPlainTextEdit {
                 border: 1px solid #e2e8f0;
                 border-radius: 6px;
                 padding: 12px;
@@ -937,14 +728,100 @@ class DashboardWidget(QWidget):
             self.send_btn.setEnabled(True)
             self.send_btn.setText("Send STK Push")
 
+    def set_stats_source(self, aggregator):
+        """Render a :class:`SalesAggregator` once a second"""
+        self._stats = aggregator
+        self._stats_rendered = None
+        self._render_stats()
+        self._stats_timer.start()
+
+    def _render_stats(self):
+        if self._stats is None:
+            return
+        # Rates change as minutes pass even without new payments
+        state = (self._stats.version, int(time.time() // 60))
+        if state == self._stats_rendered:
+            return
+        self._stats_rendered = state
+        snap = self._stats.snapshot()
+        total = snap.get(ALL_TILLS, {})
+        self._stat_values['count'].setText(f"{total.get('count', 0):,}")
+        self._stat_values['gross'].setText(format_kes(total.get('gross', 0.0)))
+        self._stat_values['average'].setText(format_kes(round(total.get('average', 0.0))))
+        self._stat_values['per_minute'].setText(f"{total.get('per_minute', 0.0):.1f}")
+        lines = [f"{'Till':<10}{'Payments':>10}{'Gross':>16}{'Avg':>10}{'/min':>7}"]
+        for till in sorted(t for t in snap if t is not ALL_TILLS):
+            st = snap[till]
+            lines.append(f"{till or '?':<10}{st['count']:>10,}{st['gross']:>16,.2f}"
+                         f"{st['average']:>10,.0f}{st['per_minute']:>7.1f}")
+        self.till_stats.setText('\n'.join(lines) if len(lines) > 1 else "")
+
     def append_history(self, msg):
-        ts = datetime.now().strftime('%H:%M:%S')
-        self.history.append(f'[{ts}] {msg}')
+        now = time.time()
+        # One line per entry, so every entry is exactly one block in the widget
+        text = ' · '.join(part.strip() for part in str(msg).splitlines() if part.strip())
+        self._history_batch.add((now, f"[{datetime.fromtimestamp(now).strftime('%H:%M:%S')}] {text}"))
+
+    def _flush_history(self, entries):
+        spilled = []
+        for entry in entries:
+            if len(self._recent) == self._recent.maxlen:
+                spilled.append(self._recent[0])
+            self._recent.append(entry)
+        # maximumBlockCount drops the same lines from the top of the widget
+        self.history.appendPlainText('\n'.join(line for _ts, line in entries))
+        bar = self.history.verticalScrollBar()
+        bar.setValue(bar.maximum())
+        if spilled:
+            self._spill_history(spilled)
+
+    def _spill_history(self, entries):
+        """Write lines that scrolled out of the ring buffer to the local cache"""
+        try:
+            if self._activity_cache is None:
+                self._activity_cache = LocalTransactionCache(shop_key(self._merchant_id, self._shop_codes))
+            cache = self._activity_cache
+            QThreadPool.globalInstance().start(lambda: cache.append_activity(entries))
+        except Exception as e:
+            log.warning("failed to store activity history: %s", e)
 
 
 class TransactionsWidget(QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
+        self.model = TransactionsTableModel(parent=self)
+        # Live rows are coalesced into one insert per frame tick
+        self._live_rows = FrameBatcher(self._append_live, parent=self)
+        # History pages are fetched and parsed on the thread pool and arrive
+        # here through queued signals, so the model is only touched on the GUI thread.
+        self._loader = HistoryLoader(self)
+        self._loader.signals.page.connect(self._on_history_page)
+        self._loader.signals.delta.connect(self._on_history_delta)
+        self._loader.signals.finished.connect(self._on_history_finished)
+        self._loader.signals.failed.connect(self._on_history_failed)
+        self._index = TransactionIndex(self.model.store)
+        # Today's totals per till; reseeded from the store after each load,
+        # then updated per live payment
+        self.stats = SalesAggregator()
+        # Local per-shop cache and the shortcodes its history is fetched for;
+        # set by set_context()
+        self._cache = None
+        self._shortcodes = None
+        self._cache_shown = False
+        # While a cache delta is being fetched, live rows wait here so they
+        # end up above the (older) delta rows
+        self._syncing = False
+        self._parked = []
+        # True until the cached rows of a load have been fully streamed
+        self._loading_cache = False
+        self._query = None
+        # Receipts picked from a notification; shown while the search box is empty
+        self._pinned_query = None
+        # Keystrokes restart this timer; the search runs once typing pauses
+        self._search_timer = QTimer(self)
+        self._search_timer.setSingleShot(True)
+        self._search_timer.setInterval(250)
+        self._search_timer.timeout.connect(self._apply_search)
         self._build_ui()
 
     def _build_ui(self):
@@ -964,32 +841,54 @@ class TransactionsWidget(QWidget):
         header_layout.addWidget(title)
         header_layout.addStretch()
         
+        self.sync_label = QLabel("")
+        self.sync_label.setStyleSheet("color: #64748b; font-size: 13px;")
+        header_layout.addWidget(self.sync_label)
+
         self.refresh_btn = ModernButton("Refresh", size="small")
         self.refresh_btn.clicked.connect(self.on_refresh)
         header_layout.addWidget(self.refresh_btn)
         
         layout.addLayout(header_layout)
+
+        # Search bar
+        search_layout = QHBoxLayout()
+        self.search_edit = ModernLineEdit("Search: 0712…, *5678, KES 500, receipt, today, 10:00-12:00")
+        self.search_edit.setClearButtonEnabled(True)
+        self.search_edit.textChanged.connect(self._on_search_edited)
+        search_layout.addWidget(self.search_edit, 1)
+
+        self.search_status = QLabel("")
+        self.search_status.setStyleSheet("color: #64748b; font-size: 13px;")
+        search_layout.addWidget(self.search_status)
+
+        layout.addLayout(search_layout)
         
         # Transactions table card
         table_card = CardWidget()
         table_layout = table_card.layout()
         
-        self.table = QTableWidget(0, 5)
-        self.table.setHorizontalHeaderLabels(['Time', 'Amount', 'Phone', 'Status', 'Transaction ID'])
+        self.table = QTableView()
+        self.table.setModel(self.model)
         self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        # Fixed row heights let the view map scroll offsets to rows without
+        # measuring every row, which keeps scrolling cheap on huge histories.
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        self.table.verticalHeader().setDefaultSectionSize(34)
+        self.table.setWordWrap(False)
         
         # Style the table
         self.table.setStyleSheet("""
-            QTableWidget {
+            QTableView {
                 border: none;
                 gridline-color: #e2e8f0;
                 font-size: 13px;
             }
-            QTableWidget::item {
+            QTableView::item {
                 padding: 8px;
                 border-bottom: 1px solid #f1f5f9;
             }
-            QTableWidget::item:selected {
+            QTableView::item:selected {
                 background-color: #dbeafe;
             }
             QHeaderView::section {
@@ -1008,79 +907,178 @@ class TransactionsWidget(QWidget):
     def on_refresh(self):
         self.refresh_btn.setEnabled(False)
         self.refresh_btn.setText("Refreshing...")
-        
-        def refresh_complete():
-            self.refresh_btn.setEnabled(True)
-            self.refresh_btn.setText("Refresh")
-            
-        threading.Thread(target=self._refresh_data, daemon=True).start()
-        QTimer.singleShot(2000, refresh_complete)
-
-    def _refresh_data(self):
         self.load_from_server()
 
+    def _refresh_complete(self):
+        self.refresh_btn.setEnabled(True)
+        self.refresh_btn.setText("Refresh")
+
     def add_transaction(self, time_or_text, amount=None, phone=None, status=None, txid=None):
-        row = self.table.rowCount()
-        self.table.insertRow(row)
-        
+        self._live_rows.add(self._make_row(time_or_text, amount, phone, status, txid))
+
+    def add_record(self, rec):
+        """Add a record produced by ``utils.callback_parser.normalize_notification``."""
+        self._live_rows.add(self.model.store.row_from_record(rec))
+
+    def _make_row(self, time_or_text, amount=None, phone=None, status=None, txid=None):
+        store = self.model.store
         if amount is None and isinstance(time_or_text, str) and '|' in time_or_text:
             parts = [p.strip() for p in time_or_text.split('|')]
             vals = parts + [''] * (5 - len(parts))
-        elif amount is None and isinstance(time_or_text, str):
-            vals = [time_or_text, '', '', '', '']
+            return store.make_row(*vals[:5])
+        if amount is None and isinstance(time_or_text, str):
+            # Free text (e.g. an error message) goes in the status column
+            return store.make_row(time.time(), status=time_or_text)
+        return store.make_row(time_or_text, amount, phone, status, txid)
+
+    def _append_live(self, rows):
+        if self._syncing:
+            self._parked.extend(rows)
+            return
+        store = self.model.store
+        rows = [r for r in rows if not store.contains_txid(r[5])]
+        self.model.append_rows(rows)
+        for _rid, ts, amount, _phone, _status, _txid, shortcode in rows:
+            if amount > 0:
+                self.stats.add(shortcode, amount, ts)
+
+    def set_context(self, merchant_id, shop_codes):
+        """Switch to the local cache of this merchant/shop.
+
+        Returns True if the shop changed (the table then needs a fresh load).
+        """
+        if isinstance(shop_codes, (list, tuple)):
+            self._shortcodes = [str(c) for c in shop_codes if c] or None
         else:
-            vals = [
-                str(time_or_text or ''),
-                str(amount or ''),
-                str(phone or ''),
-                str(status or ''),
-                str(txid or '')
-            ]
-
-        for c in range(5):
-            item = QTableWidgetItem(vals[c])
-            self.table.setItem(row, c, item)
-
-    def load_from_server(self, server_url=None, limit=100):
-        import requests
+            self._shortcodes = [str(shop_codes)] if shop_codes else None
+        key = shop_key(merchant_id, shop_codes)
+        if self._cache is not None and self._cache.key == key:
+            return False
+        try:
+            self._cache = LocalTransactionCache(key)
+        except Exception as e:
+            log.warning("local cache unavailable: %s", e)
+            self._cache = None
+        self._cache_shown = False
+        save_last_context(merchant_id, shop_codes)
+        return True
+
+    def restore_last_context(self):
+        """Show the cached history of the last used shop, without any network."""
+        ctx = load_last_context()
+        if not ctx:
+            return
+        self.set_context(*ctx)
+        if self._cache is not None:
+            self._start_load(None)
+
+    def load_from_server(self, server_url=None, limit=None):
+        """Stream history from the server; ``limit`` of None loads everything.
+
+        With a local cache only rows newer than the cache are requested, and
+        all of them (``limit`` is ignored), so the cache stays contiguous.
+        """
         if not server_url:
             server_url = SERVER_URL or "http://localhost:5000"  # Default to localhost if not configured
-            
-        print(f"[GUI Debug] Using server URL: {server_url}")
-            
-        if not server_url:
-            print("[GUI Debug] No server URL configured for transactions")
-            self.add_transaction("No server URL configured")
+
+        log.debug("loading transactions from %s/api/transactions", server_url)
+        self._start_load(server_url, limit)
+
+    def _start_load(self, server_url, limit=None):
+        store = self.model.store
+        if self._cache is not None and self._cache_shown and not self._loading_cache:
+            # Cached rows are already on screen: fetch just the delta
+            self._syncing = True
+            self._loader.start(server_url, store.make_row, shortcodes=self._shortcodes,
+                               cache=self._cache, read_cache=False)
             return
-            
-        try:
-            url = f"{server_url}/api/transactions"
-            if limit:
-                url += f"?limit={limit}"
-            print(f"[GUI Debug] Loading transactions from: {url}")
-            resp = requests.get(url, timeout=10)
-            resp.raise_for_status()
-            
-            data = resp.json()
-            print(f"[GUI Debug] Received {len(data)} transactions from server")
-            
-            self.table.setRowCount(0)
-            
-            for tx in data:
-                self.add_transaction(
-                    tx.get('time', ''),
-                    tx.get('amount', ''),
-                    tx.get('phone', ''),
-                    tx.get('status', ''),
-                    tx.get('transaction_id', '')
-                )
-            print("[GUI Debug] Transaction table updated successfully")
-                
-        except Exception as e:
-            print(f"[GUI Error] Failed to load transactions: {e}")
-            import traceback
-            print(traceback.format_exc())
-            self.add_transaction(f'Failed to load transactions: {e}')
+        # Start from an empty table: live rows arriving from now on go on top
+        # while history pages stream in below them; rows seen through both
+        # paths are dropped by transaction id.
+        self._live_rows.flush_now()
+        self.model.clear()
+        self._syncing = self._cache is not None and server_url is not None
+        self._cache_shown = self._cache is not None
+        self._loading_cache = self._cache is not None
+        self._loader.start(server_url, store.make_row, limit=limit, shortcodes=self._shortcodes,
+                           cache=self._cache)
+
+    def _on_history_page(self, generation, rows):
+        if generation != self._loader.generation:
+            return
+        store = self.model.store
+        self.model.extend_history([r for r in rows if not store.contains_txid(r[5])])
+
+    def _on_history_delta(self, generation, rows):
+        if generation != self._loader.generation:
+            return
+        store = self.model.store
+        self.model.append_rows([r for r in rows if not store.contains_txid(r[5])])
+
+    def _end_sync(self):
+        self._loading_cache = False
+        self._syncing = False
+        parked, self._parked = self._parked, []
+        if parked:
+            self._append_live(parked)
+
+    def _on_history_finished(self, generation, total):
+        if generation != self._loader.generation:
+            return
+        log.debug("received %d transactions from server", total)
+        self._end_sync()
+        self.sync_label.setText("")
+        self._refresh_complete()
+        self.stats.seed_columns(self.model.store.columns())
+        # Build the search index now, while the cashier is not typing
+        QTimer.singleShot(0, self._index.sync)
+        if self._query is not None:
+            self._apply_search()
+
+    def _on_search_edited(self, _text):
+        self._pinned_query = None
+        self._search_timer.start()
+
+    def show_receipts(self, receipts):
+        """Filter the table down to the given receipts (notification drill-down)."""
+        query = TransactionQuery()
+        query.receipts = frozenset(str(r).upper() for r in receipts if r)
+        if not query.receipts:
+            return
+        self._search_timer.stop()
+        self.search_edit.blockSignals(True)
+        self.search_edit.clear()
+        self.search_edit.blockSignals(False)
+        self._pinned_query = query
+        self._apply_search()
+
+    def _apply_search(self):
+        text = self.search_edit.text().strip()
+        query = parse_query(text) if text else self._pinned_query
+        if query is None or query.is_empty():
+            self._query = None
+            self.model.set_filter(None)
+            self.search_status.setText("")
+            return
+        self._query = query
+        keys = self._index.search(query)
+        self.model.set_filter(keys, lambda k, q=query: self._index.matches(q, k))
+        if query is self._pinned_query:
+            self.search_status.setText(f"{len(keys):,} payment{'s' if len(keys) != 1 else ''} from notification")
+        else:
+            self.search_status.setText(f"{len(keys):,} match{'es' if len(keys) != 1 else ''}")
+
+    def _on_history_failed(self, generation, error):
+        if generation != self._loader.generation:
+            return
+        log.warning("failed to load transactions: %s", error)
+        self._end_sync()
+        if self._cache is not None:
+            self.sync_label.setText("Offline – showing cached history")
+            self.stats.seed_columns(self.model.store.columns())
+        else:
+            self.add_transaction(f'Failed to load transactions: {error}')
+        self._refresh_complete()
 
 
 class SettingsWidget(QWidget):
@@ -1300,7 +1298,6 @@ class SettingsWidget(QWidget):
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
-        print("[GUI Debug] Initializing MainWindow with Multi-Desktop Support")
         self.setWindowTitle('M-Pesa Manager - Professional Payment Gateway')
         self.resize(1200, 800)
         
@@ -1311,7 +1308,6 @@ class MainWindow(QMainWindow):
             }
         """)
         
-        print("[GUI Debug] Creating central container")
         # Central container with sidebar + stacked pages
         container = QWidget()
         h = QHBoxLayout()
@@ -1320,12 +1316,10 @@ class MainWindow(QMainWindow):
         container.setLayout(h)
         self.setCentralWidget(container)
         
-        print("[GUI Debug] Setting up sidebar")
         # Sidebar and pages
         self.sidebar = SidebarWidget()
         h.addWidget(self.sidebar)
         
-        print("[GUI Debug] Creating content area")
         # Main content area
         self.content_area = QStackedWidget()
         self.content_area.setStyleSheet("""
@@ -1336,14 +1330,12 @@ class MainWindow(QMainWindow):
         """)
         h.addWidget(self.content_area, 1)
         
-        print("[GUI Debug] Initializing pages")
         # Initialize pages
         self.login = LoginWidget()
         self.dashboard = DashboardWidget()
         self.transactions = TransactionsWidget()
         self.settings = SettingsWidget()
         
-        print("[GUI Debug] Adding pages to stacked widget")
         self.content_area.addWidget(self.login)
         self.content_area.addWidget(self.dashboard)
         self.content_area.addWidget(self.transactions)
@@ -1362,31 +1354,43 @@ class MainWindow(QMainWindow):
         self._wsclient = None
         self._merchant_id = None
         self._shop_codes = None
-        self._current_overlay = None
+        # Pre-built notification cards, reused for every payment
+        self._notifier = NotificationManager(parent=self)
+        self._notifier.activated.connect(self._on_notification_clicked)
+        # Bursts of payments become one summary card instead of one card each
+        self._coalescer = NotificationCoalescer(parent=self)
+        self._coalescer.ready.connect(self.show_multi_desktop_notification)
+
+        # Dashboard sales stats follow the transactions store
+        self.dashboard.set_stats_source(self.transactions.stats)
+
+        # Show the last shop's cached history straight away, before connecting
+        self.transactions.restore_last_context()
         
-        print("[GUI Debug] MainWindow initialization complete")
+        log.debug("main window initialised")
         
     def _on_notification(self, msg):
         """Handle incoming notifications by showing MULTI-DESKTOP overlay"""
         try:
-            print(f"[GUI Debug] _on_notification received message: {msg}")
-            formatted = self._format_notification(msg)
+            record = normalize_notification(msg)
+            formatted = self._format_notification(record)
             
             # Add to dashboard history
             self.dashboard.append_history(f"🔔 {formatted}")
             
             # Add to transactions
-            self.transactions.add_transaction(formatted)
-            
-            # Show MULTI-DESKTOP overlay that appears on ALL screens and virtual desktops
-            self.show_multi_desktop_notification("💰 PAYMENT RECEIVED", formatted)
-            
-            print("[GUI Debug] Multi-desktop notification processed successfully")
+            self.transactions.add_record(record)
             
-        except Exception as e:
-            print(f"[GUI Error] Error handling notification: {e}")
-            import traceback
-            print(traceback.format_exc())
+            # Show MULTI-DESKTOP overlay (coalesced with other payments in the same burst)
+            self._coalescer.add("💰 PAYMENT RECEIVED", formatted, record)
+
+        except Exception:
+            log.exception("error handling notification")
+
+    def _on_notification_batch(self, msgs):
+        """A burst delivered as one signal; each entry is handled like a single notification"""
+        for msg in msgs:
+            self._on_notification(msg)
 
     def switch_page(self, page_name):
         page_map = {
@@ -1417,26 +1421,37 @@ class MainWindow(QMainWindow):
         self.content_area.setCurrentWidget(self.dashboard)
         self.dashboard.set_context(merchant_id, shop_codes)
 
-        # Connect notifications
+        # Connect notifications. This runs again after every reconnect (e.g. when
+        # the server drops us as a slow consumer), so only connect a new client once.
         try:
-            print("[GUI Debug] Setting up notification handler...")
-            wsclient.signals.notification.connect(self._on_notification)
-            print("[GUI Debug] Notification handler connected successfully")
-        except Exception as e:
-            print(f"[GUI Error] Failed to connect notification handler: {e}")
-            import traceback
-            print(traceback.format_exc())
+            if getattr(self, '_notify_source', None) is not wsclient:
+                if getattr(self, '_notify_source', None) is not None:
+                    self._notify_source.signals.notification.disconnect(self._on_notification)
+                    self._notify_source.signals.notification_batch.disconnect(self._on_notification_batch)
+                wsclient.signals.notification.connect(self._on_notification)
+                wsclient.signals.notification_batch.connect(self._on_notification_batch)
+                self._notify_source = wsclient
+                log.debug("notification handler connected")
+        except Exception:
+            log.exception("failed to connect notification handler")
 
-        # Pre-load transactions
+        # Render this shop's local cache, then fetch only what is newer from the server
         try:
-            threading.Thread(target=self.transactions.load_from_server, args=(SERVER_URL, 200), daemon=True).start()
+            self.transactions.set_context(merchant_id, shop_codes)
+            self.transactions.load_from_server(SERVER_URL)
         except Exception:
             pass
 
-    def show_multi_desktop_notification(self, title: str, message: str):
+    def _on_notification_clicked(self, receipts):
+        """Drill down from a notification card to its transactions"""
+        if receipts:
+            self.switch_page('transactions')
+            self.transactions.show_receipts(receipts)
+
+    def show_multi_desktop_notification(self, title: str, message: str, receipts=None):
         """Show notification on ALL virtual desktops and ALL screens"""
         try:
-            print(f"[MultiDesktop] Showing notification on ALL desktops - Title: {title}")
+            log.debug("showing notification on all desktops: %s", title)
 
             # Show Windows toast for sound (this appears in Action Center across desktops)
             if platform.system() == 'Windows' and _HAS_WINOTIFY:
@@ -1449,98 +1464,46 @@ class MainWindow(QMainWindow):
                     )
                     toast.set_audio(audio.Default, loop=False)
                     toast.show()
-                    print("[MultiDesktop] Windows toast notification shown")
+                    log.debug("windows toast notification shown")
                 except Exception as e:
-                    print(f"[MultiDesktop] Failed to show Windows toast: {e}")
+                    log.warning("failed to show windows toast: %s", e)
 
-            # Create and show the MULTI-DESKTOP overlay
-            overlay = MultiDesktopNotificationWindow(title, message)
+            # Reuse a pooled card; queued if every slot is on screen
+            self._notifier.show(title, message, receipts)
 
-            # Store reference to prevent garbage collection
-            self._current_overlay = overlay
-
-            # Show the overlay window (it will handle multiple screens/desktops)
-            overlay.show()
-            
-            print(f"[MultiDesktop] Notification displayed on {len(overlay.notification_cards)} screens")
-            
-        except Exception as e:
-            print(f"[MultiDesktop] Failed to show multi-desktop notification: {e}")
-            import traceback
-            print(traceback.format_exc())
-
-    def _format_notification(self, msg):
-        """Format notification message for display"""
-        try:
-            print(f"[GUI Debug] Formatting notification: {msg}")
-            if isinstance(msg, dict):
-                d = msg.get('data', {}) or {}
-                t = msg.get('type', '')
-                
-                if t == 'c2b_confirmation' or isinstance(d, dict) and ('TransID' in d or 'TransAmount' in d):
-                    txid = d.get('TransID') or d.get('TransID') or ''
-                    amt = d.get('TransAmount') or d.get('Amount') or ''
-                    phone = d.get('MSISDN') or d.get('Phone') or ''
-                    name = (d.get('FirstName') or '') + ' ' + (d.get('LastName') or '')
-                    formatted = f"NEW PAYMENT CONFIRMED!\n\n💵 Amount: KES {amt}\n📱 From: {phone}\n👤 Customer: {name.strip()}\n🔢 Reference: {txid}"
-                    print(f"[GUI Debug] Formatted notification: {formatted}")
-                    return formatted
-
-                if 'stkCallback' in str(d) or 'stkCallback' in str(msg):
-                    stk = None
-                    if isinstance(d, dict):
-                        stk = d.get('Body', {}).get('stkCallback') or d.get('stkCallback')
-                    if not stk and isinstance(msg, dict):
-                        stk = msg.get('stkCallback')
-                    if stk and isinstance(stk, dict):
-                        res_desc = stk.get('ResultDesc') or ''
-                        res_code = stk.get('ResultCode')
-                        cb = stk.get('CallbackMetadata') or stk.get('Callback') or {}
-                        items = cb.get('Item') if isinstance(cb, dict) else (cb if isinstance(cb, list) else None)
-                        amt = ''
-                        phone = ''
-                        txid = stk.get('MpesaReceiptNumber') or stk.get('CheckoutRequestID') or ''
-                        if items and isinstance(items, list):
-                            for it in items:
-                                name = it.get('Name') or it.get('name')
-                                val = it.get('Value')
-                                if not name:
-                                    continue
-                                if name.lower() == 'amount':
-                                    amt = str(val)
-                                if name.lower() in ('phonenumber', 'phone'):
-                                    phone = str(val)
-                        
-                        if res_code == 0:
-                            return f"✅ PAYMENT SUCCESSFUL!\n\n💵 Amount: KES {amt}\n📱 Phone: {phone}\n🧾 Receipt: {txid}"
-                        else:
-                            return f"❌ PAYMENT FAILED\n\n📱 Phone: {phone}\n⚠️ Reason: {res_desc}"
-
-            # Fallback for unknown format
-            return f"NEW TRANSACTION\n\n{str(msg)}"
-            
         except Exception:
-            return f"NEW TRANSACTION\n\n{str(msg)}"
+            log.exception("failed to show multi-desktop notification")
+
+    def _format_notification(self, rec):
+        """Format a normalized notification record for display"""
+        amount = format_kes(rec['amount']) if rec['amount'] is not None else ''
+        phone = mask_phone(rec['phone'])
+        if not rec['ok']:
+            return f"❌ PAYMENT FAILED\n\n📱 Phone: {phone}\n⚠️ Reason: {rec['status'].lstrip('❌ ')}"
+        if rec['type'] in ('stk', 'transaction'):
+            return f"✅ PAYMENT SUCCESSFUL!\n\n💵 Amount: {amount}\n📱 Phone: {phone}\n🧾 Receipt: {rec['transaction_id']}"
+        if rec['transaction_id'] or rec['amount'] is not None:
+            return (f"NEW PAYMENT CONFIRMED!\n\n💵 Amount: {amount}\n📱 From: {phone}\n"
+                    f"👤 Customer: {rec['name']}\n🔢 Reference: {rec['transaction_id']}")
+        return f"NEW TRANSACTION\n\n{rec['status']}"
 
 
 def main():
+    setup_logging()
     app = QApplication(sys.argv)
     
     # Set application-wide font
     font = QFont("Segoe UI", 10)
     app.setFont(font)
     
-    print("[GUI Debug] Starting application with Multi-Desktop Support...")
     mw = MainWindow()
-    print("[GUI Debug] Main window created")
     
     # Default to login widget on startup
     mw.content_area.setCurrentWidget(mw.login)
-    print("[GUI Debug] Set initial widget to login")
     
     # Show the window
     mw.show()
-    print("[GUI Debug] Main window displayed")
+    log.info("main window displayed")
     
     sys.exit(app.exec())
 
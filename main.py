@@ -1,8 +1,12 @@
 import sys
 from PyQt6.QtWidgets import QApplication
 from ui.main_window import MainWindow
+from utils.log import get_logger, setup_logging
+
+log = get_logger('gui')
 
 def main():
+    setup_logging()
     app = QApplication(sys.argv)
     
     # Set application-wide font
@@ -16,17 +20,14 @@ def main():
     palette.setColor(QPalette.ColorRole.Text, QColor("#0f172a"))
     app.setPalette(palette)
     
-    print("[GUI Debug] Starting application with Multi-Desktop Support...")
     mw = MainWindow()
-    print("[GUI Debug] Main window created")
     
     # Default to login widget on startup
     mw.show_login()
-    print("[GUI Debug] Set initial widget to login")
     
     # Show the window
     mw.show()
-    print("[GUI Debug] Main window displayed")
+    log.info("main window displayed")
     
     sys.exit(app.exec())
 
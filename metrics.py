@@ -0,0 +1,220 @@
+"""
+Counters and histograms for the callback server, in Prometheus text format.
+
+Each thread updates its own dict of values (a shard), so recording a
+metric on the request path is a couple of dict operations with no lock.
+A scrape adds the shards up; shards of threads that have finished are
+folded into one retired total so per-request threads do not pile up.
+
+    CALLBACKS = Counter('mpesa_callbacks_total', 'Callbacks received', ('type',))
+    CALLBACKS.inc('stk')
+    LATENCY = Histogram('mpesa_handler_seconds', 'Handler latency')
+    LATENCY.observe(0.012)
+
+    @app.route('/metrics')
+    def metrics_view():
+        return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+Values that already live elsewhere (connected sockets, queue totals) are
+exposed with :class:`Gauge` / :class:`CallbackCounter`, which call a
+function at scrape time.
+"""
+import bisect
+import threading
+
+from utils.log import get_logger
+
+log = get_logger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; covers a sub-millisecond emit up to a slow DB commit
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Live shards kept before dead threads' shards are folded on registration
+_MAX_LIVE_SHARDS = 64
+
+
+class _Shards:
+    """Per-thread value dicts: ``(metric name, labels) -> number or histogram list``."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._live = []
+        self._retired = {}
+
+    def mine(self):
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            with self._lock:
+                if len(self._live) >= _MAX_LIVE_SHARDS:
+                    self._retire()
+                self._live.append((threading.current_thread(), values))
+            return values
+
+    def _retire(self):
+        live = []
+        for thread, values in self._live:
+            if thread.is_alive():
+                live.append((thread, values))
+            else:
+                _merge(self._retired, values)
+        self._live = live
+
+    def snapshot(self):
+        """Sum of all shards (owners keep writing; a scrape may be a few updates behind)."""
+        with self._lock:
+            self._retire()
+            total = {}
+            _merge(total, self._retired)
+            for _, values in self._live:
+                _merge(total, dict(values))
+        return total
+
+
+def _merge(into, values):
+    for key, value in values.items():
+        if isinstance(value, list):
+            acc = into.get(key)
+            if acc is None:
+                into[key] = list(value)
+            else:
+                for i, v in enumerate(value):
+                    acc[i] += v
+        else:
+            into[key] = into.get(key, 0) + value
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        self.shards = _Shards()
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        values = self.shards.snapshot()
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            try:
+                lines.extend(metric.collect(values))
+            except Exception:
+                log.exception("collecting %s failed", metric.name)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._shards = registry.shards
+        registry.register(self)
+
+    def inc(self, *labels, amount=1):
+        values = self._shards.mine()
+        key = (self.name, labels)
+        values[key] = values.get(key, 0) + amount
+
+    def collect(self, values):
+        for (name, labels), value in sorted(values.items(), key=_sort_key):
+            if name == self.name:
+                yield f'{name}{_labels(self.labelnames, labels)} {_number(value)}'
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._shards = registry.shards
+        registry.register(self)
+
+    def observe(self, value, *labels):
+        values = self._shards.mine()
+        key = (self.name, labels)
+        # Per-bucket counts (made cumulative when rendered), then sum and count
+        hist = values.get(key)
+        if hist is None:
+            hist = values[key] = [0] * (len(self.buckets) + 3)
+        hist[bisect.bisect_left(self.buckets, value)] += 1
+        hist[-2] += value
+        hist[-1] += 1
+
+    def collect(self, values):
+        for (name, labels), hist in sorted(values.items(), key=_sort_key):
+            if name != self.name:
+                continue
+            running = 0
+            for bound, count in zip(self.buckets + (float('inf'),), hist):
+                running += count
+                le = 'le="%s"' % _number(bound)
+                yield f'{name}_bucket{_labels(self.labelnames, labels, le)} {running}'
+            yield f'{name}_sum{_labels(self.labelnames, labels)} {_number(hist[-2])}'
+            yield f'{name}_count{_labels(self.labelnames, labels)} {hist[-1]}'
+
+
+class Gauge:
+    """Value(s) read at scrape time: ``fn()`` returns a number, or ``{label tuple: number}``."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, fn, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        registry.register(self)
+
+    def collect(self, values):
+        result = self.fn()
+        if not isinstance(result, dict):
+            result = {(): result}
+        for labels, value in sorted(result.items()):
+            if not isinstance(labels, tuple):
+                labels = (labels,)
+            yield f'{self.name}{_labels(self.labelnames, labels)} {_number(value)}'
+
+
+class CallbackCounter(Gauge):
+    """A counter maintained elsewhere, read at scrape time like :class:`Gauge`."""
+    kind = 'counter'
+
+
+def _sort_key(item):
+    (name, labels), _ = item
+    return name, tuple(str(v) for v in labels)
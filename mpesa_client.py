@@ -4,6 +4,10 @@ from datetime import datetime
 from typing import Optional
 import json
 import os
+import time
+
+from utils.log import get_logger
+
 try:
     from config import CONSUMER_KEY, CONSUMER_SECRET, SHORTCODE, PASSKEY, CALLBACK_URL
 except Exception:
@@ -16,6 +20,8 @@ except Exception:
     PASSKEY = os.getenv('PASSKEY')
     CALLBACK_URL = os.getenv('CALLBACK_URL')
 
+log = get_logger(__name__)
+
 
 def get_access_token(consumer_key: Optional[str] = None, consumer_secret: Optional[str] = None) -> str:
     """Request an OAuth access token from Safaricom sandbox.
@@ -70,7 +76,7 @@ def c2b_register_url(shortcode: str, response_type: str,
         'ConfirmationURL': confirmation_url,
         'ValidationURL': validation_url
     }
-    print(payload)
+    log.debug("registering C2B urls for %s", shortcode)
     
     url = 'https://sandbox.safaricom.co.ke/mpesa/c2b/v2/registerurl'
     resp = requests.post(url, json=payload, headers=headers, timeout=15)
@@ -85,10 +91,12 @@ def lipa_na_mpesa_online(phone_number: str, amount: int,
                          shortcode: Optional[str] = None,
                          passkey: Optional[str] = None,
                          callback_url: Optional[str] = None,
-                         merchant_id: Optional[str] = None) -> requests.Response:
+                         merchant_id: Optional[str] = None,
+                         timings: Optional[dict] = None) -> requests.Response:
     """Initiate an STK Push (Lipa Na M-Pesa Online).
 
     Returns the requests.Response from the STK endpoint so callers can inspect status/text.
+    If ``timings`` is given it is filled with ``token_ms`` and ``request_ms``.
     """
     consumer_key = consumer_key or CONSUMER_KEY
     consumer_secret = consumer_secret or CONSUMER_SECRET
@@ -99,7 +107,9 @@ def lipa_na_mpesa_online(phone_number: str, amount: int,
     if not all([consumer_key, consumer_secret, shortcode, passkey, callback_url]):
         raise RuntimeError('Missing one or more required credentials (consumer/shortcode/passkey/callback)')
 
+    started = time.perf_counter()
     access_token = get_access_token(consumer_key, consumer_secret)
+    token_done = time.perf_counter()
     timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
     password = generate_password(shortcode, passkey, timestamp)
 
@@ -127,4 +137,7 @@ def lipa_na_mpesa_online(phone_number: str, amount: int,
 
     url = 'https://sandbox.safaricom.co.ke/mpesa/stkpush/v1/processrequest'
     resp = requests.post(url, json=payload, headers=headers, timeout=15)
+    if timings is not None:
+        timings['token_ms'] = round((token_done - started) * 1000, 1)
+        timings['request_ms'] = round((time.perf_counter() - token_done) * 1000, 1)
     return resp
@@ -0,0 +1,247 @@
+"""
+Reconcile stored callbacks against an M-Pesa organisation statement (CSV).
+
+Both sides are loaded into flat column arrays. The callbacks are hash-indexed
+by receipt number and the statement is joined against that index in one pass,
+which flags (dicts and ``array`` columns, so there is no numpy/pandas dependency):
+
+ - missing_callback    paid in per the statement, but no callback received
+ - amount_mismatch     receipt in both, amounts differ
+ - duplicate_callback  the same receipt received more than once
+ - duplicate_statement the same receipt listed more than once in the statement
+ - not_in_statement    callback inside the statement period with no statement line
+
+Usage:
+    python reconcile.py statement.csv [--db callbacks.db] [--shortcode 600977] [--out report.csv]
+"""
+import argparse
+import csv
+import sys
+import time
+from array import array
+from datetime import datetime, timedelta
+
+from callback_store import CallbackStore, DB_PATH, decode_payload
+from utils.callback_parser import normalize_callback, parse_amount
+
+# Header names used by Safaricom statement exports (lower-cased, first match wins)
+_RECEIPT_HEADERS = ('receipt no.', 'receipt no', 'receipt', 'transaction id')
+_TIME_HEADERS = ('completion time', 'initiation time', 'date')
+_PAID_IN_HEADERS = ('paid in', 'credit', 'amount')
+_STATUS_HEADERS = ('transaction status', 'status')
+_TIME_FORMATS = ('%Y-%m-%d %H:%M:%S', '%d-%m-%Y %H:%M:%S', '%d/%m/%Y %H:%M:%S', '%Y-%m-%d %H:%M', '%d/%m/%Y %H:%M')
+
+REPORT_FIELDS = ['issue', 'receipt', 'statement_amount', 'callback_amount', 'callback_ids', 'time']
+
+# Amounts are in KES with at most two decimals
+_TOLERANCE = 0.005
+
+
+class Columns:
+    """Parallel arrays: receipts, amounts (NaN when unknown), times, row ids and shortcodes."""
+
+    def __init__(self):
+        self.receipts = []
+        self.amounts = array('d')
+        self.times = array('d')
+        self.ids = array('q')
+        self.shortcodes = []
+
+    def append(self, receipt, amount, ts, rid=0, shortcode=''):
+        self.receipts.append(receipt)
+        self.amounts.append(float('nan') if amount is None else amount)
+        self.times.append(float('nan') if ts is None else ts)
+        self.ids.append(rid)
+        self.shortcodes.append(shortcode)
+
+    def __len__(self):
+        return len(self.receipts)
+
+
+def _pick(header, candidates):
+    lowered = [h.strip().lower() for h in header]
+    for name in candidates:
+        if name in lowered:
+            return lowered.index(name)
+    return None
+
+
+def _parse_statement_time(value):
+    value = (value or '').strip()
+    for fmt in _TIME_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).timestamp()
+        except ValueError:
+            continue
+    return None
+
+
+def load_statement(path):
+    """Load completed paid-in lines of a statement CSV into :class:`Columns`.
+
+    Statement exports start with a few lines of account details; the table
+    starts at the first row that has a receipt column.
+    """
+    cols = Columns()
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        for header in reader:
+            if _pick(header, _RECEIPT_HEADERS) is not None:
+                break
+        else:
+            raise ValueError(f'{path}: no header row with a receipt column found')
+        i_receipt = _pick(header, _RECEIPT_HEADERS)
+        i_time = _pick(header, _TIME_HEADERS)
+        i_paid = _pick(header, _PAID_IN_HEADERS)
+        i_status = _pick(header, _STATUS_HEADERS)
+        if i_paid is None:
+            raise ValueError(f'{path}: no "Paid In" column found')
+        for row in reader:
+            if len(row) <= max(i_receipt, i_paid):
+                continue
+            receipt = row[i_receipt].strip().upper()
+            amount = parse_amount(row[i_paid])
+            if not receipt or not amount or amount <= 0:
+                continue
+            if i_status is not None and len(row) > i_status and row[i_status].strip().lower() not in ('', 'completed'):
+                continue
+            ts = _parse_statement_time(row[i_time]) if i_time is not None and len(row) > i_time else None
+            cols.append(receipt, amount, ts)
+    return cols
+
+
+def load_callbacks(store, start=None, end=None, shortcodes=None):
+    """Load successful payment callbacks (with a receipt) into :class:`Columns`.
+
+    ``shortcodes`` is matched against each callback's own shortcode, as the
+    rollups do: STK results are often stored without a merchant_id, so the
+    database column cannot be used to filter them. Callbacks with no
+    shortcode at all are kept, so they can still match a statement line.
+    """
+    wanted = set(shortcodes or ())
+    cols = Columns()
+    for rows in store.iter_callbacks(start, end, None, ['stk', 'c2b_confirmation'], chunk_size=10000):
+        for rid, merchant_id, cb_type, payload_text, created_at in rows:
+            rec = normalize_callback(cb_type, decode_payload(payload_text), created_at)
+            if not rec['ok'] or not rec['transaction_id']:
+                continue
+            shortcode = rec['shortcode'] or str(merchant_id or '')
+            if wanted and shortcode and shortcode not in wanted:
+                continue
+            cols.append(str(rec['transaction_id']).upper(), rec['amount'], rec['timestamp'], rid, shortcode)
+    return cols
+
+
+def _index(receipts):
+    """receipt -> list of row positions, built in one pass."""
+    index = {}
+    for pos, receipt in enumerate(receipts):
+        hit = index.get(receipt)
+        if hit is None:
+            index[receipt] = [pos]
+        else:
+            hit.append(pos)
+    return index
+
+
+def _fmt_time(ts):
+    return '' if ts != ts else datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _fmt_amount(amount):
+    return '' if amount != amount else f'{amount:.2f}'
+
+
+def reconcile(statement, callbacks, shortcodes=None):
+    """Hash-join the two column sets; returns a list of report dicts.
+
+    With ``shortcodes``, callbacks that carry no shortcode are only used to
+    match statement lines: they may belong to another till, so they are not
+    reported as ``not_in_statement``.
+    """
+    issues = []
+    cb_index = _index(callbacks.receipts)
+    st_index = _index(statement.receipts)
+    cb_amounts = callbacks.amounts
+
+    for receipt, positions in st_index.items():
+        st_pos = positions[0]
+        st_amount = statement.amounts[st_pos]
+        if len(positions) > 1:
+            issues.append({'issue': 'duplicate_statement', 'receipt': receipt,
+                           'statement_amount': _fmt_amount(st_amount), 'callback_amount': '',
+                           'callback_ids': '', 'time': _fmt_time(statement.times[st_pos])})
+        hits = cb_index.get(receipt)
+        if hits is None:
+            issues.append({'issue': 'missing_callback', 'receipt': receipt,
+                           'statement_amount': _fmt_amount(st_amount), 'callback_amount': '',
+                           'callback_ids': '', 'time': _fmt_time(statement.times[st_pos])})
+            continue
+        cb_amount = cb_amounts[hits[0]]
+        ids = ' '.join(str(callbacks.ids[p]) for p in hits)
+        if not abs(cb_amount - st_amount) <= _TOLERANCE:
+            issues.append({'issue': 'amount_mismatch', 'receipt': receipt,
+                           'statement_amount': _fmt_amount(st_amount), 'callback_amount': _fmt_amount(cb_amount),
+                           'callback_ids': ids, 'time': _fmt_time(statement.times[st_pos])})
+
+    # Statement period, to tell "not in statement" apart from "outside the statement"
+    st_times = [t for t in statement.times if t == t]
+    lo, hi = (min(st_times), max(st_times)) if st_times else (float('-inf'), float('inf'))
+    for receipt, hits in cb_index.items():
+        if len(hits) > 1:
+            issues.append({'issue': 'duplicate_callback', 'receipt': receipt, 'statement_amount': '',
+                           'callback_amount': _fmt_amount(cb_amounts[hits[0]]),
+                           'callback_ids': ' '.join(str(callbacks.ids[p]) for p in hits),
+                           'time': _fmt_time(callbacks.times[hits[0]])})
+        ts = callbacks.times[hits[0]]
+        if shortcodes and not callbacks.shortcodes[hits[0]]:
+            continue
+        if receipt not in st_index and lo <= ts <= hi:
+            issues.append({'issue': 'not_in_statement', 'receipt': receipt, 'statement_amount': '',
+                           'callback_amount': _fmt_amount(cb_amounts[hits[0]]),
+                           'callback_ids': ' '.join(str(callbacks.ids[p]) for p in hits),
+                           'time': _fmt_time(ts)})
+    return issues
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reconcile callbacks against an M-Pesa statement CSV')
+    parser.add_argument('statement', help='statement CSV exported from the M-Pesa org portal')
+    parser.add_argument('--db', default=DB_PATH, help='path to callbacks.db')
+    parser.add_argument('--shortcode', action='append', help='only callbacks for this till/paybill (repeatable)')
+    parser.add_argument('--out', help='write the report CSV here (default: stdout)')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    statement = load_statement(args.statement)
+    st_times = [t for t in statement.times if t == t]
+    # Callbacks are filtered on created_at (UTC); pad a day either side
+    start = end = None
+    if st_times:
+        start = (datetime.fromtimestamp(min(st_times)) - timedelta(days=1)).strftime('%Y-%m-%d')
+        end = (datetime.fromtimestamp(max(st_times)) + timedelta(days=1)).strftime('%Y-%m-%d')
+    callbacks = load_callbacks(CallbackStore(args.db), start, end, args.shortcode)
+    loaded = time.perf_counter()
+    issues = reconcile(statement, callbacks, args.shortcode)
+    done = time.perf_counter()
+
+    out = open(args.out, 'w', newline='', encoding='utf-8') if args.out else sys.stdout
+    try:
+        writer = csv.DictWriter(out, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(issues)
+    finally:
+        if args.out:
+            out.close()
+
+    counts = {}
+    for issue in issues:
+        counts[issue['issue']] = counts.get(issue['issue'], 0) + 1
+    print(f"Statement lines: {len(statement)}, callbacks: {len(callbacks)} "
+          f"(loaded in {loaded - started:.1f}s, matched in {done - loaded:.2f}s)", file=sys.stderr)
+    for name in ('missing_callback', 'amount_mismatch', 'duplicate_callback', 'duplicate_statement', 'not_in_statement'):
+        print(f"  {name}: {counts.get(name, 0)}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
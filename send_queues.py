@@ -0,0 +1,531 @@
+"""
+Per-client bounded outbound queues for Socket.IO broadcasts.
+
+python-socketio hands every emit straight to each client's Engine.IO socket,
+whose send queue is unbounded: a terminal on a bad link just accumulates
+packets while the server keeps writing to it. Here every connection gets a
+small bounded queue instead, and a pump thread moves packets on to Engine.IO
+only while that client has fewer than ``max_in_flight`` packets still
+unsent. A slow client backs up in its own queue; when that queue is full the
+policy of the room the packet was sent to decides what happens:
+
+ - ``drop_oldest``  discard the oldest queued packet
+ - ``coalesce``     replace the queued packet with the same key (else drop oldest)
+ - ``disconnect``   disconnect the client; on reconnect it replays what it
+                    missed from ``/api/transactions?since_id=...``
+
+A broadcast is encoded once per codec (JSON, or MessagePack for clients that
+negotiated it; see utils.wire_format) and the same packet is queued for every
+recipient using that codec.
+
+Clients that join with ``batch=True`` get events listed in ``batch_events``
+collected per room for up to ``batch_window`` seconds (or ``batch_max``
+events) and delivered as one batch event carrying a list, e.g.
+``notification_batch``. A burst then costs them one packet and one dispatch
+instead of one per event.
+
+:class:`AckTracker` adds acknowledged delivery for clients that ask for it:
+notifications are kept per client until acknowledged and redelivered on
+timeout or reconnect.
+"""
+import bisect
+import threading
+import time
+from collections import OrderedDict, deque
+
+from engineio import packet as eio_packet
+from socketio import packet
+
+from utils import wire_format
+from utils.log import get_logger
+
+log = get_logger(__name__)
+
+POLICIES = ('drop_oldest', 'coalesce', 'disconnect')
+
+
+def parse_policies(spec):
+    """``"notify=disconnect,notify_raw=drop_oldest"`` -> ``{room: policy}``"""
+    out = {}
+    for item in spec.split(','):
+        room, _, policy = item.partition('=')
+        room, policy = room.strip(), policy.strip()
+        if room and policy:
+            if policy not in POLICIES:
+                raise ValueError(f'unknown send queue policy {policy!r} for room {room!r}')
+            out[room] = policy
+    return out
+
+
+class _Client:
+    __slots__ = ('sid', 'eio_sid', 'codec', 'batch', 'rooms', 'queue', 'keys', 'sent', 'dropped', 'max_depth')
+
+    def __init__(self, sid, eio_sid, codec, batch):
+        self.sid = sid
+        self.eio_sid = eio_sid
+        self.codec = codec
+        self.batch = batch
+        self.rooms = set()
+        # Items are [key, packets]; keys maps a coalesce key to its queued item
+        self.queue = deque()
+        self.keys = {}
+        self.sent = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+
+class SendQueues:
+    """Bounded per-client send queues in front of a Flask-SocketIO server.
+
+    Call :meth:`join` / :meth:`leave` from the connect/disconnect handlers and
+    broadcast with :meth:`send` instead of ``socketio.emit``. Rooms without a
+    configured policy use ``default_policy``.
+    """
+
+    def __init__(self, socketio, max_queue=200, max_in_flight=16, policies=None,
+                 default_policy='drop_oldest', namespace='/', batch_events=None,
+                 batch_window=0.02, batch_max=50):
+        self.socketio = socketio
+        self.max_queue = max_queue
+        self.max_in_flight = max_in_flight
+        self.policies = dict(policies or {})
+        self.default_policy = default_policy
+        self.namespace = namespace
+        # event -> batch event name, e.g. {'notification': 'notification_batch'}
+        self.batch_events = dict(batch_events or {})
+        self.batch_window = batch_window
+        self.batch_max = batch_max
+        self._clients = {}
+        self._rooms = {}
+        # (room, event) -> [flush deadline, [data, ...]]
+        self._batches = {}
+        self._pending_disconnect = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        # Set by AckTracker when acknowledged delivery is enabled
+        self.acks = None
+        self.totals = {'sent': 0, 'dropped': 0, 'coalesced': 0, 'disconnected': 0, 'batches': 0, 'batched': 0}
+        self._thread = threading.Thread(target=self._run, name='socketio-send-pump', daemon=True)
+        self._thread.start()
+
+    # --- membership ---
+
+    def join(self, sid, room, codec=wire_format.JSON, batch=False):
+        server = self.socketio.server
+        with self._lock:
+            client = self._clients.get(sid)
+            if client is None:
+                eio_sid = server.manager.eio_sid_from_sid(sid, self.namespace)
+                client = self._clients[sid] = _Client(sid, eio_sid, codec, batch)
+            client.rooms.add(room)
+            self._rooms.setdefault(room, set()).add(sid)
+
+    def leave(self, sid):
+        with self._lock:
+            client = self._clients.pop(sid, None)
+            self._pending_disconnect.discard(sid)
+            if client is None:
+                return
+            for room in client.rooms:
+                members = self._rooms.get(room)
+                if members is not None:
+                    members.discard(sid)
+                    if not members:
+                        del self._rooms[room]
+
+    # --- sending ---
+
+    def _encode(self, event, data, codec=wire_format.JSON):
+        packet_class = wire_format.packet_class(codec) or self.socketio.server.packet_class
+        pkt = packet_class(packet.EVENT, namespace=self.namespace, data=[event, data])
+        encoded = pkt.encode()
+        if not isinstance(encoded, list):
+            encoded = [encoded]
+        return [eio_packet.Packet(eio_packet.MESSAGE, p) for p in encoded]
+
+    def send(self, room, event, data, key=None, ack_id=None):
+        """Queue ``event`` for every member of ``room``.
+
+        ``key`` identifies packets that supersede each other under the
+        ``coalesce`` policy. With an ``ack_id`` and an :class:`AckTracker`
+        attached, the event is also held for redelivery until each client
+        that opted in acknowledges it.
+        """
+        policy = self.policies.get(room, self.default_policy)
+        batching = event in self.batch_events
+        with self._lock:
+            members = [self._clients[sid] for sid in self._rooms.get(room, ())]
+        codecs = {c.codec for c in members if not (batching and c.batch)}
+        encoded = {codec: self._encode(event, data, codec) for codec in codecs}
+        recipients = []
+        flush = False
+        with self._lock:
+            batched = False
+            for sid in self._rooms.get(room, ()):
+                client = self._clients[sid]
+                recipients.append(sid)
+                if batching and client.batch:
+                    batched = True
+                    continue
+                packets = encoded.get(client.codec)
+                if packets is None:
+                    # Joined since the codecs were collected
+                    packets = encoded[client.codec] = self._encode(event, data, client.codec)
+                self._enqueue(client, packets, policy, key)
+            if batched:
+                pending = self._batches.get((room, event))
+                if pending is None:
+                    pending = self._batches[(room, event)] = [time.monotonic() + self.batch_window, []]
+                pending[1].append(data)
+                flush = len(pending[1]) >= self.batch_max
+        if flush:
+            self._flush_batch(room, event)
+        if ack_id is not None and self.acks is not None:
+            self.acks.track(recipients, ack_id, room, event, data)
+        self._wake.set()
+
+    def send_to(self, sid, event, data, room):
+        """Queue ``event`` for one client, unbatched (used for redelivery)."""
+        with self._lock:
+            client = self._clients.get(sid)
+        if client is None:
+            return False
+        packets = self._encode(event, data, client.codec)
+        with self._lock:
+            if self._clients.get(sid) is not client:
+                return False
+            self._enqueue(client, packets, self.policies.get(room, self.default_policy), None)
+        self._wake.set()
+        return True
+
+    def _flush_batch(self, room, event):
+        """Send the events collected for ``room`` to its batching members as one packet."""
+        with self._lock:
+            pending = self._batches.pop((room, event), None)
+            members = [c for c in (self._clients[sid] for sid in self._rooms.get(room, ())) if c.batch]
+        if not pending or not members:
+            return
+        items = pending[1]
+        batch_event = self.batch_events[event]
+        encoded = {codec: self._encode(batch_event, items, codec) for codec in {c.codec for c in members}}
+        policy = self.policies.get(room, self.default_policy)
+        with self._lock:
+            for client in members:
+                if self._clients.get(client.sid) is client:
+                    self._enqueue(client, encoded[client.codec], policy, None)
+            self.totals['batches'] += 1
+            self.totals['batched'] += len(items)
+        self._wake.set()
+
+    def _flush_due(self):
+        now = time.monotonic()
+        with self._lock:
+            due = [key for key, (deadline, _) in self._batches.items() if deadline <= now]
+        for room, event in due:
+            self._flush_batch(room, event)
+
+    def _enqueue(self, client, packets, policy, key):
+        """Append to a client's queue, applying ``policy`` when it is full. Caller holds the lock."""
+        if client.sid in self._pending_disconnect:
+            return
+        if len(client.queue) >= self.max_queue:
+            if policy == 'disconnect':
+                client.queue.clear()
+                client.keys.clear()
+                self._pending_disconnect.add(client.sid)
+                return
+            if policy == 'coalesce' and key is not None and key in client.keys:
+                client.keys[key][1] = packets
+                self.totals['coalesced'] += 1
+                return
+            self._pop(client)
+            client.dropped += 1
+            self.totals['dropped'] += 1
+        elif policy == 'coalesce' and key is not None and key in client.keys:
+            client.keys[key][1] = packets
+            self.totals['coalesced'] += 1
+            return
+        item = [key, packets]
+        client.queue.append(item)
+        if key is not None:
+            client.keys[key] = item
+        client.max_depth = max(client.max_depth, len(client.queue))
+
+    @staticmethod
+    def _pop(client):
+        item = client.queue.popleft()
+        if item[0] is not None and client.keys.get(item[0]) is item:
+            del client.keys[item[0]]
+        return item[1]
+
+    def _backlog(self, client):
+        """Packets handed to Engine.IO but not yet written to the client (None if gone)."""
+        sock = self.socketio.server.eio.sockets.get(client.eio_sid)
+        return None if sock is None else sock.queue.qsize()
+
+    def _run(self):
+        eio = self.socketio.server.eio
+        while True:
+            with self._lock:
+                busy = any(c.queue for c in self._clients.values())
+                deadline = min((b[0] for b in self._batches.values()), default=None)
+            # Poll while a backed-up client waits for its socket to drain,
+            # and wake up in time to flush the next batch
+            timeout = 0.05 if busy else None
+            if deadline is not None:
+                wait = max(0.0, deadline - time.monotonic())
+                timeout = wait if timeout is None else min(timeout, wait)
+            self._wake.wait(timeout)
+            self._wake.clear()
+            self._flush_due()
+            with self._lock:
+                clients = [c for c in self._clients.values() if c.queue]
+                doomed = list(self._pending_disconnect)
+                self._pending_disconnect.clear()
+            for client in clients:
+                backlog = self._backlog(client)
+                if backlog is None:
+                    continue
+                while backlog < self.max_in_flight:
+                    with self._lock:
+                        if not client.queue:
+                            break
+                        packets = self._pop(client)
+                    try:
+                        for p in packets:
+                            eio.send_packet(client.eio_sid, p)
+                    except Exception as e:
+                        log.warning("send to %s failed: %s", client.sid, e)
+                        break
+                    client.sent += 1
+                    self.totals['sent'] += 1
+                    backlog += 1
+            for sid in doomed:
+                self.totals['disconnected'] += 1
+                log.warning("disconnecting slow client sid=%s", sid)
+                self.leave(sid)
+                try:
+                    self.socketio.server.disconnect(sid, namespace=self.namespace)
+                except Exception as e:
+                    log.warning("disconnect of %s failed: %s", sid, e)
+
+    # --- metrics ---
+
+    def stats(self, top=10):
+        """Queue depth and drop counters, overall and for the most backed-up clients."""
+        with self._lock:
+            clients = list(self._clients.values())
+            depths = [len(c.queue) for c in clients]
+            slowest = sorted(clients, key=lambda c: (len(c.queue), c.dropped), reverse=True)[:top]
+            per_client = [{'sid': c.sid, 'depth': len(c.queue), 'max_depth': c.max_depth, 'sent': c.sent,
+                           'dropped': c.dropped, 'rooms': sorted(c.rooms), 'codec': c.codec, 'batch': c.batch}
+                          for c in slowest]
+            codecs = {}
+            for c in clients:
+                codecs[c.codec] = codecs.get(c.codec, 0) + 1
+            totals = dict(self.totals)
+        return dict(totals, clients=len(clients), queued=sum(depths), max_depth=max(depths, default=0),
+                    max_queue=self.max_queue, codecs=codecs, batching=sum(1 for c in clients if c.batch),
+                    slowest=per_client)
+
+
+class _Pending:
+    __slots__ = ('event', 'data', 'room', 'first_sent', 'last_sent', 'attempts')
+
+    def __init__(self, event, data, room, now):
+        self.event = event
+        self.data = data
+        self.room = room
+        self.first_sent = now
+        self.last_sent = now
+        self.attempts = 1
+
+
+class _AckClient:
+    __slots__ = ('client_id', 'sid', 'unacked', 'acked', 'redelivered', 'expired', 'evicted',
+                 'last_ack', 'last_seen')
+
+    def __init__(self, client_id, now):
+        self.client_id = client_id
+        self.sid = None
+        # notification id -> _Pending, oldest first
+        self.unacked = OrderedDict()
+        self.acked = 0
+        self.redelivered = 0
+        self.expired = 0
+        self.evicted = 0
+        self.last_ack = None
+        self.last_seen = now
+
+
+class AckTracker:
+    """Acknowledged delivery on top of :class:`SendQueues`.
+
+    Clients that connect with a ``client_id`` are :meth:`bind`-ed to their
+    socket. Every tracked notification sent to them stays in a per-client
+    unacked window until the client acknowledges its id; it is sent again
+    after ``timeout`` seconds (backing off linearly, at most ``max_attempts``
+    times) and whenever the same client id reconnects. The client id outlives
+    the socket, so a till that drops mid-burst gets what it missed as soon as
+    it is back. Windows of clients gone for ``forget_after`` seconds are
+    discarded.
+
+    The time from first send to acknowledgement is recorded in a latency
+    histogram (``BUCKETS_MS``).
+    """
+
+    BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+    def __init__(self, queues, window=500, timeout=10.0, max_attempts=5, forget_after=86400):
+        self.queues = queues
+        self.window = window
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.forget_after = forget_after
+        self._clients = {}
+        self._by_sid = {}
+        self._lock = threading.Lock()
+        self.histogram = [0] * (len(self.BUCKETS_MS) + 1)
+        self.latency_sum = 0.0
+        self.totals = {'tracked': 0, 'acked': 0, 'redelivered': 0, 'expired': 0, 'evicted': 0}
+        queues.acks = self
+        self._thread = threading.Thread(target=self._run, name='socketio-ack-sweep', daemon=True)
+        self._thread.start()
+
+    # --- membership ---
+
+    def bind(self, client_id, sid):
+        """Attach ``client_id`` to a new socket and redeliver its unacked window."""
+        now = time.monotonic()
+        with self._lock:
+            state = self._clients.get(client_id)
+            if state is None:
+                state = self._clients[client_id] = _AckClient(client_id, now)
+            elif state.sid is not None:
+                self._by_sid.pop(state.sid, None)
+            state.sid = sid
+            state.last_seen = now
+            self._by_sid[sid] = client_id
+            pending = list(state.unacked.items())
+        if pending:
+            log.info("redelivering %d unacked notification(s) to %s", len(pending), client_id)
+        for nid, entry in pending:
+            self._resend(state, entry, now)
+
+    def unbind(self, sid):
+        """The socket is gone; keep the client's window for when it reconnects."""
+        with self._lock:
+            client_id = self._by_sid.pop(sid, None)
+            state = self._clients.get(client_id)
+            if state is not None and state.sid == sid:
+                state.sid = None
+                state.last_seen = time.monotonic()
+
+    # --- tracking ---
+
+    def track(self, sids, nid, room, event, data):
+        """Hold notification ``nid`` for the opted-in clients among ``sids``."""
+        now = time.monotonic()
+        with self._lock:
+            for sid in sids:
+                state = self._clients.get(self._by_sid.get(sid))
+                if state is None:
+                    continue
+                state.unacked[nid] = _Pending(event, data, room, now)
+                self.totals['tracked'] += 1
+                if len(state.unacked) > self.window:
+                    state.unacked.popitem(last=False)
+                    state.evicted += 1
+                    self.totals['evicted'] += 1
+
+    def ack(self, sid, ids):
+        """Record acknowledgements from ``sid``; unknown or repeated ids are ignored."""
+        now = time.monotonic()
+        with self._lock:
+            state = self._clients.get(self._by_sid.get(sid))
+            if state is None:
+                return 0
+            acked = 0
+            for nid in ids:
+                entry = state.unacked.pop(nid, None)
+                if entry is None:
+                    continue
+                latency_ms = (now - entry.first_sent) * 1000
+                self.histogram[bisect.bisect_left(self.BUCKETS_MS, latency_ms)] += 1
+                self.latency_sum += latency_ms
+                acked += 1
+            state.acked += acked
+            state.last_ack = now
+            self.totals['acked'] += acked
+        return acked
+
+    def _resend(self, state, entry, now):
+        sid = state.sid
+        if sid is None or not self.queues.send_to(sid, entry.event, entry.data, entry.room):
+            return
+        with self._lock:
+            entry.attempts += 1
+            entry.last_sent = now
+            state.redelivered += 1
+            self.totals['redelivered'] += 1
+
+    def _run(self):
+        interval = min(1.0, self.timeout / 2)
+        while True:
+            time.sleep(interval)
+            try:
+                self._sweep()
+            except Exception:
+                log.exception("delivery sweep failed")
+
+    def _sweep(self):
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            for client_id, state in list(self._clients.items()):
+                if state.sid is None:
+                    if now - state.last_seen > self.forget_after:
+                        del self._clients[client_id]
+                    continue
+                for nid, entry in list(state.unacked.items()):
+                    if now - entry.last_sent < self.timeout * entry.attempts:
+                        continue
+                    if entry.attempts >= self.max_attempts:
+                        del state.unacked[nid]
+                        state.expired += 1
+                        self.totals['expired'] += 1
+                        log.warning("notification %s never acknowledged by %s", nid, client_id)
+                    else:
+                        due.append((state, entry))
+        for state, entry in due:
+            self._resend(state, entry, now)
+
+    # --- metrics ---
+
+    def stats(self, top=10):
+        """Delivery counters, the ack latency histogram and the clients with most pending."""
+        now = time.monotonic()
+        with self._lock:
+            states = list(self._clients.values())
+            pending = sum(len(s.unacked) for s in states)
+            worst = sorted(states, key=lambda s: len(s.unacked), reverse=True)[:top]
+            per_client = []
+            for s in worst:
+                oldest = next(iter(s.unacked.values()), None)
+                per_client.append({
+                    'client_id': s.client_id, 'connected': s.sid is not None, 'pending': len(s.unacked),
+                    'acked': s.acked, 'redelivered': s.redelivered, 'expired': s.expired, 'evicted': s.evicted,
+                    'oldest_pending_s': None if oldest is None else round(now - oldest.first_sent, 3),
+                    'last_ack_s_ago': None if s.last_ack is None else round(now - s.last_ack, 3),
+                })
+            counts = list(self.histogram)
+            totals = dict(self.totals)
+            latency_sum = self.latency_sum
+        buckets, running = [], 0
+        for bound, count in zip(list(self.BUCKETS_MS) + ['+Inf'], counts):
+            running += count
+            buckets.append({'le_ms': bound, 'count': running})
+        return dict(totals, clients=len(states), connected=sum(1 for s in states if s.sid is not None),
+                    pending=pending, window=self.window,
+                    latency_ms={'buckets': buckets, 'count': running, 'sum': round(latency_sum, 3)},
+                    clients_detail=per_client)
@@ -9,23 +9,42 @@ Usage:
 This example exposes:
  - /stk-callback  (POST) - STK push callbacks
  - /c2b-callback  (POST) - C2B callbacks
+ - /api/search    (GET)  - find payments by name, bill reference, receipt or phone
+ - /api/queues    (GET)  - per-client notification queue depth and drops
+ - /api/delivery  (GET)  - acknowledged delivery: unacked windows and ack latency
+ - /metrics       (GET)  - Prometheus metrics (callbacks, latencies, sockets, queues)
  - Socket.IO endpoint at /socket.io/ for real-time notifications
 
 Security: This example is minimal and not production-ready. Add auth and HTTPS before
 using publicly.
 """
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from dotenv import load_dotenv
 import os
-import sqlite3
 import json
+import csv
+import functools
+import io
+import time
+import zlib
 from itsdangerous import URLSafeSerializer
 from datetime import datetime, UTC
 
-DB_PATH = os.path.join(os.path.dirname(__file__), 'callbacks.db')
+from utils import wire_format
+from utils.callback_parser import build_notification, display_phone, normalize_callback, format_time
+from callback_store import CallbackStore, DB_PATH, ROLLUP_TABLES, ROLLUP_TZ, decode_payload
+from send_queues import AckTracker, SendQueues, parse_policies
+import metrics
+from utils.delivery import SeenIds
+from utils.log import Sampler, get_logger, setup_logging
 
 load_dotenv()
+# Before SocketIO() so the socketio/engineio loggers get their levels (LOG_LEVELS)
+setup_logging()
+log = get_logger('server')
+# Per-callback messages are logged once per LOG_SAMPLE_EVERY callbacks
+_log_sample = Sampler()
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev')
@@ -33,8 +52,8 @@ app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev')
 socketio = SocketIO(
     app, 
     cors_allowed_origins='*',
-    logger=True, 
-    engineio_logger=True,
+    logger=get_logger('socketio.server'),
+    engineio_logger=get_logger('engineio.server'),
     async_mode='threading',  # Use threading mode for better stability
     ping_timeout=60,  # Increase timeouts for better connection stability
     ping_interval=25,
@@ -45,106 +64,156 @@ socketio = SocketIO(
 serializer = URLSafeSerializer(app.config['SECRET_KEY'])
 
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS callbacks (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        merchant_id TEXT,
-        type TEXT,
-        payload TEXT,
-        created_at TEXT
-    )
-    ''')
-    conn.commit()
-    conn.close()
-
-
-init_db()
+# Creates the callbacks and rollup tables on first use; old months are moved
+# to the archive directory in the background
+store = CallbackStore(DB_PATH)
+store.start_archiver(interval=int(os.getenv('CALLBACK_ARCHIVE_INTERVAL', '3600')))
 
 # Simple mapping from merchant_id -> connected sockets (managed by rooms)
 # Clients should join a room named after their merchant_id after connecting.
 
+# Every client is put in one of these rooms on connect. Notifications are a
+# compact normalized record (see build_notification); clients that connect with
+# ?raw=1 get the same record with the Daraja payload attached under 'data'.
+NOTIFY_ROOM = 'notify'
+NOTIFY_RAW_ROOM = 'notify_raw'
+
+# Broadcasts go through bounded per-client queues so a slow terminal only
+# delays itself. By default a client that falls SEND_QUEUE_MAX notifications
+# behind is disconnected (it replays the gap from /api/transactions when it
+# reconnects); raw-payload subscribers lose their oldest messages instead.
+# Clients that connect with ?batch=1 get notifications collected for up to
+# NOTIFY_BATCH_WINDOW_MS (or NOTIFY_BATCH_MAX of them) as one
+# 'notification_batch' event carrying a list.
+send_queues = SendQueues(
+    socketio,
+    max_queue=int(os.getenv('SEND_QUEUE_MAX', '200')),
+    policies=parse_policies(os.getenv('SEND_QUEUE_POLICY', f'{NOTIFY_ROOM}=disconnect,{NOTIFY_RAW_ROOM}=drop_oldest')),
+    batch_events={'notification': 'notification_batch'},
+    batch_window=int(os.getenv('NOTIFY_BATCH_WINDOW_MS', '20')) / 1000,
+    batch_max=int(os.getenv('NOTIFY_BATCH_MAX', '50')),
+)
+
+# Clients that connect with ?client_id=...&ack=1 acknowledge each notification
+# id with a 'notification_ack' event; until they do it is redelivered every
+# DELIVERY_ACK_TIMEOUT seconds and again when the same client_id reconnects.
+delivery = AckTracker(
+    send_queues,
+    window=int(os.getenv('DELIVERY_WINDOW', '500')),
+    timeout=float(os.getenv('DELIVERY_ACK_TIMEOUT', '10')),
+    max_attempts=int(os.getenv('DELIVERY_MAX_ATTEMPTS', '5')),
+)
+
+
+# --- metrics (served at /metrics) ---
+CALLBACKS = metrics.Counter('mpesa_callbacks_total', 'Callbacks received', ('type', 'shortcode', 'result'))
+DUPLICATE_CALLBACKS = metrics.Counter(
+    'mpesa_callback_duplicates_total', 'Callbacks repeating a recently received receipt', ('type',))
+FAILED_CALLBACKS = metrics.Counter(
+    'mpesa_callback_failures_total', 'Callback requests that raised, by exception', ('type', 'reason'))
+HANDLER_SECONDS = metrics.Histogram('mpesa_callback_handler_seconds', 'Callback request handling time', ('type',))
+DB_WRITE_SECONDS = metrics.Histogram(
+    'mpesa_db_write_seconds', 'Callback insert time (row, rollups, search index) before commit')
+DB_COMMIT_SECONDS = metrics.Histogram('mpesa_db_commit_seconds', 'Callback insert commit time')
+EMIT_SECONDS = metrics.Histogram('mpesa_emit_seconds', 'Time to encode and queue a notification for all rooms')
+
+
+def _sockets_per_room():
+    rooms = socketio.server.manager.rooms.get('/', {})
+    # Every socket also sits in a room named after its own sid; leave those out
+    return {(room,): len(members) for room, members in list(rooms.items())
+            if room is not None and room not in members}
+
+
+metrics.Gauge('mpesa_sockets_connected', 'Connected Socket.IO clients',
+              lambda: len(socketio.server.manager.rooms.get('/', {}).get(None, ())))
+metrics.Gauge('mpesa_sockets', 'Connected Socket.IO clients per room', _sockets_per_room, ('room',))
+metrics.CallbackCounter('mpesa_send_queue_events_total', 'Send queue outcomes (see /api/queues)',
+                        lambda: {(k,): v for k, v in send_queues.totals.items()}, ('event',))
+metrics.Gauge('mpesa_send_queue_depth', 'Notifications queued for all clients', lambda: send_queues.stats(top=0)['queued'])
+metrics.CallbackCounter('mpesa_delivery_events_total', 'Acknowledged delivery outcomes (see /api/delivery)',
+                        lambda: {(k,): v for k, v in delivery.totals.items()}, ('event',))
+
+
+def _observe_db_write(write_seconds, commit_seconds):
+    DB_WRITE_SECONDS.observe(write_seconds)
+    DB_COMMIT_SECONDS.observe(commit_seconds)
+
+
+store.on_write = _observe_db_write
+
+# Daraja retries callbacks it thinks were not received; remember recent
+# receipts per callback type to count the repeats
+_recent_receipts = SeenIds(capacity=int(os.getenv('DUPLICATE_WINDOW', '10000')))
+
+
+def _instrumented(cb_type):
+    """Time a callback route and count the requests that raise."""
+    def decorate(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return view(*args, **kwargs)
+            except Exception as e:
+                FAILED_CALLBACKS.inc(cb_type, type(e).__name__)
+                raise
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - started, cb_type)
+        return wrapper
+    return decorate
+
+
+def _store_and_notify(cb_type, merchant, data):
+    """Persist a callback and broadcast it to all connected clients.
+
+    The payload is normalized once; that record feeds the rollups, the
+    search index and the notification, and each notification variant is
+    encoded once and queued for every client in its room.
+    """
+    created_at = datetime.now(UTC).isoformat()
+    rec = normalize_callback(cb_type, data, created_at)
+    CALLBACKS.inc(cb_type, rec['shortcode'] or str(merchant or ''), 'ok' if rec['ok'] else 'failed')
+    if rec['transaction_id'] and not _recent_receipts.add(f"{cb_type}:{rec['transaction_id']}"):
+        DUPLICATE_CALLBACKS.inc(cb_type)
+    # get_json cached the body, so get_data is the raw bytes without a re-read
+    rid = store.insert(merchant, cb_type, data, created_at=created_at, raw=request.get_data(), rec=rec)
+    msg = build_notification(rid, rec, merchant)
+    try:
+        if _log_sample('broadcast'):
+            log.info("broadcasting %s notification %s (%d callbacks so far)", cb_type, rid, _log_sample.count('broadcast'))
+        started = time.perf_counter()
+        send_queues.send(NOTIFY_ROOM, 'notification', msg, ack_id=rid)
+        send_queues.send(NOTIFY_RAW_ROOM, 'notification', dict(msg, data=data), ack_id=rid)
+        EMIT_SECONDS.observe(time.perf_counter() - started)
+    except Exception:
+        log.exception("emitting notification %s failed", rid)
+
+
 @app.route('/stk-callback', methods=['POST'])
+@_instrumented('stk')
 def stk_callback():
     data = request.get_json(force=True)
-    # Persist callback
     merchant = data.get('merchant_id') or data.get('BusinessShortCode') or data.get('ShortCode')
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    try:
-        payload_text = json.dumps(data)
-    except Exception:
-        payload_text = str(data)
-    c.execute('INSERT INTO callbacks (merchant_id, type, payload, created_at) VALUES (?, ?, ?, ?)',
-              (merchant, 'stk', payload_text, datetime.now(UTC).isoformat()))
-    conn.commit()
-    conn.close()
-
-    # Broadcast to all connected clients
-    try:
-        print(f"[{datetime.now().isoformat()}] Broadcasting STK notification to all merchants")
-        socketio.emit('notification', {
-            'type': 'transaction', 
-            'data': data
-        })  # No room/to parameter means broadcast to all
-    except Exception as e:
-        print(f"Error emitting notification: {e}")
+    _store_and_notify('stk', merchant, data)
     return jsonify({'status': 'ok'})
 
 @app.route('/c2b-callback', methods=['POST'])
+@_instrumented('c2b_confirmation')
 def c2b_callback():
     """Handle C2B confirmation callback."""
     data = request.get_json(force=True)
-    merchant = data.get('BusinessShortCode')
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    try:
-        payload_text = json.dumps(data)
-    except Exception:
-        payload_text = str(data)
-    c.execute('INSERT INTO callbacks (merchant_id, type, payload, created_at) VALUES (?, ?, ?, ?)',
-              (merchant, 'c2b_confirmation', payload_text, datetime.now(UTC).isoformat()))
-    conn.commit()
-    conn.close()
-
-    try:
-        print(f"[{datetime.now().isoformat()}] Broadcasting C2B confirmation to all merchants")
-        socketio.emit('notification', {
-            'type': 'c2b_confirmation', 
-            'data': data
-        })
-    except Exception as e:
-        print(f"Error emitting notification: {e}")
+    _store_and_notify('c2b_confirmation', data.get('BusinessShortCode'), data)
     return jsonify({'ResultCode': '0', 'ResultDesc': 'Success'})
 
 @app.route('/c2b-validation', methods=['POST'])
+@_instrumented('c2b_validation')
 def c2b_validation():
     """Handle C2B validation callback.
     This endpoint validates incoming C2B transactions before they are processed.
     """
     data = request.get_json(force=True)
-    merchant = data.get('BusinessShortCode')
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    try:
-        payload_text = json.dumps(data)
-    except Exception:
-        payload_text = str(data)
-    c.execute('INSERT INTO callbacks (merchant_id, type, payload, created_at) VALUES (?, ?, ?, ?)',
-              (merchant, 'c2b_validation', payload_text, datetime.now(UTC).isoformat()))
-    conn.commit()
-    conn.close()
-
-    try:
-        print(f"[{datetime.now().isoformat()}] Broadcasting C2B validation to all merchants")
-        socketio.emit('notification', {
-            'type': 'c2b_validation', 
-            'data': data
-        })
-    except Exception as e:
-        print(f"Error emitting notification: {e}")
+    _store_and_notify('c2b_validation', data.get('BusinessShortCode'), data)
     
     # Accept all transactions (customize validation logic as needed)
     return jsonify({
@@ -153,30 +222,258 @@ def c2b_validation():
     })
 
 
+def _int_arg(name, default=None):
+    """Integer query parameter, or ``default`` if absent; ValueError if it is not an integer."""
+    value = request.args.get(name, '').strip()
+    return int(value) if value else default
+
+
 @app.route('/api/callbacks', methods=['GET'])
 def api_callbacks():
     """Return recent callbacks stored in the server DB.
 
     Query params:
-    - limit: number of records to return (default 100)
+    - limit: number of records to return (default 100, max 1000; use
+      /api/export for bulk downloads)
     """
-    limit = int(request.args.get('limit', '100'))
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('SELECT id, merchant_id, type, payload, created_at FROM callbacks ORDER BY id DESC LIMIT ?', (limit,))
-    rows = c.fetchall()
-    conn.close()
+    try:
+        limit = max(1, min(_int_arg('limit', 100), 1000))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    rows = store.latest(limit)
 
     out = []
     for rid, merchant_id, typ, payload_text, created_at in rows:
-        try:
-            payload = json.loads(payload_text)
-        except Exception:
-            payload = payload_text
+        payload = decode_payload(payload_text)
         out.append({'id': rid, 'merchant_id': merchant_id, 'type': typ, 'payload': payload, 'created_at': created_at})
     return jsonify({'callbacks': out})
 
 
+@app.route('/api/transactions', methods=['GET'])
+def api_transactions():
+    """Return stored payments as flat transaction rows, newest first.
+
+    Designed for paging, so clients can stream history instead of pulling one
+    huge response:
+    - limit: page size (default 100, max 1000)
+    - before_id: only rows with id < before_id (walk back through history)
+    - since_id: only rows with id > since_id (fetch the delta since a known id)
+    - shortcode: comma-separated list of till/paybill numbers to include
+
+    C2B validation callbacks are skipped; the confirmation that follows is the
+    actual payment.
+    """
+    try:
+        limit = max(1, min(_int_arg('limit', 100), 1000))
+        before_id = _int_arg('before_id')
+        since_id = _int_arg('since_id')
+    except ValueError:
+        return jsonify({'error': 'limit, before_id and since_id must be integers'}), 400
+    shortcodes = [s for s in (request.args.get('shortcode') or '').split(',') if s]
+    rows = store.latest(limit, before_id=before_id, since_id=since_id,
+                        shortcodes=shortcodes, exclude_types=['c2b_validation'])
+
+    out = []
+    for rid, _merchant_id, typ, payload_text, created_at in rows:
+        rec = normalize_callback(typ, decode_payload(payload_text), created_at)
+        out.append({
+            'id': rid,
+            'type': typ,
+            'time': format_time(rec['timestamp']),
+            'timestamp': rec['timestamp'],
+            'amount': rec['amount'],
+            # Masked like the live notifications, so both paths show the same
+            'phone': display_phone(rec['phone']),
+            'status': rec['status'],
+            'transaction_id': rec['transaction_id'],
+            'shortcode': rec['shortcode'],
+        })
+    return jsonify(out)
+
+
+EXPORT_FIELDS = ['id', 'created_at', 'type', 'shortcode', 'transaction_id', 'time', 'amount',
+                 'phone', 'name', 'bill_ref', 'status', 'ok']
+
+
+def _export_rows(chunks, include_payload):
+    """Flatten stored callbacks chunk by chunk into export dicts."""
+    for rows in chunks:
+        out = []
+        for rid, merchant_id, typ, payload_text, created_at in rows:
+            payload = decode_payload(payload_text)
+            rec = normalize_callback(typ, payload, created_at)
+            row = {
+                'id': rid,
+                'created_at': created_at,
+                'type': typ,
+                'shortcode': rec['shortcode'] or merchant_id or '',
+                'transaction_id': rec['transaction_id'],
+                'time': format_time(rec['timestamp']),
+                'amount': rec['amount'],
+                'phone': rec['phone'],
+                'name': rec['name'],
+                'bill_ref': rec['bill_ref'],
+                'status': rec['status'],
+                'ok': rec['ok'],
+            }
+            if include_payload:
+                row['payload'] = payload
+            out.append(row)
+        yield out
+
+
+def _ndjson_chunks(row_chunks):
+    for rows in row_chunks:
+        yield ''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows).encode('utf-8')
+
+
+def _csv_chunks(row_chunks, fields):
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=fields, extrasaction='ignore')
+    writer.writeheader()
+    for rows in row_chunks:
+        for row in rows:
+            if 'payload' in row:
+                row = dict(row, payload=json.dumps(row['payload'], ensure_ascii=False))
+            writer.writerow(row)
+        yield buf.getvalue().encode('utf-8')
+        buf.seek(0)
+        buf.truncate()
+
+
+def _gzip_chunks(chunks):
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    for chunk in chunks:
+        data = gz.compress(chunk)
+        if data:
+            yield data
+    yield gz.flush()
+
+
+@app.route('/api/export', methods=['GET'])
+def api_export():
+    """Stream stored callbacks as NDJSON or CSV for reconciliation.
+
+    The response is generated chunk by chunk from a keyset-paginated query,
+    so memory use does not depend on the size of the export.
+
+    Query params:
+    - format: 'ndjson' (default) or 'csv'
+    - from, to: inclusive dates (YYYY-MM-DD, UTC, on created_at)
+    - shortcode: comma-separated list of till/paybill numbers
+    - type: comma-separated callback types (default: all but c2b_validation)
+    - payload=1: include the raw callback payload
+    - gzip=1: gzip the download
+    """
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify({'error': "format must be 'ndjson' or 'csv'"}), 400
+    start = request.args.get('from')
+    end = request.args.get('to')
+    try:
+        for d in (start, end):
+            if d:
+                datetime.strptime(d, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'error': 'from/to must be YYYY-MM-DD'}), 400
+    shortcodes = [s for s in (request.args.get('shortcode') or '').split(',') if s]
+    types = [t for t in (request.args.get('type') or '').split(',') if t] or ['stk', 'c2b_confirmation']
+    include_payload = request.args.get('payload') in ('1', 'true', 'yes')
+    use_gzip = request.args.get('gzip') in ('1', 'true', 'yes')
+
+    row_chunks = _export_rows(store.iter_callbacks(start, end, shortcodes, types), include_payload)
+    if fmt == 'csv':
+        fields = EXPORT_FIELDS + (['payload'] if include_payload else [])
+        body = _csv_chunks(row_chunks, fields)
+        mimetype = 'text/csv'
+    else:
+        body = _ndjson_chunks(row_chunks)
+        mimetype = 'application/x-ndjson'
+    filename = f"callbacks_{start or 'all'}_{end or 'now'}.{fmt}"
+    if use_gzip:
+        body = _gzip_chunks(body)
+        mimetype = 'application/gzip'
+        filename += '.gz'
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+@app.route('/api/search', methods=['GET'])
+def api_search():
+    """Find payments by customer name, bill reference, receipt or phone.
+
+    Query params:
+    - q: search text; every word is a prefix match ('wanj 0712', 'INV-7', '5678'
+      for a phone ending in 5678)
+    - limit: number of results (default 20, max 100)
+    - shortcode: comma-separated list of till/paybill numbers
+
+    Results are ranked best match first.
+    """
+    if not store.fts:
+        return jsonify({'error': 'search is not available (SQLite built without FTS5)'}), 501
+    q = (request.args.get('q') or '').strip()
+    if not q:
+        return jsonify({'error': 'q is required'}), 400
+    try:
+        limit = max(1, min(_int_arg('limit', 20), 100))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    shortcodes = [s for s in (request.args.get('shortcode') or '').split(',') if s]
+    results = store.search(q, limit, shortcodes)
+    for r in results:
+        r['time'] = format_time(r['timestamp'])
+    return jsonify({'q': q, 'results': results})
+
+
+@app.route('/api/queues', methods=['GET'])
+def api_queues():
+    """Outbound Socket.IO queue metrics: totals sent/dropped/coalesced/disconnected,
+    current depth, and the most backed-up clients."""
+    return jsonify(send_queues.stats())
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_view():
+    """Prometheus text exposition of the counters and histograms above."""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@app.route('/api/delivery', methods=['GET'])
+def api_delivery():
+    """Acknowledged delivery metrics: tracked/acked/redelivered/expired counts,
+    the ack latency histogram, and the clients with the most unacked notifications."""
+    return jsonify(delivery.stats())
+
+
+@app.route('/api/summary', methods=['GET'])
+def api_summary():
+    """Per-shop totals over a date range, answered from the rollup tables.
+
+    Query params:
+    - from, to: inclusive dates (YYYY-MM-DD); default today
+    - shortcode: comma-separated list of till/paybill numbers
+    - granularity: 'day' (default) or 'hour'
+
+    Each row has count and total of successful payments, min/max amount and
+    the number of failed payments.
+    """
+    today = datetime.now(ROLLUP_TZ).strftime('%Y-%m-%d')
+    start = request.args.get('from') or today
+    end = request.args.get('to') or start
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in ROLLUP_TABLES:
+        return jsonify({'error': "granularity must be 'day' or 'hour'"}), 400
+    try:
+        for d in (start, end):
+            datetime.strptime(d, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'error': 'from/to must be YYYY-MM-DD'}), 400
+    shortcodes = [s for s in (request.args.get('shortcode') or '').split(',') if s]
+    rows, totals = store.summary(start, end, shortcodes, granularity)
+    return jsonify({'from': start, 'to': end, 'granularity': granularity, 'rows': rows, 'totals': totals})
+
+
 @app.route('/api/login', methods=['POST'])
 def api_login():
     j = request.get_json(force=True)
@@ -198,20 +495,26 @@ def on_connect():
     except Exception:
         sid = 'unknown'
     addr = request.remote_addr if hasattr(request, 'remote_addr') else 'unknown'
-    now = datetime.now(UTC).isoformat()
-    # Print query params to help debug merchant_id passing
-    try:
-        args = request.args.to_dict()
-    except Exception:
-        args = {}
-    print(f"[{now}] Client connected: sid={sid} addr={addr} args={args}")
+
+    # Clients opt in to the raw Daraja payload with ?raw=1, to MessagePack
+    # packets with ?codec=msgpack (JSON unless both sides have msgpack) and to
+    # batched notifications with ?batch=1
+    room = NOTIFY_RAW_ROOM if request.args.get('raw') in ('1', 'true', 'yes') else NOTIFY_ROOM
+    join_room(room)
+    send_queues.join(sid, room, codec=wire_format.negotiate(request.args.get('codec')),
+                     batch=request.args.get('batch') in ('1', 'true', 'yes'))
+    client_id = request.args.get('client_id')
+    if client_id and request.args.get('ack') in ('1', 'true', 'yes'):
+        delivery.bind(client_id, sid)
+    # Query args are not logged: they carry the auth token
+    log.info("client connected sid=%s addr=%s room=%s client_id=%s", sid, addr, room, client_id or '-')
 
     # If merchant_id passed as query param, auto-join that room
     try:
         merchant_q = request.args.get('merchant_id')
         if merchant_q:
             join_room(merchant_q)
-            print(f"[{now}] sid={sid} joined room {merchant_q} (from query param)")
+            log.debug("sid=%s joined room %s (from query param)", sid, merchant_q)
     except Exception:
         pass
 
@@ -225,8 +528,13 @@ def on_join(data):
             sid = request.sid
         except Exception:
             sid = 'unknown'
-        now = datetime.now(UTC).isoformat()
-        print(f"[{now}] sid={sid} joined room {merchant} via join event")
+        log.debug("sid=%s joined room %s via join event", sid, merchant)
+
+@socketio.on('notification_ack')
+def on_notification_ack(data):
+    ids = data.get('ids') if isinstance(data, dict) else None
+    if ids:
+        delivery.ack(request.sid, ids)
 
 @socketio.on('disconnect')
 def on_disconnect():
@@ -234,8 +542,9 @@ def on_disconnect():
         sid = request.sid
     except Exception:
         sid = 'unknown'
-    now = datetime.now(UTC).isoformat()
-    print(f"[{now}] Client disconnected: sid={sid}")
+    delivery.unbind(sid)
+    send_queues.leave(sid)
+    log.info("client disconnected sid=%s", sid)
 
 if __name__ == '__main__':
     socketio.run(app, host='0.0.0.0', port=5000)
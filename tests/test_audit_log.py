@@ -0,0 +1,60 @@
+import json
+import os
+import time
+
+from utils.audit_log import AuditLog, redact
+
+
+def read_lines(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_redact_hides_credentials_and_masks_phones():
+    record = {
+        'phone': '254712345678',
+        'request': {
+            'headers': {'Authorization': 'Bearer abc.def', 'Content-Type': 'application/json'},
+            'body': {'Password': 'c2VjcmV0', 'PartyA': 254712345678, 'Amount': 10},
+        },
+        'error': 'token rejected: Basic dXNlcjpwYXNz',
+        'token_ms': 112.4,
+    }
+    out = redact(record)
+    assert out['phone'] == '********5678'
+    assert out['request']['headers'] == {'Authorization': '***', 'Content-Type': 'application/json'}
+    assert out['request']['body'] == {'Password': '***', 'PartyA': '********5678', 'Amount': 10}
+    assert out['error'] == 'token rejected: Basic ***'
+    assert out['token_ms'] == 112.4
+    # The caller's record is left alone
+    assert record['request']['body']['Password'] == 'c2VjcmV0'
+
+
+def test_rotates_by_size_and_keeps_backup_count(tmp_path):
+    path = str(tmp_path / 'audit.log')
+    audit = AuditLog(path, max_bytes=300, rotate_seconds=0, backup_count=2, flush_interval=0.01)
+    for n in range(40):
+        audit.write({'event': 'stk_push', 'n': n, 'phone': '254712345678'})
+    audit.close()
+
+    assert os.path.exists(path + '.1') and os.path.exists(path + '.2')
+    assert not os.path.exists(path + '.3')
+    newest = read_lines(path)
+    assert newest[-1]['n'] == 39
+    assert all(r['phone'] == '********5678' and 'ts' in r for r in newest)
+    assert os.path.getsize(path + '.1') <= 300 + len(json.dumps(newest[-1])) + 1
+
+
+def test_rotates_a_stale_file_left_by_a_previous_run(tmp_path):
+    path = str(tmp_path / 'audit.log')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'event': 'old'}) + '\n')
+    day_ago = time.time() - 86400
+    os.utime(path, (day_ago, day_ago))
+
+    audit = AuditLog(path, max_bytes=0, rotate_seconds=3600, flush_interval=0.01)
+    audit.write({'event': 'new'})
+    audit.close()
+
+    assert [r['event'] for r in read_lines(path + '.1')] == ['old']
+    assert [r['event'] for r in read_lines(path)] == ['new']
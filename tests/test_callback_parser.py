@@ -0,0 +1,31 @@
+from utils.callback_parser import build_notification, normalize_callback, normalize_notification
+
+
+def stk_payload(phone):
+    return {'Body': {'stkCallback': {
+        'MerchantRequestID': '1', 'CheckoutRequestID': 'ws_CO_1', 'ResultCode': 0, 'ResultDesc': 'ok',
+        'CallbackMetadata': {'Item': [
+            {'Name': 'Amount', 'Value': 100},
+            {'Name': 'MpesaReceiptNumber', 'Value': 'RK1'},
+            {'Name': 'PhoneNumber', 'Value': phone},
+        ]},
+    }}}
+
+
+def test_compact_notification_keeps_its_callback_id():
+    msg = build_notification(42, normalize_callback('stk', stk_payload(254712345678)), '600977')
+    rec = normalize_notification(msg)
+    assert rec['id'] == 42
+    assert (rec['amount'], rec['transaction_id']) == (100.0, 'RK1')
+
+
+def test_phone_is_masked_the_same_for_every_message_shape():
+    compact = normalize_notification(build_notification(1, normalize_callback('stk', stk_payload(254712345678))))
+    envelope = normalize_notification({'type': 'stk', 'data': stk_payload(254712345678)})
+    assert compact['phone'] == envelope['phone'] == '********5678'
+
+
+def test_null_phone_stays_empty():
+    rec = normalize_callback('stk', stk_payload(None))
+    assert rec['phone'] == ''
+    assert normalize_notification(build_notification(1, rec))['phone'] == ''
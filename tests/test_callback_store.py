@@ -0,0 +1,142 @@
+from datetime import datetime, timedelta, UTC
+
+import pytest
+
+import callback_store
+from callback_store import CallbackStore
+
+NOW = datetime(2025, 10, 26, 12, 0, tzinfo=UTC)
+OLD = NOW - timedelta(days=120)
+
+
+def stk(amount, receipt, phone=254712345678, ok=True):
+    body = {'MerchantRequestID': '1', 'CheckoutRequestID': 'ws_CO_' + receipt,
+            'ResultCode': 0 if ok else 1032, 'ResultDesc': 'ok' if ok else 'Request Cancelled by user.'}
+    if ok:
+        body['CallbackMetadata'] = {'Item': [
+            {'Name': 'Amount', 'Value': amount},
+            {'Name': 'MpesaReceiptNumber', 'Value': receipt},
+            {'Name': 'PhoneNumber', 'Value': phone},
+        ]}
+    return {'Body': {'stkCallback': body}}
+
+
+def c2b(amount, trans_id, shortcode='600977'):
+    return {'TransactionType': 'Pay Bill', 'TransID': trans_id, 'TransAmount': str(amount),
+            'BusinessShortCode': shortcode, 'MSISDN': '254712345678', 'FirstName': 'JOHN'}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return CallbackStore(str(tmp_path / 'callbacks.db'))
+
+
+def all_rows(store, **kwargs):
+    return [row for chunk in store.iter_callbacks(**kwargs) for row in chunk]
+
+
+def test_new_database_has_complete_rollups(store):
+    assert store.rollups_complete()
+
+
+def test_iter_callbacks_merges_rows_kept_in_db_below_the_archive(store, monkeypatch):
+    # stk is retained in the database, so the archiver leaves it behind with
+    # an id lower than the archived c2b row after it
+    monkeypatch.setattr(callback_store, 'RETENTION_DAYS', {'c2b_validation': 7, 'stk': 400})
+    kept = store.insert(None, 'stk', stk(100, 'RK1'), created_at=OLD.isoformat())
+    archived = store.insert('600977', 'c2b_confirmation', c2b(250, 'RK2'), created_at=OLD.isoformat())
+    recent = store.insert('600977', 'c2b_confirmation', c2b(50, 'RK3'), created_at=NOW.isoformat())
+
+    assert store.archive(now=NOW) == (1, 0)
+    assert [row[0] for row in all_rows(store)] == [kept, archived, recent]
+    assert [row[0] for row in all_rows(store, after_id=kept)] == [archived, recent]
+
+
+def test_rebuild_rollups_counts_archived_and_retained_rows(store, monkeypatch):
+    monkeypatch.setattr(callback_store, 'RETENTION_DAYS', {'c2b_validation': 7, 'stk': 400})
+    store.insert(None, 'stk', stk(100, 'RK1'), created_at=OLD.isoformat())
+    store.insert('600977', 'c2b_confirmation', c2b(250, 'RK2'), created_at=OLD.isoformat())
+    store.archive(now=NOW)
+    start, end = (OLD - timedelta(days=1)).strftime('%Y-%m-%d'), (OLD + timedelta(days=1)).strftime('%Y-%m-%d')
+    before = store.summary(start, end)[1]
+
+    assert store.rebuild_rollups() == 2
+    totals = store.summary(start, end)[1]
+    assert totals == before
+    assert sum(t['count'] for t in totals) == 2
+
+
+def test_interrupted_archive_row_is_yielded_once(store):
+    rid = store.insert('600977', 'c2b_confirmation', c2b(250, 'RK2'), created_at=OLD.isoformat())
+    store.archive(now=NOW)
+    # Same row back in the database, as after a crash between writing the
+    # archive file and deleting the rows
+    row = next(iter(store._read_archive(OLD.strftime('%Y-%m'))))
+    conn = store._connect()
+    with conn:
+        conn.execute('INSERT INTO callbacks (id, merchant_id, type, payload, created_at) VALUES (?, ?, ?, ?, ?)', row)
+    conn.close()
+    assert [r[0] for r in all_rows(store)] == [rid]
+
+
+def test_latest_pages_back_into_the_archive(store):
+    ids = [store.insert('600977', 'c2b_confirmation', c2b(i, f'RK{i}'), created_at=OLD.isoformat())
+           for i in range(1, 8)]
+    ids += [store.insert('600977', 'c2b_confirmation', c2b(9, 'RK9'), created_at=NOW.isoformat())]
+    store.archive(now=NOW)
+
+    seen, before = [], None
+    while True:
+        page = store.latest(limit=3, before_id=before)
+        if not page:
+            break
+        seen += [row[0] for row in page]
+        before = page[-1][0]
+    assert seen == sorted(ids, reverse=True)
+
+
+def test_archive_waits_for_rollup_backfill(tmp_path):
+    path = str(tmp_path / 'old.db')
+    store = CallbackStore(path)
+    store.insert('600977', 'c2b_confirmation', c2b(250, 'RK2'), created_at=OLD.isoformat())
+    conn = store._connect()
+    with conn:
+        conn.execute('DELETE FROM store_meta')
+    conn.close()
+
+    assert store.archive(now=NOW) == (0, 0)
+    store.rebuild_rollups()
+    assert store.archive(now=NOW) == (1, 0)
+
+
+def test_rebuild_and_archive_exclude_each_other_across_processes(store):
+    # Another process (e.g. the server's archiver) holds the lease
+    assert store._acquire_lease('archive-elsewhere')
+    with pytest.raises(RuntimeError):
+        store.rebuild_rollups()
+    assert store.archive(now=NOW) == (0, 0)
+
+    store._release_lease('archive-elsewhere')
+    store.rebuild_rollups()
+    assert store._acquire_lease('next')
+
+
+def test_expired_lease_is_taken_over(store):
+    assert store._acquire_lease('crashed', seconds=-1)
+    assert store._acquire_lease('rebuild')
+
+
+def test_rebuild_counts_callbacks_stored_while_it_runs(store, monkeypatch):
+    store.insert('600977', 'c2b_confirmation', c2b(100, 'RK1'), created_at=NOW.isoformat())
+    scan = store.iter_callbacks
+
+    def scan_then_insert(**kwargs):
+        for chunk in scan(**kwargs):
+            yield chunk
+            store.insert('600977', 'c2b_confirmation', c2b(50, 'RK2'), created_at=NOW.isoformat())
+
+    monkeypatch.setattr(store, 'iter_callbacks', scan_then_insert)
+    store.rebuild_rollups(chunk_size=1)
+    day = NOW.astimezone(callback_store.ROLLUP_TZ).strftime('%Y-%m-%d')
+    (total,) = store.summary(day, day)[1]
+    assert (total['count'], total['total']) == (2, 150.0)
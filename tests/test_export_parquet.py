@@ -0,0 +1,39 @@
+import pytest
+
+import export_parquet
+from callback_store import CallbackStore
+from test_callback_store import NOW, c2b, stk
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / 'callbacks.db')
+    store = CallbackStore(path)
+    store.insert('600977', 'stk', stk(100, 'RK1'), created_at=NOW.isoformat())
+    store.insert('600977', 'c2b_validation', c2b(50, 'RK2'), created_at=NOW.isoformat())
+    store.insert('600977', 'c2b_confirmation', c2b(50, 'RK2'), created_at=NOW.isoformat())
+    store.insert('600977', 'c2b_confirmation', {'TransID': 'RK3', 'TransAmount': '20'}, created_at='yesterday')
+    return path
+
+
+def test_export_needs_pyarrow(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(export_parquet, '_HAS_PYARROW', False)
+    with pytest.raises(RuntimeError, match='pip install pyarrow'):
+        export_parquet.export(db, str(tmp_path / 'out'))
+
+
+def test_export_writes_payments_only_and_keeps_rows_without_a_time(db, tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    out = tmp_path / 'out'
+    assert export_parquet.export(db, str(out)) == 3
+    rows = {}
+    for path in out.glob('day=*/shortcode=*/*.parquet'):
+        for row in pq.read_table(path).to_pylist():
+            rows[row['transaction_id']] = (path.parent.parent.name, row)
+    assert sorted(rows) == ['RK1', 'RK2', 'RK3']
+    assert all(row['type'] != 'c2b_validation' for _day, row in rows.values())
+    day, undated = rows['RK3']
+    assert day == 'day=' + export_parquet.UNKNOWN_DAY
+    assert undated['timestamp'] is None
+    # Incremental: a second run finds nothing new
+    assert export_parquet.export(db, str(out)) == 0
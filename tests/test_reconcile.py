@@ -0,0 +1,71 @@
+import pytest
+
+import reconcile
+from callback_store import CallbackStore
+from test_callback_store import NOW, c2b, stk
+
+STATEMENT = """Account Name,Shop
+Receipt No.,Completion Time,Details,Transaction Status,Paid In,Withdrawn
+RK1,2025-10-25 00:00:00,Pay Bill,Completed,100.00,
+RK2,2025-10-26 12:05:00,Pay Bill,Completed,"1,000.00",
+RK3,2025-10-27 23:00:00,Pay Bill,Completed,30.00,
+RK3,2025-10-27 23:00:00,Pay Bill,Completed,30.00,
+RK9,2025-10-26 12:20:00,Pay Bill,Failed,5.00,
+"""
+
+
+@pytest.fixture
+def statement(tmp_path):
+    path = tmp_path / 'statement.csv'
+    path.write_text(STATEMENT, encoding='utf-8')
+    return reconcile.load_statement(str(path))
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = CallbackStore(str(tmp_path / 'callbacks.db'))
+    at = NOW.isoformat()
+    # STK results are stored without a merchant_id; the shortcode is in the payload
+    store.insert(None, 'stk', dict(stk(100, 'RK1'), BusinessShortCode='600977'), created_at=at)
+    store.insert('600977', 'c2b_confirmation', c2b(999, 'RK2'), created_at=at)
+    store.insert('600977', 'c2b_confirmation', c2b(10, 'RK4'), created_at=at)
+    store.insert('600977', 'c2b_confirmation', c2b(10, 'RK4'), created_at=at)
+    store.insert('600978', 'c2b_confirmation', c2b(10, 'RK5', shortcode='600978'), created_at=at)
+    store.insert(None, 'stk', stk(10, 'RK6'), created_at=at)
+    return store
+
+
+def issues_by_receipt(statement, callbacks, shortcodes=None):
+    return sorted((i['receipt'], i['issue']) for i in reconcile.reconcile(statement, callbacks, shortcodes))
+
+
+def test_statement_skips_preamble_and_failed_lines(statement):
+    assert statement.receipts == ['RK1', 'RK2', 'RK3', 'RK3']
+    assert list(statement.amounts) == [100.0, 1000.0, 30.0, 30.0]
+
+
+def test_reconcile_flags_every_kind_of_difference(statement, store):
+    callbacks = reconcile.load_callbacks(store)
+    assert issues_by_receipt(statement, callbacks) == [
+        ('RK2', 'amount_mismatch'),
+        ('RK3', 'duplicate_statement'),
+        ('RK3', 'missing_callback'),
+        ('RK4', 'duplicate_callback'),
+        ('RK4', 'not_in_statement'),
+        ('RK5', 'not_in_statement'),
+        ('RK6', 'not_in_statement'),
+    ]
+
+
+def test_shortcode_filter_matches_stk_results_by_their_payload(statement, store):
+    callbacks = reconcile.load_callbacks(store, shortcodes=['600977'])
+    assert 'RK1' in callbacks.receipts
+    assert 'RK5' not in callbacks.receipts
+    # RK6 has no shortcode: kept for matching, but not reported for this till
+    assert issues_by_receipt(statement, callbacks, ['600977']) == [
+        ('RK2', 'amount_mismatch'),
+        ('RK3', 'duplicate_statement'),
+        ('RK3', 'missing_callback'),
+        ('RK4', 'duplicate_callback'),
+        ('RK4', 'not_in_statement'),
+    ]
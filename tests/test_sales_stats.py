@@ -0,0 +1,65 @@
+from datetime import datetime
+
+from utils.sales_stats import ALL_TILLS, SalesAggregator, format_kes
+
+NOON = datetime(2025, 10, 26, 12, 0).timestamp()
+MIDNIGHT = datetime(2025, 10, 27, 0, 0).timestamp()
+
+
+def test_add_keeps_totals_per_till_and_overall():
+    stats = SalesAggregator(rate_window=10)
+    stats.seed([], now=NOON)
+    stats.add('600977', 100, NOON - 30)
+    stats.add('600977', 300, NOON - 20)
+    stats.add('600978', 50, NOON - 700)
+    stats.add('600978', None, NOON)
+    stats.add('600978', float('nan'), NOON)
+
+    snap = stats.snapshot(now=NOON)
+    assert snap['600977'] == {'count': 2, 'gross': 400.0, 'average': 200.0, 'per_minute': 0.2, 'last_hour': 2}
+    assert snap['600978']['per_minute'] == 0.0
+    assert snap['600978']['last_hour'] == 1
+    assert (snap[ALL_TILLS]['count'], snap[ALL_TILLS]['gross']) == (3, 450.0)
+    assert stats.tills() == ['600977', '600978']
+
+
+def test_day_totals_roll_over_at_midnight_but_the_rate_does_not():
+    stats = SalesAggregator()
+    stats.seed([], now=MIDNIGHT - 120)
+    stats.add('600977', 100, MIDNIGHT - 60)
+    stats.add('600977', 40, MIDNIGHT + 10)
+
+    snap = stats.snapshot(now=MIDNIGHT + 30)
+    assert (snap['600977']['count'], snap['600977']['gross']) == (1, 40.0)
+    assert snap['600977']['last_hour'] == 2
+
+
+def test_minute_bins_are_reused_a_day_later():
+    stats = SalesAggregator()
+    stats.seed([], now=NOON - 86400)
+    stats.add('600977', 10, NOON - 86400)
+    stats.add('600977', 10, NOON)
+    # Same slot, a day older than what it now holds: outside the window
+    stats.add('600977', 10, NOON - 86400)
+    assert stats.snapshot(now=NOON)['600977']['last_hour'] == 1
+
+
+def test_seed_replaces_totals_and_skips_old_or_invalid_payments():
+    stats = SalesAggregator()
+    stats.add('old', 5)
+    stats.seed([
+        ('600977', 100, NOON - 60),
+        ('600977', None, NOON - 60),
+        ('600977', 100, float('nan')),
+        ('600977', 100, NOON - 2 * 86400),
+        (None, 20, NOON - 60),
+    ], now=NOON)
+    snap = stats.snapshot(now=NOON)
+    assert set(snap) == {ALL_TILLS, '600977', ''}
+    assert snap[ALL_TILLS]['gross'] == 120.0
+
+
+def test_format_kes():
+    assert format_kes(14350) == 'KES 14,350'
+    assert format_kes(14350.5) == 'KES 14,350.50'
+    assert format_kes(float('nan')) == 'KES 0'
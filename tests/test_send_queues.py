@@ -0,0 +1,132 @@
+import json
+import time
+
+import pytest
+from socketio import packet
+
+from send_queues import SendQueues, parse_policies
+
+
+class FakeSocket:
+    def __init__(self, eio, eio_sid):
+        self.eio, self.eio_sid = eio, eio_sid
+
+    @property
+    def queue(self):
+        return self  # qsize(): nothing is ever written to the network
+
+    def qsize(self):
+        return len(self.eio.sent.get(self.eio_sid, []))
+
+
+class FakeEngineIO:
+    def __init__(self):
+        self.sockets = {}
+        self.sent = {}
+
+    def send_packet(self, eio_sid, pkt):
+        self.sent.setdefault(eio_sid, []).append(pkt)
+
+
+class FakeManager:
+    @staticmethod
+    def eio_sid_from_sid(sid, namespace):
+        return 'eio-' + sid
+
+
+class FakeServer:
+    packet_class = packet.Packet
+
+    def __init__(self):
+        self.manager = FakeManager()
+        self.eio = FakeEngineIO()
+        self.disconnected = []
+
+    def disconnect(self, sid, namespace=None):
+        self.disconnected.append(sid)
+
+
+class FakeSocketIO:
+    def __init__(self):
+        self.server = FakeServer()
+
+
+def events(packets):
+    """[event, data] of each encoded Socket.IO event packet."""
+    return [json.loads(p.data[1:]) for p in packets]
+
+
+def queued(queues, sid):
+    return [events(item[1])[0] for item in queues._clients[sid].queue]
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def sio():
+    return FakeSocketIO()
+
+
+def test_parse_policies():
+    assert parse_policies('notify=disconnect, notify_raw = drop_oldest,') == {
+        'notify': 'disconnect', 'notify_raw': 'drop_oldest'}
+    with pytest.raises(ValueError):
+        parse_policies('notify=block')
+
+
+def test_drop_oldest_keeps_the_newest_packets(sio):
+    # No Engine.IO socket registered, so the pump leaves the queue alone
+    queues = SendQueues(sio, max_queue=3)
+    queues.join('a', 'notify')
+    for n in range(5):
+        queues.send('notify', 'notification', {'id': n})
+    assert [data['id'] for _event, data in queued(queues, 'a')] == [2, 3, 4]
+    assert queues.stats()['dropped'] == 2
+
+
+def test_coalesce_replaces_the_packet_with_the_same_key(sio):
+    queues = SendQueues(sio, max_queue=3, policies={'stats': 'coalesce'})
+    queues.join('a', 'stats')
+    queues.send('stats', 'till', {'till': 1, 'gross': 10}, key=1)
+    queues.send('stats', 'till', {'till': 2, 'gross': 5}, key=2)
+    queues.send('stats', 'till', {'till': 1, 'gross': 30}, key=1)
+    assert [data for _event, data in queued(queues, 'a')] == [{'till': 1, 'gross': 30}, {'till': 2, 'gross': 5}]
+    assert queues.stats()['coalesced'] == 1
+
+
+def test_disconnect_policy_drops_a_client_whose_queue_is_full(sio):
+    queues = SendQueues(sio, max_queue=2, policies={'notify': 'disconnect'})
+    queues.join('slow', 'notify')
+    for n in range(3):
+        queues.send('notify', 'notification', {'id': n})
+    wait_for(lambda: sio.server.disconnected == ['slow'])
+    assert queues.stats()['clients'] == 0
+    assert queues.stats()['disconnected'] == 1
+
+
+def test_pump_keeps_at_most_max_in_flight_packets_unsent(sio):
+    queues = SendQueues(sio, max_queue=10, max_in_flight=2)
+    sio.server.eio.sockets['eio-a'] = FakeSocket(sio.server.eio, 'eio-a')
+    queues.join('a', 'notify')
+    for n in range(5):
+        queues.send('notify', 'notification', {'id': n})
+    wait_for(lambda: len(sio.server.eio.sent.get('eio-a', [])) == 2)
+    time.sleep(0.1)
+    assert [data['id'] for _event, data in events(sio.server.eio.sent['eio-a'])] == [0, 1]
+    assert len(queues._clients['a'].queue) == 3
+
+
+def test_batching_clients_get_one_packet_per_burst(sio):
+    queues = SendQueues(sio, batch_events={'notification': 'notification_batch'}, batch_window=60, batch_max=3)
+    queues.join('plain', 'notify')
+    queues.join('batched', 'notify', batch=True)
+    for n in range(3):
+        queues.send('notify', 'notification', {'id': n})
+    assert [event for event, _data in queued(queues, 'plain')] == ['notification'] * 3
+    assert queued(queues, 'batched') == [['notification_batch', [{'id': 0}, {'id': 1}, {'id': 2}]]]
+    assert queues.stats()['batches'] == 1
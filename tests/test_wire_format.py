@@ -0,0 +1,38 @@
+import pytest
+from socketio import packet
+
+from utils import wire_format
+
+pytest.importorskip('msgpack')
+
+NOTIFICATION = {'id': 42, 'type': 'stk', 'amount': 100.0, 'phone': '********5678', 'ok': True}
+
+
+def test_negotiation_falls_back_to_json(monkeypatch):
+    assert wire_format.negotiate('msgpack') == wire_format.MSGPACK
+    assert wire_format.negotiate('cbor') == wire_format.JSON
+    assert wire_format.negotiate(None) == wire_format.JSON
+    assert wire_format.codec_params() == {'codec': 'msgpack'}
+
+    monkeypatch.setattr(wire_format, '_HAS_MSGPACK', False)
+    assert wire_format.negotiate('msgpack') == wire_format.JSON
+    assert wire_format.codec_params() == {}
+    assert wire_format.client_serializer() == 'default'
+
+
+def test_client_decodes_msgpack_and_json_packets():
+    client_packet = wire_format.client_serializer()
+    server_packet = wire_format.packet_class(wire_format.MSGPACK)
+    assert wire_format.packet_class(wire_format.JSON) is None
+
+    binary = server_packet(packet.EVENT, data=['notification', NOTIFICATION]).encode()
+    assert isinstance(binary, bytes)
+    decoded = client_packet(encoded_packet=binary)
+    assert (decoded.packet_type, decoded.data) == (packet.EVENT, ['notification', NOTIFICATION])
+
+    text = packet.Packet(packet.EVENT, data=['notification', NOTIFICATION]).encode()
+    decoded = client_packet(encoded_packet=text)
+    assert decoded.data == ['notification', NOTIFICATION]
+
+    # What the client sends stays JSON
+    assert isinstance(client_packet(packet.EVENT, data=['ack', [42]]).encode(), str)
@@ -1,4 +1,3 @@
-import threading
 from PyQt6.QtWidgets import QMainWindow, QWidget, QHBoxLayout, QStackedWidget
 from PyQt6.QtCore import pyqtSignal
 
@@ -7,10 +6,15 @@ from ui.widgets.login_widget import LoginWidget
 from ui.widgets.dashboard_widget import DashboardWidget
 from ui.widgets.transactions_widget import TransactionsWidget
 from ui.widgets.settings_widget import SettingsWidget
-from ui.widgets.notification_widget import MultiDesktopNotificationWindow
+from ui.widgets.notification_widget import NotificationManager, NotificationCoalescer
 from ui.network.ws_client import WSClient
+from utils.callback_parser import mask_phone, normalize_notification
+from utils.log import get_logger
+from utils.sales_stats import format_kes
 from config import SERVER_URL
 
+log = get_logger(__name__)
+
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -71,29 +75,41 @@ class MainWindow(QMainWindow):
         self._wsclient = None
         self._merchant_id = None
         self._shop_codes = None
-        self._current_overlay = None
+        # Pre-built notification cards, reused for every payment
+        self._notifier = NotificationManager(parent=self)
+        self._notifier.activated.connect(self._on_notification_clicked)
+        # Bursts of payments become one summary card instead of one card each
+        self._coalescer = NotificationCoalescer(parent=self)
+        self._coalescer.ready.connect(self.show_multi_desktop_notification)
+
+        # Dashboard sales stats follow the transactions store
+        self.dashboard.set_stats_source(self.transactions.stats)
+
+        # Show the last shop's cached history straight away, before connecting
+        self.transactions.restore_last_context()
         
     def _on_notification(self, msg):
         """Handle incoming notifications by showing MULTI-DESKTOP overlay"""
         try:
-            print(f"[GUI Debug] _on_notification received message: {msg}")
-            formatted = self._format_notification(msg)
+            record = normalize_notification(msg)
+            formatted = self._format_notification(record)
             
             # Add to dashboard history
             self.dashboard.append_history(f"🔔 {formatted}")
             
             # Add to transactions
-            self.transactions.add_transaction(formatted)
-            
-            # Show MULTI-DESKTOP overlay that appears on ALL screens and virtual desktops
-            self.show_multi_desktop_notification("💰 PAYMENT RECEIVED", formatted)
+            self.transactions.add_record(record)
             
-            print("[GUI Debug] Multi-desktop notification processed successfully")
-            
-        except Exception as e:
-            print(f"[GUI Error] Error handling notification: {e}")
-            import traceback
-            print(traceback.format_exc())
+            # Show MULTI-DESKTOP overlay (coalesced with other payments in the same burst)
+            self._coalescer.add("💰 PAYMENT RECEIVED", formatted, record)
+
+        except Exception:
+            log.exception("error handling notification")
+
+    def _on_notification_batch(self, msgs):
+        """A burst delivered as one signal; each entry is handled like a single notification"""
+        for msg in msgs:
+            self._on_notification(msg)
 
     def switch_page(self, page_name):
         page_map = {
@@ -127,92 +143,53 @@ class MainWindow(QMainWindow):
         self.content_area.setCurrentWidget(self.dashboard)
         self.dashboard.set_context(merchant_id, shop_codes)
 
-        # Connect notifications
+        # Connect notifications. This runs again after every reconnect (e.g. when
+        # the server drops us as a slow consumer), so only connect a new client once.
         try:
-            print("[GUI Debug] Setting up notification handler...")
-            wsclient.signals.notification.connect(self._on_notification)
-            print("[GUI Debug] Notification handler connected successfully")
-        except Exception as e:
-            print(f"[GUI Error] Failed to connect notification handler: {e}")
-            import traceback
-            print(traceback.format_exc())
-
-        # Pre-load transactions
+            if getattr(self, '_notify_source', None) is not wsclient:
+                if getattr(self, '_notify_source', None) is not None:
+                    self._notify_source.signals.notification.disconnect(self._on_notification)
+                    self._notify_source.signals.notification_batch.disconnect(self._on_notification_batch)
+                wsclient.signals.notification.connect(self._on_notification)
+                wsclient.signals.notification_batch.connect(self._on_notification_batch)
+                self._notify_source = wsclient
+                log.debug("notification handler connected")
+        except Exception:
+            log.exception("failed to connect notification handler")
+
+        # Render this shop's local cache, then fetch only what is newer from the server
         try:
-            threading.Thread(target=self.transactions.load_from_server, args=(SERVER_URL, 200), daemon=True).start()
+            self.transactions.set_context(merchant_id, shop_codes)
+            self.transactions.load_from_server(SERVER_URL)
         except Exception:
             pass
 
-    def show_multi_desktop_notification(self, title: str, message: str):
+    def _on_notification_clicked(self, receipts):
+        """Drill down from a notification card to its transactions"""
+        if receipts:
+            self.switch_page('transactions')
+            self.transactions.show_receipts(receipts)
+
+    def show_multi_desktop_notification(self, title: str, message: str, receipts=None):
         """Show notification on ALL virtual desktops and ALL screens"""
         try:
-            print(f"[MultiDesktop] Showing notification on ALL desktops - Title: {title}")
-
-            # Create and show the MULTI-DESKTOP overlay
-            overlay = MultiDesktopNotificationWindow(title, message)
+            log.debug("showing notification on all desktops: %s", title)
 
-            # Store reference to prevent garbage collection
-            self._current_overlay = overlay
+            # Reuse a pooled card; queued if every slot is on screen
+            self._notifier.show(title, message, receipts)
 
-            # Show the overlay window (it will handle multiple screens/desktops)
-            overlay.show()
-            
-            print(f"[MultiDesktop] Notification displayed on {len(overlay.notification_cards)} screens")
-            
-        except Exception as e:
-            print(f"[MultiDesktop] Failed to show multi-desktop notification: {e}")
-            import traceback
-            print(traceback.format_exc())
-
-    def _format_notification(self, msg):
-        """Format notification message for display"""
-        try:
-            print(f"[GUI Debug] Formatting notification: {msg}")
-            if isinstance(msg, dict):
-                d = msg.get('data', {}) or {}
-                t = msg.get('type', '')
-                
-                if t == 'c2b_confirmation' or isinstance(d, dict) and ('TransID' in d or 'TransAmount' in d):
-                    txid = d.get('TransID') or d.get('TransID') or ''
-                    amt = d.get('TransAmount') or d.get('Amount') or ''
-                    phone = d.get('MSISDN') or d.get('Phone') or ''
-                    name = (d.get('FirstName') or '') + ' ' + (d.get('LastName') or '')
-                    formatted = f"NEW PAYMENT CONFIRMED!\n\n💵 Amount: KES {amt}\n📱 From: {phone}\n👤 Customer: {name.strip()}\n🔢 Reference: {txid}"
-                    print(f"[GUI Debug] Formatted notification: {formatted}")
-                    return formatted
-
-                if 'stkCallback' in str(d) or 'stkCallback' in str(msg):
-                    stk = None
-                    if isinstance(d, dict):
-                        stk = d.get('Body', {}).get('stkCallback') or d.get('stkCallback')
-                    if not stk and isinstance(msg, dict):
-                        stk = msg.get('stkCallback')
-                    if stk and isinstance(stk, dict):
-                        res_desc = stk.get('ResultDesc') or ''
-                        res_code = stk.get('ResultCode')
-                        cb = stk.get('CallbackMetadata') or stk.get('Callback') or {}
-                        items = cb.get('Item') if isinstance(cb, dict) else (cb if isinstance(cb, list) else None)
-                        amt = ''
-                        phone = ''
-                        txid = stk.get('MpesaReceiptNumber') or stk.get('CheckoutRequestID') or ''
-                        if items and isinstance(items, list):
-                            for it in items:
-                                name = it.get('Name') or it.get('name')
-                                val = it.get('Value')
-                                if not name:
-                                    continue
-                                if name.lower() == 'amount':
-                                    amt = str(val)
-                                if name.lower() in ('phonenumber', 'phone'):
-                                    phone = str(val)
-                        
-                        if res_code == 0:
-                            return f"✅ PAYMENT SUCCESSFUL!\n\n💵 Amount: KES {amt}\n📱 Phone: {phone}\n🧾 Receipt: {txid}"
-                        else:
-                            return f"❌ PAYMENT FAILED\n\n📱 Phone: {phone}\n⚠️ Reason: {res_desc}"
-
-            # Fallback for unknown format
-            return f"NEW TRANSACTION\n\n{str(msg)}"
-            
         except Exception:
-            return f"NEW TRANSACTION\n\n{str(msg)}"
\ No newline at end of file
+            log.exception("failed to show multi-desktop notification")
+
+    def _format_notification(self, rec):
+        """Format a normalized notification record for display"""
+        amount = format_kes(rec['amount']) if rec['amount'] is not None else ''
+        phone = mask_phone(rec['phone'])
+        if not rec['ok']:
+            return f"❌ PAYMENT FAILED\n\n📱 Phone: {phone}\n⚠️ Reason: {rec['status'].lstrip('❌ ')}"
+        if rec['type'] in ('stk', 'transaction'):
+            return f"✅ PAYMENT SUCCESSFUL!\n\n💵 Amount: {amount}\n📱 Phone: {phone}\n🧾 Receipt: {rec['transaction_id']}"
+        if rec['transaction_id'] or rec['amount'] is not None:
+            return (f"NEW PAYMENT CONFIRMED!\n\n💵 Amount: {amount}\n📱 From: {phone}\n"
+                    f"👤 Customer: {rec['name']}\n🔢 Reference: {rec['transaction_id']}")
+        return f"NEW TRANSACTION\n\n{rec['status']}"
\ No newline at end of file
@@ -0,0 +1,15 @@
+# Models package
+from .transaction_store import TransactionStore, COLUMNS
+from .transactions_model import TransactionsTableModel
+from .frame_batcher import FrameBatcher
+from .transaction_index import TransactionIndex, TransactionQuery, parse_query
+
+__all__ = [
+    'TransactionStore',
+    'COLUMNS',
+    'TransactionsTableModel',
+    'FrameBatcher',
+    'TransactionIndex',
+    'TransactionQuery',
+    'parse_query'
+]
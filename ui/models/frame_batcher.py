@@ -0,0 +1,54 @@
+import threading
+
+from PyQt6.QtCore import QObject, QTimer, pyqtSignal
+
+
+class FrameBatcher(QObject):
+    """Buffer items and hand them to ``flush`` once per frame tick.
+
+    A burst of N items within one interval costs a single ``flush(items)``
+    call (one model insert / one layout pass) instead of N. ``add`` may be
+    called from any thread: the first item of a batch wakes the owning thread
+    through a queued signal, which starts the single-shot timer there.
+    """
+    _wake = pyqtSignal()
+
+    def __init__(self, flush, interval_ms=33, parent=None):
+        super().__init__(parent)
+        self._flush_cb = flush
+        self._pending = []
+        self._lock = threading.Lock()
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(interval_ms)
+        self._timer.timeout.connect(self.flush_now)
+        self._wake.connect(self._schedule)
+
+    def add(self, item):
+        with self._lock:
+            self._pending.append(item)
+            first = len(self._pending) == 1
+        if first:
+            self._wake.emit()
+
+    def extend(self, items):
+        items = list(items)
+        if not items:
+            return
+        with self._lock:
+            first = not self._pending
+            self._pending.extend(items)
+        if first:
+            self._wake.emit()
+
+    def _schedule(self):
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def flush_now(self):
+        """Deliver everything buffered so far, in arrival order."""
+        self._timer.stop()
+        with self._lock:
+            items, self._pending = self._pending, []
+        if items:
+            self._flush_cb(items)
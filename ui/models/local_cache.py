@@ -0,0 +1,209 @@
+import json
+import math
+import os
+import re
+import sqlite3
+
+from config import CACHE_DIR
+
+_LAST_CONTEXT_FILE = 'last_context.json'
+
+
+def shop_key(merchant_id, shop_codes):
+    """Stable, filesystem-safe key for a merchant + shop combination."""
+    if isinstance(shop_codes, (list, tuple)):
+        codes = '-'.join(str(s) for s in shop_codes)
+    else:
+        codes = str(shop_codes or '')
+    raw = f"{merchant_id or 'default'}_{codes}" if codes else str(merchant_id or 'default')
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', raw)
+
+
+def save_last_context(merchant_id, shop_codes, cache_dir=CACHE_DIR):
+    """Remember the shop used last so the next launch can render its cache."""
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(os.path.join(cache_dir, _LAST_CONTEXT_FILE), 'w', encoding='utf-8') as f:
+            json.dump({'merchant_id': merchant_id, 'shop_codes': shop_codes}, f)
+    except OSError:
+        pass
+
+
+def load_last_context(cache_dir=CACHE_DIR):
+    """Return ``(merchant_id, shop_codes)`` saved by :func:`save_last_context`, or None."""
+    try:
+        with open(os.path.join(cache_dir, _LAST_CONTEXT_FILE), encoding='utf-8') as f:
+            ctx = json.load(f)
+        return ctx.get('merchant_id'), ctx.get('shop_codes')
+    except (OSError, ValueError):
+        return None
+
+
+def _nan_to_none(v):
+    return None if v is None or math.isnan(v) else v
+
+
+class LocalTransactionCache:
+    """Per-shop SQLite copy of the server's transaction history.
+
+    Rows are stored with their server id so a later session only needs to
+    ask the server for ``since_id=max_id()``. A fetch writes its pages to a
+    staging table and moves them over with :meth:`commit_staged` once it has
+    walked the whole range, so an interrupted fetch never leaves a gap below
+    ``max_id()``; the next one asks for the same range again.
+
+    Every method opens its own connection, so the cache can be used from the
+    history loader's pool thread as well as the GUI thread.
+
+    The same file keeps the dashboard activity lines that no longer fit in
+    its on-screen history (see :meth:`append_activity`).
+    """
+
+    def __init__(self, key, cache_dir=CACHE_DIR):
+        self.key = key
+        self.path = os.path.join(cache_dir, f'transactions_{key}.db')
+        os.makedirs(cache_dir, exist_ok=True)
+        self._init_db()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        try:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS transactions (
+                id INTEGER PRIMARY KEY,
+                ts REAL,
+                amount REAL,
+                phone TEXT,
+                status TEXT,
+                txid TEXT,
+                shortcode TEXT
+            )
+            ''')
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS transactions_staging (
+                id INTEGER PRIMARY KEY,
+                ts REAL,
+                amount REAL,
+                phone TEXT,
+                status TEXT,
+                txid TEXT,
+                shortcode TEXT
+            )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_ts ON transactions (ts)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_txid ON transactions (txid)')
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS activity (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ts REAL,
+                text TEXT
+            )
+            ''')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def save_rows(self, rows, staged=False):
+        """Upsert store rows ``(id, ts, amount, phone, status, txid, shortcode)``.
+
+        Rows without a server id (live notifications) are skipped; they come
+        back with an id on the next delta fetch. ``staged`` rows are kept out
+        of the cache until :meth:`commit_staged`.
+        """
+        table = 'transactions_staging' if staged else 'transactions'
+        values = [
+            (rid, _nan_to_none(ts), _nan_to_none(amount), phone, status, txid, shortcode)
+            for rid, ts, amount, phone, status, txid, shortcode in rows
+            if rid
+        ]
+        if not values:
+            return 0
+        conn = self._connect()
+        try:
+            conn.executemany(f'INSERT OR REPLACE INTO {table} (id, ts, amount, phone, status, txid, shortcode) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?)', values)
+            conn.commit()
+        finally:
+            conn.close()
+        return len(values)
+
+    def clear_staged(self):
+        """Drop staged rows left by a fetch that did not finish."""
+        conn = self._connect()
+        try:
+            conn.execute('DELETE FROM transactions_staging')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def commit_staged(self):
+        """Move staged rows into the cache in one transaction; returns how many."""
+        conn = self._connect()
+        try:
+            with conn:
+                moved = conn.execute('INSERT OR REPLACE INTO transactions '
+                                     'SELECT id, ts, amount, phone, status, txid, shortcode '
+                                     'FROM transactions_staging').rowcount
+                conn.execute('DELETE FROM transactions_staging')
+        finally:
+            conn.close()
+        return moved
+
+    def max_id(self):
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT MAX(id) FROM transactions').fetchone()
+            return row[0] or 0
+        finally:
+            conn.close()
+
+    def iter_pages(self, first_page=50, page_size=1000):
+        """Yield lists of raw rows, newest first, in pages.
+
+        The first page is small so it can be painted straight away.
+        """
+        conn = self._connect()
+        try:
+            cur = conn.execute('SELECT id, ts, amount, phone, status, txid, shortcode '
+                               'FROM transactions ORDER BY id DESC')
+            size = first_page
+            while True:
+                rows = cur.fetchmany(size)
+                if not rows:
+                    break
+                yield rows
+                size = page_size
+        finally:
+            conn.close()
+
+    def append_activity(self, entries):
+        """Store ``(timestamp, text)`` activity lines, oldest first."""
+        entries = list(entries)
+        if not entries:
+            return 0
+        conn = self._connect()
+        try:
+            conn.executemany('INSERT INTO activity (ts, text) VALUES (?, ?)', entries)
+            conn.commit()
+        finally:
+            conn.close()
+        return len(entries)
+
+    def recent_activity(self, limit=500, before_id=None):
+        """Return ``(id, timestamp, text)`` activity lines, newest first."""
+        conn = self._connect()
+        try:
+            if before_id is None:
+                cur = conn.execute('SELECT id, ts, text FROM activity ORDER BY id DESC LIMIT ?', (limit,))
+            else:
+                cur = conn.execute('SELECT id, ts, text FROM activity WHERE id < ? ORDER BY id DESC LIMIT ?',
+                                   (before_id, limit))
+            return cur.fetchall()
+        finally:
+            conn.close()
@@ -0,0 +1,293 @@
+import re
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timedelta
+
+# Pending keys up to this count are merged into the sorted indexes one by one;
+# larger batches (history pages) trigger a single re-sort instead.
+_INSORT_LIMIT = 256
+
+_STOPWORDS = {'payment', 'payments', 'from', 'for', 'of', 'to', 'by', 'at', 'on'}
+_AMOUNT_MARKERS = ('kes', 'ksh')
+_DATE_RE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+_CLOCK_RANGE_RE = re.compile(r'^(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})$')
+_AMOUNT_RE = re.compile(r'^\d+(\.\d+)?$')
+
+
+class TransactionQuery:
+    """Parsed search criteria; every set field must match (AND)."""
+
+    __slots__ = ('phone_prefix', 'phone_suffix', 'receipt_prefix', 'receipts', 'amount', 'since', 'until')
+
+    def __init__(self):
+        self.phone_prefix = None
+        self.phone_suffix = None
+        self.receipt_prefix = None
+        # Exact set of (upper-case) receipts, e.g. from a notification drill-down
+        self.receipts = None
+        self.amount = None
+        self.since = None
+        self.until = None
+
+    def criteria(self):
+        """Number of independent criteria (a time range counts once)."""
+        n = sum(getattr(self, name) is not None for name in self.__slots__[:5])
+        return n + (self.since is not None or self.until is not None)
+
+    def is_empty(self):
+        return self.criteria() == 0
+
+
+def normalize_phone(text):
+    """Turn local formats (``0712...``, ``+254712...``) into ``254712...``."""
+    digits = re.sub(r'\D', '', text)
+    if digits.startswith('0'):
+        return '254' + digits[1:]
+    return digits
+
+
+def _day_bounds(day):
+    start = datetime(day.year, day.month, day.day)
+    return start.timestamp(), (start + timedelta(days=1)).timestamp()
+
+
+def parse_query(text, now=None):
+    """Parse a cashier's search text into a :class:`TransactionQuery`.
+
+    Understands, in any order:
+    - ``0712``, ``0712...``, ``254712``, ``+254712`` - phone prefix
+    - ``*5678`` / ``...5678`` - last digits of the phone
+    - ``KES 500``, ``500``, ``1,250.50`` - exact amount
+    - ``QK7`` - receipt / transaction id prefix (anything with letters)
+    - ``today``, ``yesterday``, ``2025-10-21``, ``10:00-12:30`` - time range
+    Filler words such as "payment from ... for" are ignored.
+    """
+    now = now or datetime.now()
+    q = TransactionQuery()
+    day = None
+    clock = None
+    tokens = text.replace('…', '...').replace(',', '').lower().split()
+    expect_amount = False
+    for tok in tokens:
+        if tok in _STOPWORDS:
+            continue
+        if tok in _AMOUNT_MARKERS:
+            expect_amount = True
+            continue
+        for marker in _AMOUNT_MARKERS:
+            if tok.startswith(marker) and _AMOUNT_RE.match(tok[len(marker):]):
+                tok = tok[len(marker):]
+                expect_amount = True
+        if tok == 'today':
+            day = now.date()
+        elif tok == 'yesterday':
+            day = (now - timedelta(days=1)).date()
+        elif _DATE_RE.match(tok):
+            try:
+                day = datetime.strptime(tok, '%Y-%m-%d').date()
+            except ValueError:
+                pass
+        elif _CLOCK_RANGE_RE.match(tok):
+            clock = tuple(int(x) for x in _CLOCK_RANGE_RE.match(tok).groups())
+        elif tok.endswith('...') and tok[:-3].lstrip('+').isdigit():
+            q.phone_prefix = normalize_phone(tok[:-3])
+        elif tok.startswith('*') or tok.startswith('...'):
+            digits = re.sub(r'\D', '', tok)
+            if len(digits) >= 3:
+                q.phone_suffix = digits
+        elif expect_amount and _AMOUNT_RE.match(tok):
+            q.amount = round(float(tok), 2)
+        elif re.match(r'^\+?\d+$', tok) and (tok.startswith(('0', '+', '254')) and len(tok) >= 4):
+            q.phone_prefix = normalize_phone(tok)
+        elif _AMOUNT_RE.match(tok):
+            q.amount = round(float(tok), 2)
+        elif re.search(r'[a-z]', tok) and tok.isalnum():
+            q.receipt_prefix = tok.upper()
+        expect_amount = False
+
+    if clock is not None:
+        base = datetime.combine(day or now.date(), datetime.min.time())
+        h1, m1, h2, m2 = clock
+        q.since = (base + timedelta(hours=h1, minutes=m1)).timestamp()
+        q.until = (base + timedelta(hours=h2, minutes=m2)).timestamp()
+    elif day is not None:
+        q.since, q.until = _day_bounds(day)
+    return q
+
+
+class TransactionIndex:
+    """Client-side lookup structures over a :class:`TransactionStore`.
+
+    - phone suffix: dict of last four digits -> keys
+    - amount: dict of amount (2dp) -> keys
+    - phone prefix, receipt prefix, time range: arrays of keys kept sorted by
+      the respective column and searched with bisect
+
+    The index follows the store lazily: :meth:`sync` folds in rows appended
+    since the last call and rebuilds from scratch only when rows were removed.
+    A query starts from whichever criterion yields the fewest candidates and
+    checks the remaining criteria on those rows only.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._epoch = None
+        self._reset()
+
+    def _reset(self):
+        self._by_suffix = {}
+        self._by_amount = {}
+        self._by_phone = array('q')
+        self._by_receipt = array('q')
+        self._by_time = array('q')
+        # Nothing indexed yet: start from the oldest live tail key
+        self._head_len = 0
+        self._tail_end = self.store.tail_end() - (len(self.store) - self.store.head_len())
+        self._epoch = self.store.epoch
+
+    # --- sort keys ---
+
+    def _phone_key(self, key):
+        return self.store.phone(key)
+
+    def _receipt_key(self, key):
+        return self.store.txid(key).upper()
+
+    def _time_key(self, key):
+        ts = self.store.timestamp(key)
+        return ts if ts is not None else float('-inf')
+
+    # --- maintenance ---
+
+    def sync(self):
+        store = self.store
+        if store.epoch != self._epoch:
+            self._reset()
+        new_keys = []
+        head_len = store.head_len()
+        if head_len > self._head_len:
+            new_keys.extend(range(-self._head_len - 1, -head_len - 1, -1))
+            self._head_len = head_len
+        tail_end = store.tail_end()
+        if tail_end > self._tail_end:
+            new_keys.extend(range(self._tail_end, tail_end))
+            self._tail_end = tail_end
+        if new_keys:
+            self._add(new_keys)
+
+    def _add(self, keys):
+        store = self.store
+        for k in keys:
+            phone = store.phone(k)
+            if len(phone) >= 4:
+                self._by_suffix.setdefault(phone[-4:], []).append(k)
+            amt = store.amount(k)
+            if amt is not None:
+                self._by_amount.setdefault(round(amt, 2), []).append(k)
+
+        sorted_indexes = (
+            (self._by_phone, self._phone_key),
+            (self._by_receipt, self._receipt_key),
+            (self._by_time, self._time_key),
+        )
+        if len(keys) <= _INSORT_LIMIT:
+            for arr, keyfn in sorted_indexes:
+                for k in keys:
+                    insort(arr, k, key=keyfn)
+        else:
+            for arr, keyfn in sorted_indexes:
+                merged = sorted(arr.tolist() + list(keys), key=keyfn)
+                arr[:] = array('q', merged)
+
+    # --- querying ---
+
+    def _prefix_range(self, arr, keyfn, prefix):
+        lo = bisect_left(arr, prefix, key=keyfn)
+        hi = bisect_left(arr, prefix + '\uffff', key=keyfn)
+        return lo, hi
+
+    def _suffix_candidates(self, suffix):
+        if len(suffix) >= 4:
+            return [k for k in self._by_suffix.get(suffix[-4:], ())
+                    if self.store.phone(k).endswith(suffix)]
+        out = []
+        for bucket, keys in self._by_suffix.items():
+            if bucket.endswith(suffix):
+                out.extend(keys)
+        return out
+
+    def _receipt_candidates(self, receipts):
+        out = []
+        for receipt in receipts:
+            lo = bisect_left(self._by_receipt, receipt, key=self._receipt_key)
+            hi = bisect_right(self._by_receipt, receipt, key=self._receipt_key)
+            out.extend(self._by_receipt[lo:hi])
+        return out
+
+    def _candidates(self, q):
+        """Return the smallest candidate key collection for ``q``.
+
+        Each option is ``(estimated size, thunk)``; only the cheapest one is
+        materialized.
+        """
+        options = []
+        if q.phone_suffix is not None:
+            if len(q.phone_suffix) >= 4:
+                size = len(self._by_suffix.get(q.phone_suffix[-4:], ()))
+            else:
+                size = len(self.store)
+            options.append((size, lambda: self._suffix_candidates(q.phone_suffix)))
+        if q.amount is not None:
+            keys = self._by_amount.get(q.amount, ())
+            options.append((len(keys), lambda: keys))
+        if q.phone_prefix is not None:
+            lo, hi = self._prefix_range(self._by_phone, self._phone_key, q.phone_prefix)
+            options.append((hi - lo, lambda: self._by_phone[lo:hi]))
+        if q.receipt_prefix is not None:
+            rlo, rhi = self._prefix_range(self._by_receipt, self._receipt_key, q.receipt_prefix)
+            options.append((rhi - rlo, lambda: self._by_receipt[rlo:rhi]))
+        if q.receipts is not None:
+            options.append((len(q.receipts), lambda: self._receipt_candidates(q.receipts)))
+        if q.since is not None or q.until is not None:
+            tlo = 0 if q.since is None else bisect_left(self._by_time, q.since, key=self._time_key)
+            thi = len(self._by_time) if q.until is None else bisect_right(self._by_time, q.until, key=self._time_key)
+            options.append((max(0, thi - tlo), lambda: self._by_time[tlo:thi]))
+        if not options:
+            return None
+        return min(options, key=lambda opt: opt[0])[1]()
+
+    def matches(self, q, key):
+        """Check a single row against every criterion of ``q``."""
+        store = self.store
+        if q.phone_suffix is not None and not store.phone(key).endswith(q.phone_suffix):
+            return False
+        if q.phone_prefix is not None and not store.phone(key).startswith(q.phone_prefix):
+            return False
+        if q.receipt_prefix is not None and not store.txid(key).upper().startswith(q.receipt_prefix):
+            return False
+        if q.receipts is not None and store.txid(key).upper() not in q.receipts:
+            return False
+        if q.amount is not None:
+            amt = store.amount(key)
+            if amt is None or round(amt, 2) != q.amount:
+                return False
+        if q.since is not None or q.until is not None:
+            ts = store.timestamp(key)
+            if ts is None:
+                return False
+            if q.since is not None and ts < q.since:
+                return False
+            if q.until is not None and ts > q.until:
+                return False
+        return True
+
+    def search(self, q):
+        """Keys matching ``q`` in view order (newest first), or None if ``q`` is empty."""
+        self.sync()
+        cands = self._candidates(q)
+        if cands is None:
+            return None
+        if q.criteria() > 1:
+            cands = [k for k in cands if self.matches(q, k)]
+        # Candidates from a single index are exact already
+        return sorted(cands, reverse=True)
@@ -0,0 +1,276 @@
+import math
+from array import array
+from itertools import chain
+
+from utils.callback_parser import format_time, parse_amount, parse_time
+
+# Column order shared by the store, the table model and the views
+COLUMNS = ['Time', 'Amount', 'Phone', 'Status', 'Transaction ID']
+COL_TIME, COL_AMOUNT, COL_PHONE, COL_STATUS, COL_TXID = range(5)
+
+DEFAULT_MAX_ROWS = 1_000_000
+
+_NAN = float('nan')
+
+
+class _Columns:
+    """One half of the store: parallel typed arrays plus interned string lists."""
+
+    __slots__ = ('ids', 'ts', 'amount', 'phone', 'status', 'txid', 'shortcode')
+
+    def __init__(self):
+        self.ids = array('q')
+        self.ts = array('d')
+        self.amount = array('d')
+        self.phone = []
+        self.status = []
+        self.txid = []
+        self.shortcode = []
+
+    def __len__(self):
+        return len(self.ts)
+
+    def extend(self, rows):
+        for rid, ts, amount, phone, status, txid, shortcode in rows:
+            self.ids.append(rid)
+            self.ts.append(ts)
+            self.amount.append(amount)
+            self.phone.append(phone)
+            self.status.append(status)
+            self.txid.append(txid)
+            self.shortcode.append(shortcode)
+
+    def delete(self, start, stop=None):
+        sl = slice(start, stop)
+        for name in self.__slots__:
+            del getattr(self, name)[sl]
+
+
+class TransactionStore:
+    """Compact columnar storage for the transactions table.
+
+    Rows live in two halves so both ends grow in amortized O(1): ``_tail`` holds
+    rows that arrived live (appended oldest-to-newest) and ``_head`` holds
+    history loaded from the server (appended newest-to-oldest). The view shows
+    newest first, i.e. the tail reversed followed by the head.
+
+    Every row also has a stable integer key that survives inserts and trimming:
+    tail rows get ``0, 1, 2...`` and head rows ``-1, -2...``. Keys sort in
+    chronological arrival order, which the search index relies on.
+
+    Status and shortcode strings repeat a lot, so they are interned; amounts
+    and times are stored as doubles (NaN when unknown) and only formatted when
+    a visible cell is painted.
+    """
+
+    def __init__(self, max_rows=DEFAULT_MAX_ROWS):
+        self.max_rows = max_rows
+        self._head = _Columns()
+        self._tail = _Columns()
+        self._tail_base = 0
+        self._interned = {}
+        self._txids = set()
+        self._max_id = 0
+        self.version = 0
+        # Bumped whenever existing keys disappear (clear/trim), so derived
+        # structures such as the search index know to rebuild.
+        self.epoch = 0
+
+    def __len__(self):
+        return len(self._head) + len(self._tail)
+
+    # --- building rows ---
+
+    def _intern(self, s):
+        return self._interned.setdefault(s, s)
+
+    def make_row(self, timestamp=None, amount=None, phone='', status='', txid='', shortcode='', rid=0):
+        """Build a storage row tuple from loosely typed values."""
+        ts = parse_time(timestamp)
+        amt = parse_amount(amount)
+        return (
+            int(rid or 0),
+            _NAN if ts is None else ts,
+            _NAN if amt is None else amt,
+            str(phone or ''),
+            self._intern(str(status or '')),
+            str(txid or ''),
+            self._intern(str(shortcode or '')),
+        )
+
+    def row_from_record(self, rec, rid=None):
+        """Build a storage row from a :func:`normalize_callback` record."""
+        return self.make_row(
+            rec.get('timestamp'), rec.get('amount'), rec.get('phone'),
+            rec.get('status'), rec.get('transaction_id'), rec.get('shortcode'),
+            rid if rid is not None else rec.get('id'),
+        )
+
+    # --- mutation ---
+
+    def append(self, rows):
+        """Append newer rows (oldest first). Returns the keys assigned to them."""
+        rows = list(rows)
+        start = self.tail_end()
+        self._tail.extend(rows)
+        self._remember(rows)
+        self.version += 1
+        return range(start, start + len(rows))
+
+    def extend_older(self, rows):
+        """Append older history rows (newest first). Returns the keys assigned to them."""
+        rows = list(rows)
+        start = -len(self._head) - 1
+        self._head.extend(rows)
+        self._remember(rows)
+        self.version += 1
+        return range(start, start - len(rows), -1)
+
+    def _remember(self, rows):
+        for row in rows:
+            if row[0] > self._max_id:
+                self._max_id = row[0]
+            if row[5]:
+                self._txids.add(row[5])
+
+    def contains_txid(self, txid):
+        return bool(txid) and txid in self._txids
+
+    def clear(self):
+        self._head = _Columns()
+        self._tail = _Columns()
+        self._tail_base = 0
+        self._interned.clear()
+        self._txids.clear()
+        self._max_id = 0
+        self.version += 1
+        self.epoch += 1
+
+    def overflow(self):
+        """Number of oldest rows that :meth:`trim` would drop right now.
+
+        Trimming waits for 5% slack above ``max_rows`` so deleting from the
+        front of an array does not happen on every insert.
+        """
+        n = len(self)
+        if not self.max_rows or n <= self.max_rows + max(1, self.max_rows // 20):
+            return 0
+        return n - self.max_rows
+
+    def trim(self, count):
+        """Drop the ``count`` oldest rows (the last view rows)."""
+        if count <= 0:
+            return
+        from_head = min(count, len(self._head))
+        if from_head:
+            for txid in self._head.txid[len(self._head) - from_head:]:
+                self._txids.discard(txid)
+            self._head.delete(len(self._head) - from_head)
+        rest = count - from_head
+        if rest:
+            for txid in self._tail.txid[:rest]:
+                self._txids.discard(txid)
+            self._tail.delete(0, rest)
+            self._tail_base += rest
+        self.version += 1
+        self.epoch += 1
+
+    # --- keys ---
+
+    def key_at(self, row):
+        """Stable key of the row shown at view position ``row``."""
+        nt = len(self._tail)
+        if row < nt:
+            return self._tail_base + nt - 1 - row
+        return -(row - nt) - 1
+
+    def row_of_key(self, key):
+        """View position of ``key`` or -1 if it has been trimmed."""
+        nt = len(self._tail)
+        if key >= 0:
+            i = key - self._tail_base
+            return nt - 1 - i if 0 <= i < nt else -1
+        i = -key - 1
+        return nt + i if i < len(self._head) else -1
+
+    def _locate(self, key):
+        if key >= 0:
+            return self._tail, key - self._tail_base
+        return self._head, -key - 1
+
+    def head_len(self):
+        return len(self._head)
+
+    def tail_end(self):
+        """One past the newest tail key."""
+        return self._tail_base + len(self._tail)
+
+    def iter_keys(self):
+        """All live keys in chronological (ascending) order."""
+        return chain(range(-len(self._head), 0),
+                     range(self._tail_base, self._tail_base + len(self._tail)))
+
+    def key_is_live(self, key):
+        cols, i = self._locate(key)
+        return 0 <= i < len(cols)
+
+    # --- column access by key ---
+
+    def get(self, key):
+        cols, i = self._locate(key)
+        return (cols.ids[i], cols.ts[i], cols.amount[i], cols.phone[i],
+                cols.status[i], cols.txid[i], cols.shortcode[i])
+
+    def timestamp(self, key):
+        cols, i = self._locate(key)
+        v = cols.ts[i]
+        return None if math.isnan(v) else v
+
+    def amount(self, key):
+        cols, i = self._locate(key)
+        v = cols.amount[i]
+        return None if math.isnan(v) else v
+
+    def phone(self, key):
+        cols, i = self._locate(key)
+        return cols.phone[i]
+
+    def txid(self, key):
+        cols, i = self._locate(key)
+        return cols.txid[i]
+
+    def shortcode(self, key):
+        cols, i = self._locate(key)
+        return cols.shortcode[i]
+
+    def max_id(self):
+        """Largest server id seen, 0 when only live rows are present."""
+        return self._max_id
+
+    def columns(self):
+        """Yield ``(ids, ts, amount, phone, status, txid, shortcode)`` per half.
+
+        Lets aggregate consumers make a single pass over the raw arrays
+        without going through per-row accessors.
+        """
+        for cols in (self._head, self._tail):
+            if len(cols):
+                yield (cols.ids, cols.ts, cols.amount, cols.phone,
+                       cols.status, cols.txid, cols.shortcode)
+
+    def display(self, key, col):
+        """Text for one cell; formatting happens only for painted cells."""
+        cols, i = self._locate(key)
+        if col == COL_TIME:
+            v = cols.ts[i]
+            return '' if math.isnan(v) else format_time(v)
+        if col == COL_AMOUNT:
+            v = cols.amount[i]
+            return '' if math.isnan(v) else f'{v:,.2f}'
+        if col == COL_PHONE:
+            return cols.phone[i]
+        if col == COL_STATUS:
+            return cols.status[i]
+        if col == COL_TXID:
+            return cols.txid[i]
+        return ''
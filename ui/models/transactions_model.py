@@ -0,0 +1,137 @@
+from array import array
+
+from PyQt6.QtCore import QAbstractTableModel, QModelIndex, Qt
+
+from ui.models.transaction_store import TransactionStore, COLUMNS, COL_AMOUNT, DEFAULT_MAX_ROWS
+
+
+class TransactionsTableModel(QAbstractTableModel):
+    """Virtualized table model over a :class:`TransactionStore`.
+
+    The view only asks for the cells it paints, so memory and paint cost stay
+    proportional to the visible rows no matter how long the history is. Newest
+    rows are shown first.
+
+    A filter (see :meth:`set_filter`) swaps the row mapping for an explicit
+    array of store keys; new rows are only shown if they pass its predicate.
+    """
+
+    def __init__(self, max_rows=DEFAULT_MAX_ROWS, parent=None):
+        super().__init__(parent)
+        self.store = TransactionStore(max_rows=max_rows)
+        self._filter = None
+        self._filter_match = None
+
+    # --- QAbstractTableModel interface ---
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        if self._filter is not None:
+            return len(self._filter)
+        return len(self.store)
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(COLUMNS)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.ItemDataRole.DisplayRole:
+            return self.store.display(self.key_at(index.row()), index.column())
+        if role == Qt.ItemDataRole.TextAlignmentRole and index.column() == COL_AMOUNT:
+            return int(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+        return None
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role != Qt.ItemDataRole.DisplayRole:
+            return None
+        if orientation == Qt.Orientation.Horizontal:
+            return COLUMNS[section] if 0 <= section < len(COLUMNS) else None
+        return section + 1
+
+    def key_at(self, row):
+        """Store key shown at view position ``row``."""
+        if self._filter is not None:
+            return self._filter[row]
+        return self.store.key_at(row)
+
+    # --- filtering ---
+
+    def set_filter(self, keys, match=None):
+        """Show only ``keys`` (in the given order); None shows everything.
+
+        ``match(key)`` decides whether rows added while the filter is active
+        are shown.
+        """
+        self.beginResetModel()
+        self._filter = None if keys is None else array('q', keys)
+        self._filter_match = match if keys is not None else None
+        self.endResetModel()
+
+    def is_filtered(self):
+        return self._filter is not None
+
+    # --- mutation ---
+
+    def append_rows(self, rows):
+        """Insert newer rows (oldest first) at the top of the view."""
+        rows = list(rows)
+        if not rows:
+            return
+        if self._filter is not None:
+            keys = self.store.append(rows)
+            shown = [k for k in reversed(keys) if self._filter_match(k)]
+            if shown:
+                self.beginInsertRows(QModelIndex(), 0, len(shown) - 1)
+                self._filter[0:0] = array('q', shown)
+                self.endInsertRows()
+        else:
+            self.beginInsertRows(QModelIndex(), 0, len(rows) - 1)
+            self.store.append(rows)
+            self.endInsertRows()
+        self._enforce_cap()
+
+    def extend_history(self, rows):
+        """Add older history rows (newest first) below the existing ones."""
+        rows = list(rows)
+        if not rows:
+            return
+        if self._filter is not None:
+            keys = self.store.extend_older(rows)
+            shown = [k for k in keys if self._filter_match(k)]
+            if shown:
+                start = len(self._filter)
+                self.beginInsertRows(QModelIndex(), start, start + len(shown) - 1)
+                self._filter.extend(shown)
+                self.endInsertRows()
+        else:
+            start = len(self.store)
+            self.beginInsertRows(QModelIndex(), start, start + len(rows) - 1)
+            self.store.extend_older(rows)
+            self.endInsertRows()
+        self._enforce_cap()
+
+    def clear(self):
+        self.beginResetModel()
+        self.store.clear()
+        if self._filter is not None:
+            self._filter = array('q')
+        self.endResetModel()
+
+    def _enforce_cap(self):
+        count = self.store.overflow()
+        if not count:
+            return
+        if self._filter is not None:
+            self.beginResetModel()
+            self.store.trim(count)
+            self._filter = array('q', (k for k in self._filter if self.store.key_is_live(k)))
+            self.endResetModel()
+            return
+        n = len(self.store)
+        self.beginRemoveRows(QModelIndex(), n - count, n - 1)
+        self.store.trim(count)
+        self.endRemoveRows()
@@ -1,7 +1,10 @@
 # Network package
 from .ws_client import WSClient, WSClientSignals
+from .history_loader import HistoryLoader, HistoryLoaderSignals
 
 __all__ = [
     'WSClient',
-    'WSClientSignals'
+    'WSClientSignals',
+    'HistoryLoader',
+    'HistoryLoaderSignals'
 ]
\ No newline at end of file
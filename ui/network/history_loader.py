@@ -0,0 +1,172 @@
+import threading
+
+import requests
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+
+# The first page is small so the table paints almost immediately; the rest of
+# the history streams in with larger pages.
+FIRST_PAGE_SIZE = 50
+PAGE_SIZE = 1000
+
+
+class HistoryLoaderSignals(QObject):
+    # (generation, rows) - older history, newest first, ready for extend_history
+    page = pyqtSignal(int, list)
+    # (generation, rows) - rows newer than the local cache, oldest first, ready for append_rows
+    delta = pyqtSignal(int, list)
+    # (generation, total rows delivered)
+    finished = pyqtSignal(int, int)
+    # (generation, error message)
+    failed = pyqtSignal(int, str)
+
+
+class _HistoryTask(QRunnable):
+    """Fetch history on a pool thread.
+
+    With a local cache the cached rows are streamed first, then only rows
+    newer than the cache's highest id are requested from the server. Fetched
+    pages are staged and written to the cache only once the walk reaches the
+    end of the range, so a cancelled or failed load leaves no gap behind it;
+    for the same reason ``limit`` only applies when there is no cache.
+    Without a cache, ``/api/transactions`` is walked page by page. JSON
+    decoding and row building happen here; only finished row batches cross
+    to the GUI thread, through queued signals.
+    """
+
+    def __init__(self, signals, generation, cancelled, server_url, make_row,
+                 limit=None, shortcodes=None, since_id=None, cache=None, read_cache=True):
+        super().__init__()
+        self.signals = signals
+        self.generation = generation
+        self.cancelled = cancelled
+        self.server_url = server_url.rstrip('/') if server_url else None
+        self.make_row = make_row
+        self.limit = limit
+        self.shortcodes = shortcodes
+        self.since_id = since_id
+        self.cache = cache
+        self.read_cache = read_cache
+
+    def run(self):
+        total = 0
+        try:
+            if self.cache is not None and self.read_cache:
+                for raw in self.cache.iter_pages(FIRST_PAGE_SIZE, PAGE_SIZE):
+                    if self.cancelled.is_set():
+                        return
+                    rows = [self.make_row(ts, amount, phone, status, txid, shortcode, rid)
+                            for rid, ts, amount, phone, status, txid, shortcode in raw]
+                    self.signals.page.emit(self.generation, rows)
+                    total += len(rows)
+            if self.cache is not None:
+                self.since_id = self.cache.max_id() or self.since_id
+            if self.server_url:
+                total += self._fetch_server()
+            if not self.cancelled.is_set():
+                self.signals.finished.emit(self.generation, total)
+        except Exception as e:
+            if not self.cancelled.is_set():
+                self.signals.failed.emit(self.generation, str(e))
+
+    def _fetch_server(self):
+        total = 0
+        newer = []
+        before_id = None
+        page_size = FIRST_PAGE_SIZE
+        url = f"{self.server_url}/api/transactions"
+        complete = False
+        # A limited walk would never reach the end of its range, so nothing it
+        # staged could be committed: with a cache the whole delta is fetched
+        limit = self.limit if self.cache is None else None
+        if self.cache is not None:
+            self.cache.clear_staged()
+        with requests.Session() as session:
+            while not self.cancelled.is_set():
+                size = page_size if not limit else min(page_size, limit - total)
+                params = {'limit': size}
+                if before_id is not None:
+                    params['before_id'] = before_id
+                if self.since_id:
+                    params['since_id'] = self.since_id
+                if self.shortcodes:
+                    params['shortcode'] = ','.join(str(s) for s in self.shortcodes)
+                resp = session.get(url, params=params, timeout=10)
+                resp.raise_for_status()
+                data = resp.json()
+                if not data:
+                    complete = True
+                    break
+
+                rows = [
+                    self.make_row(
+                        tx.get('timestamp') or tx.get('time', ''),
+                        tx.get('amount', ''),
+                        tx.get('phone', ''),
+                        tx.get('status', ''),
+                        tx.get('transaction_id', ''),
+                        tx.get('shortcode', ''),
+                        tx.get('id') or 0,
+                    )
+                    for tx in data
+                ]
+                if self.cache is not None:
+                    self.cache.save_rows(rows, staged=True)
+                if self.cancelled.is_set():
+                    break
+                if self.since_id:
+                    # Rows newer than what is already shown go on top, in one batch
+                    newer.extend(rows)
+                else:
+                    self.signals.page.emit(self.generation, rows)
+                total += len(rows)
+
+                ids = [tx.get('id') for tx in data if tx.get('id')]
+                if len(data) < size or not ids:
+                    complete = True
+                    break
+                if limit and total >= limit:
+                    break
+                before_id = min(ids)
+                page_size = PAGE_SIZE
+        # Only a walk that reached the end of its range goes into the cache
+        if complete and self.cache is not None and not self.cancelled.is_set():
+            self.cache.commit_staged()
+        if newer and not self.cancelled.is_set():
+            newer.reverse()
+            self.signals.delta.emit(self.generation, newer)
+        return total
+
+
+class HistoryLoader(QObject):
+    """Streams transaction history from the local cache and the server.
+
+    Each :meth:`start` bumps a generation number and cancels the previous
+    load, so receivers can drop batches from a superseded request.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.signals = HistoryLoaderSignals()
+        self.generation = 0
+        self._cancelled = threading.Event()
+
+    def start(self, server_url, make_row, limit=None, shortcodes=None, since_id=None,
+              cache=None, read_cache=True):
+        """Start a load.
+
+        ``server_url`` may be None to read only ``cache``; ``read_cache=False``
+        skips streaming the cached rows (already shown) and only fetches the
+        delta since the cache's highest id.
+        """
+        self.cancel()
+        self.generation += 1
+        self._cancelled = threading.Event()
+        task = _HistoryTask(self.signals, self.generation, self._cancelled, server_url,
+                            make_row, limit=limit, shortcodes=shortcodes, since_id=since_id,
+                            cache=cache, read_cache=read_cache)
+        QThreadPool.globalInstance().start(task)
+        return self.generation
+
+    def cancel(self):
+        self._cancelled.set()
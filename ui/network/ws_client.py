@@ -2,12 +2,20 @@ import socketio
 import threading
 from PyQt6.QtCore import QObject, pyqtSignal
 
+from utils.delivery import SeenIds, acknowledge, delivery_params, new_client_id
+from utils.log import get_logger
+from utils.wire_format import client_serializer, codec_params
+
+log = get_logger(__name__)
+
 
 class WSClientSignals(QObject):
     connected = pyqtSignal()
     disconnected = pyqtSignal()
     error = pyqtSignal(str)
     notification = pyqtSignal(object)
+    # A list of notifications delivered together (?batch=1)
+    notification_batch = pyqtSignal(object)
 
 
 class WSClient(QObject):
@@ -19,6 +27,9 @@ class WSClient(QObject):
         self.token = token
         self.merchant_id = merchant_id
         self.shop_codes = shop_codes
+        # Stable across reconnects so the server can redeliver what we missed
+        self.client_id = new_client_id()
+        self._seen = SeenIds()
         self._sio = None
         self._thread = None
 
@@ -28,7 +39,9 @@ class WSClient(QObject):
 
     def _run(self):
         try:
-            self._sio = socketio.Client(reconnection=True, logger=False, engineio_logger=False)
+            self._sio = socketio.Client(reconnection=True, logger=get_logger('socketio.client'),
+                                        engineio_logger=get_logger('engineio.client'),
+                                        serializer=client_serializer())
 
             @self._sio.event
             def connect():
@@ -67,15 +80,32 @@ class WSClient(QObject):
             @self._sio.on('notification')
             def on_notification(msg):
                 try:
-                    print(f"[WSClient Debug] Received notification from server: {msg}")
+                    log.debug("notification %s", msg.get('id') if isinstance(msg, dict) else type(msg).__name__)
+                    if isinstance(msg, dict) and not self._seen.add(msg.get('id')):
+                        # Redelivery of one we already showed; our ack got lost
+                        acknowledge(self._sio, msg)
+                        return
                     self.signals.notification.emit(msg)
-                    print("[WSClient Debug] Notification emitted to GUI")
-                except Exception as e:
-                    print(f"[WSClient Error] Failed to handle notification: {e}")
-                    import traceback
-                    print(traceback.format_exc())
+                    acknowledge(self._sio, msg)
+                except Exception:
+                    log.exception("failed to handle notification")
+
+            @self._sio.on('notification_batch')
+            def on_notification_batch(msgs):
+                try:
+                    msgs = [m for m in (msgs or []) if isinstance(m, dict)]
+                    log.debug("batch of %d notifications", len(msgs))
+                    # Redeliveries of ones already shown are only acknowledged again
+                    fresh = [m for m in msgs if self._seen.add(m.get('id'))]
+                    if fresh:
+                        self.signals.notification_batch.emit(fresh)
+                    acknowledge(self._sio, *msgs)
+                except Exception:
+                    log.exception("failed to handle notification batch")
 
-            connect_params = {}
+            connect_params = delivery_params(self.client_id)
+            connect_params.update(codec_params())
+            connect_params['batch'] = '1'
             if self.token:
                 connect_params['token'] = self.token
             if self.merchant_id:
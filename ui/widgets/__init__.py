@@ -4,7 +4,7 @@ from .login_widget import LoginWidget
 from .dashboard_widget import DashboardWidget
 from .transactions_widget import TransactionsWidget
 from .settings_widget import SettingsWidget
-from .notification_widget import MultiDesktopNotificationWindow, PaymentNotificationCard
+from .notification_widget import PaymentNotificationCard, NotificationManager, NotificationCoalescer
 
 __all__ = [
     'SidebarWidget',
@@ -12,6 +12,7 @@ __all__ = [
     'DashboardWidget',
     'TransactionsWidget',
     'SettingsWidget',
-    'MultiDesktopNotificationWindow',
-    'PaymentNotificationCard'
+    'PaymentNotificationCard',
+    'NotificationManager',
+    'NotificationCoalescer'
 ]
\ No newline at end of file
@@ -1,14 +1,26 @@
 import threading
+import time
+from collections import deque
+from datetime import datetime
 from PyQt6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QLabel, 
-    QFormLayout, QTextEdit, QMessageBox
+    QFormLayout, QGridLayout, QPlainTextEdit, QMessageBox
 )
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QThreadPool, QTimer
 import mpesa_client
 
 from ui.components.card_widgets import CardWidget
 from ui.components.modern_inputs import ModernLineEdit
 from ui.components.modern_buttons import ModernButton
+from ui.models.frame_batcher import FrameBatcher
+from ui.models.local_cache import LocalTransactionCache, shop_key
+from utils.log import get_logger
+from utils.sales_stats import ALL_TILLS, format_kes
+
+log = get_logger(__name__)
+
+# Lines kept on screen; older ones are moved to the local cache
+HISTORY_CAPACITY = 500
 
 
 class DashboardWidget(QWidget):
@@ -16,11 +28,23 @@ class DashboardWidget(QWidget):
         super().__init__(parent)
         self._merchant_id = None
         self._shop_codes = None
+        # History lines are merged into one document edit per frame tick
+        self._history_batch = FrameBatcher(self._flush_history, parent=self)
+        # Ring buffer of (timestamp, line) mirroring what the widget shows
+        self._recent = deque(maxlen=HISTORY_CAPACITY)
+        self._activity_cache = None
+        # Sales stats are read on a timer, never per payment
+        self._stats = None
+        self._stats_rendered = None
+        self._stats_timer = QTimer(self)
+        self._stats_timer.setInterval(1000)
+        self._stats_timer.timeout.connect(self._render_stats)
         self._build_ui()
 
     def set_context(self, merchant_id, shop_codes):
         self._merchant_id = merchant_id
         self._shop_codes = shop_codes
+        self._activity_cache = None
 
     def _build_ui(self):
         layout = QVBoxLayout()
@@ -74,6 +98,31 @@ class DashboardWidget(QWidget):
         stk_layout.addWidget(self.send_btn)
         
         left_column.addWidget(stk_card)
+
+        # Today's sales card
+        stats_card = CardWidget("Today's Sales")
+        stats_layout = stats_card.layout()
+
+        totals = QGridLayout()
+        totals.setHorizontalSpacing(20)
+        self._stat_values = {}
+        for col, (key, label) in enumerate((('count', 'Payments'), ('gross', 'Gross'),
+                                            ('average', 'Avg ticket'), ('per_minute', 'Per minute'))):
+            value = QLabel("–")
+            value.setStyleSheet("font-size: 20px; font-weight: 700; color: #2563eb;")
+            caption = QLabel(label)
+            caption.setStyleSheet("color: #64748b; font-size: 12px;")
+            totals.addWidget(value, 0, col)
+            totals.addWidget(caption, 1, col)
+            self._stat_values[key] = value
+        stats_layout.addLayout(totals)
+
+        self.till_stats = QLabel("")
+        self.till_stats.setStyleSheet("font-family: 'Monospace'; font-size: 12px; color: #374151;")
+        self.till_stats.setTextFormat(Qt.TextFormat.PlainText)
+        stats_layout.addWidget(self.till_stats)
+
+        left_column.addWidget(stats_card)
         left_column.addStretch()
         
         # Right column - Activity feed
@@ -84,10 +133,12 @@ class DashboardWidget(QWidget):
         activity_card = CardWidget("Recent Activity")
         activity_layout = activity_card.layout()
         
-        self.history = QTextEdit()
+        self.history = QPlainTextEdit()
         self.history.setReadOnly(True)
+        self.history.setUndoRedoEnabled(False)
+        self.history.setMaximumBlockCount(HISTORY_CAPACITY)
         self.history.setStyleSheet("""
-            QTextEdit {
+            QPlainTextEdit {
                 border: 1px solid #e2e8f0;
                 border-radius: 6px;
                 padding: 12px;
@@ -153,7 +204,59 @@ class DashboardWidget(QWidget):
             self.send_btn.setEnabled(True)
             self.send_btn.setText("Send STK Push")
 
+    def set_stats_source(self, aggregator):
+        """Render a :class:`SalesAggregator` once a second"""
+        self._stats = aggregator
+        self._stats_rendered = None
+        self._render_stats()
+        self._stats_timer.start()
+
+    def _render_stats(self):
+        if self._stats is None:
+            return
+        # Rates change as minutes pass even without new payments
+        state = (self._stats.version, int(time.time() // 60))
+        if state == self._stats_rendered:
+            return
+        self._stats_rendered = state
+        snap = self._stats.snapshot()
+        total = snap.get(ALL_TILLS, {})
+        self._stat_values['count'].setText(f"{total.get('count', 0):,}")
+        self._stat_values['gross'].setText(format_kes(total.get('gross', 0.0)))
+        self._stat_values['average'].setText(format_kes(round(total.get('average', 0.0))))
+        self._stat_values['per_minute'].setText(f"{total.get('per_minute', 0.0):.1f}")
+        lines = [f"{'Till':<10}{'Payments':>10}{'Gross':>16}{'Avg':>10}{'/min':>7}"]
+        for till in sorted(t for t in snap if t is not ALL_TILLS):
+            st = snap[till]
+            lines.append(f"{till or '?':<10}{st['count']:>10,}{st['gross']:>16,.2f}"
+                         f"{st['average']:>10,.0f}{st['per_minute']:>7.1f}")
+        self.till_stats.setText('\n'.join(lines) if len(lines) > 1 else "")
+
     def append_history(self, msg):
-        from datetime import datetime
-        ts = datetime.now().strftime('%H:%M:%S')
-        self.history.append(f'[{ts}] {msg}')
\ No newline at end of file
+        now = time.time()
+        # One line per entry, so every entry is exactly one block in the widget
+        text = ' · '.join(part.strip() for part in str(msg).splitlines() if part.strip())
+        self._history_batch.add((now, f"[{datetime.fromtimestamp(now).strftime('%H:%M:%S')}] {text}"))
+
+    def _flush_history(self, entries):
+        spilled = []
+        for entry in entries:
+            if len(self._recent) == self._recent.maxlen:
+                spilled.append(self._recent[0])
+            self._recent.append(entry)
+        # maximumBlockCount drops the same lines from the top of the widget
+        self.history.appendPlainText('\n'.join(line for _ts, line in entries))
+        bar = self.history.verticalScrollBar()
+        bar.setValue(bar.maximum())
+        if spilled:
+            self._spill_history(spilled)
+
+    def _spill_history(self, entries):
+        """Write lines that scrolled out of the ring buffer to the local cache"""
+        try:
+            if self._activity_cache is None:
+                self._activity_cache = LocalTransactionCache(shop_key(self._merchant_id, self._shop_codes))
+            cache = self._activity_cache
+            QThreadPool.globalInstance().start(lambda: cache.append_activity(entries))
+        except Exception as e:
+            log.warning("failed to store activity history: %s", e)
\ No newline at end of file
@@ -1,8 +1,8 @@
-import platform
-import ctypes
+import time
+from collections import deque
 from datetime import datetime
 from PyQt6.QtWidgets import QWidget, QVBoxLayout, QLabel, QPushButton, QHBoxLayout, QGraphicsDropShadowEffect
-from PyQt6.QtCore import QTimer, QPropertyAnimation, Qt, pyqtSignal
+from PyQt6.QtCore import QObject, QTimer, QPropertyAnimation, Qt, pyqtSignal
 from PyQt6.QtGui import QGuiApplication, QScreen, QColor
 
 # Optional Windows native toast notifier (for sound and system toast)
@@ -12,180 +12,30 @@ try:
 except Exception:
     _HAS_WINOTIFY = False
 
+from utils.log import get_logger
+from utils.multi_desktop import pin_to_all_desktops, play_notification_sound, preload_notification_sound
+from utils.sales_stats import format_kes
 
-class MultiDesktopNotificationWindow(QWidget):
-    """A notification that appears on ALL virtual desktops and ALL screens"""
-    
-    def __init__(self, title: str, message: str, parent=None):
-        super().__init__(parent)
-        
-        # ULTRA-FORCEFUL window flags for multi-desktop support
-        self.setWindowFlags(
-            Qt.WindowType.WindowStaysOnTopHint |          # Always on top
-            Qt.WindowType.FramelessWindowHint |           # No title bar
-            Qt.WindowType.Tool |                          # No taskbar entry
-            Qt.WindowType.X11BypassWindowManagerHint |    # Bypass window manager (Linux)
-            Qt.WindowType.WindowDoesNotAcceptFocus |      # Don't steal focus
-            Qt.WindowType.MSWindowsFixedSizeDialogHint    # Better multi-desktop support on Windows
-        )
-        
-        # Make it truly top-most and visible on all virtual desktops
-        self.setAttribute(Qt.WidgetAttribute.WA_AlwaysStackOnTop, True)
-        self.setAttribute(Qt.WidgetAttribute.WA_ShowWithoutActivating, True)
-        self.setAttribute(Qt.WidgetAttribute.WA_TranslucentBackground, True)
-
-        # Create notification cards for ALL screens
-        self.notification_cards = []
-        self.create_notifications_for_all_screens(title, message)
-        
-        # Auto-close timer
-        self.auto_close_timer = QTimer()
-        self.auto_close_timer.setSingleShot(True)
-        self.auto_close_timer.timeout.connect(self.animate_out)
-        self.auto_close_timer.start(15000)  # 15 seconds
-        
-        # Force to top immediately on all desktops
-        QTimer.singleShot(100, self.force_to_all_desktops)
-        
-    def create_notifications_for_all_screens(self, title: str, message: str):
-        """Create notification cards for EVERY screen and virtual desktop"""
-        screens = QGuiApplication.screens()
-        print(f"[MultiDesktop] Creating notifications for {len(screens)} screens")
-        
-        for screen in screens:
-            # Create a notification card for each screen
-            card = PaymentNotificationCard(title, message, self)
-            card.dismissed.connect(self.on_card_dismissed)
-            self.notification_cards.append(card)
-            
-            # Position card at center of this specific screen
-            self.center_notification_on_screen(card, screen)
-            
-    def center_notification_on_screen(self, card, screen):
-        """Position the notification card at bottom-right of the given screen (like a toast)"""
-        geo = screen.geometry()
-        margin = 32
-        x = geo.x() + geo.width() - card.width() - margin
-        y = geo.y() + geo.height() - card.height() - margin
-
-        card.move(x, y)
-        card.show()
-        
-    def showEvent(self, event):
-        """Animate in when shown"""
-        super().showEvent(event)
-        self.force_to_all_desktops()
-        for card in self.notification_cards:
-            card.animate_in()
-        
-    def force_to_all_desktops(self):
-        """Force the window to be visible on ALL virtual desktops using platform-specific methods"""
-        try:
-            if platform.system() == 'Windows':
-                self._force_windows_all_desktops()
-            elif platform.system() == 'Linux':
-                self._force_linux_all_desktops()
-            else:  # macOS and others
-                self._force_generic_all_desktops()
-                
-            # Force all cards to be visible
-            for card in self.notification_cards:
-                card.raise_()
-                card.activateWindow()
-                card.show()
-                
-        except Exception as e:
-            print(f"[MultiDesktop] Error forcing to all desktops: {e}")
-            
-    def _force_windows_all_desktops(self):
-        """Windows-specific: Make window visible on all virtual desktops"""
-        try:
-            # Try to use Windows API to show on all virtual desktops
-            HWND_TOPMOST = -1
-            SWP_NOSIZE = 0x0001
-            SWP_NOMOVE = 0x0002
-            SWP_SHOWWINDOW = 0x0040
-            flags = SWP_NOMOVE | SWP_NOSIZE | SWP_SHOWWINDOW
-            
-            for card in self.notification_cards:
-                hwnd = int(card.winId())
-                # Set as topmost
-                ctypes.windll.user32.SetWindowPos(hwnd, HWND_TOPMOST, 0, 0, 0, 0, flags)
-                # Additional forceful methods
-                ctypes.windll.user32.BringWindowToTop(hwnd)
-                ctypes.windll.user32.SetForegroundWindow(hwnd)
-                
-                # Try to make it visible on all virtual desktops (Windows 10+)
-                try:
-                    # This is the key for virtual desktop support
-                    GWL_EXSTYLE = -20
-                    WS_EX_TOOLWINDOW = 0x00000080
-                    WS_EX_NOACTIVATE = 0x08000000
-                    
-                    # Get current style
-                    current_style = ctypes.windll.user32.GetWindowLongW(hwnd, GWL_EXSTYLE)
-                    # Add toolwindow and noactivate flags for better multi-desktop behavior
-                    new_style = current_style | WS_EX_TOOLWINDOW | WS_EX_NOACTIVATE
-                    ctypes.windll.user32.SetWindowLongW(hwnd, GWL_EXSTYLE, new_style)
-                    
-                except Exception as e:
-                    print(f"[Windows Virtual Desktop] Fallback: {e}")
-                    
-        except Exception as e:
-            print(f"[Windows All Desktops Error] {e}")
-            
-    def _force_linux_all_desktops(self):
-        """Linux-specific: Make window visible on all workspaces"""
-        try:
-            for card in self.notification_cards:
-                hwnd = int(card.winId())
-                # Use xdotool to set on all workspaces
-                import subprocess
-                wid = hex(hwnd)
-                # Try to set sticky flag (visible on all workspaces)
-                subprocess.run(['xdotool', 'set_window', '--classname', 'MPesaNotification', wid], timeout=2)
-                subprocess.run(['wmctrl', '-i', '-r', wid, '-b', 'add,sticky'], timeout=2)
-        except:
-            # Fallback - just ensure visibility
-            for card in self.notification_cards:
-                card.raise_()
-                card.show()
-            
-    def _force_generic_all_desktops(self):
-        """Generic method for other platforms"""
-        for card in self.notification_cards:
-            card.raise_()
-            card.activateWindow()
-            card.show()
-            
-    def on_card_dismissed(self):
-        """When any card is dismissed, dismiss all"""
-        self.animate_out()
-        
-    def animate_out(self):
-        """Animate out and close all cards"""
-        for card in self.notification_cards:
-            card.animate_out()
-        QTimer.singleShot(500, self.close_all)
-        
-    def close_all(self):
-        """Close all notification cards"""
-        for card in self.notification_cards:
-            card.close()
-        self.close()
+log = get_logger(__name__)
 
 
 class PaymentNotificationCard(QWidget):
-    """A toast-style payment notification card (small, bottom-right, rounded, shadowed)"""
+    """A toast-style payment notification card (small, bottom-right, rounded, shadowed)
+
+    Cards can be reused: :meth:`set_content` swaps the text of an existing
+    card, so the stylesheet, shadow effect and animation are built only once.
+    """
     dismissed = pyqtSignal()
+    clicked = pyqtSignal()
 
-    def __init__(self, title: str, message: str, parent=None):
+    def __init__(self, title: str = "", message: str = "", parent=None, play_sound=True):
         super().__init__(parent)
         self.setWindowFlags(
             Qt.WindowType.WindowStaysOnTopHint |
             Qt.WindowType.FramelessWindowHint |
             Qt.WindowType.Tool
         )
+        self.setAttribute(Qt.WidgetAttribute.WA_ShowWithoutActivating, True)
         self.setFixedSize(340, 110)
         self.setStyleSheet("""
             QWidget {
@@ -207,9 +57,9 @@ class PaymentNotificationCard(QWidget):
         icon_label.setStyleSheet("font-size: 22px; margin-right: 8px;")
         header_layout.addWidget(icon_label)
         
-        title_label = QLabel(title)
-        title_label.setStyleSheet("font-size: 15px; font-weight: 700; color: #f1f5f9; margin: 0px;")
-        header_layout.addWidget(title_label)
+        self.title_label = QLabel(title)
+        self.title_label.setStyleSheet("font-size: 15px; font-weight: 700; color: #f1f5f9; margin: 0px;")
+        header_layout.addWidget(self.title_label)
         header_layout.addStretch()
         
         close_btn = QPushButton("×")
@@ -235,25 +85,23 @@ class PaymentNotificationCard(QWidget):
         layout.addLayout(header_layout)
         
         # Message content
-        message_label = QLabel(message)
-        message_label.setStyleSheet("font-size: 13px; color: #e0e7ef; line-height: 1.5; margin-top: 2px;")
-        message_label.setWordWrap(True)
-        layout.addWidget(message_label)
+        self.message_label = QLabel(message)
+        self.message_label.setStyleSheet("font-size: 13px; color: #e0e7ef; line-height: 1.5; margin-top: 2px;")
+        self.message_label.setWordWrap(True)
+        layout.addWidget(self.message_label)
         
         # Timestamp
-        timestamp = QLabel(datetime.now().strftime("%H:%M:%S"))
-        timestamp.setStyleSheet("font-size: 11px; color: #a5b4fc; font-style: italic; margin-top: 2px;")
-        layout.addWidget(timestamp)
+        self.timestamp_label = QLabel(datetime.now().strftime("%H:%M:%S"))
+        self.timestamp_label.setStyleSheet("font-size: 11px; color: #a5b4fc; font-style: italic; margin-top: 2px;")
+        layout.addWidget(self.timestamp_label)
         
         self.setLayout(layout)
         
-        # Fade in effect
-        self.setWindowOpacity(0.0)
+        # One fade animation, reused for fading in and out
+        self._fading_out = False
         self.fade_anim = QPropertyAnimation(self, b"windowOpacity")
-        self.fade_anim.setDuration(350)
-        self.fade_anim.setStartValue(0.0)
-        self.fade_anim.setEndValue(1.0)
-        self.fade_anim.start()
+        self.fade_anim.finished.connect(self._on_fade_finished)
+        self.setWindowOpacity(0.0)
         
         # Add drop shadow effect
         shadow = QGraphicsDropShadowEffect(self)
@@ -263,40 +111,253 @@ class PaymentNotificationCard(QWidget):
         shadow.setColor(QColor(31, 38, 135, 90))
         self.setGraphicsEffect(shadow)
         
+        if title or message:
+            self.animate_in()
+        
         # Play sound if available
-        self._play_notification_sound()
+        if play_sound:
+            self._play_notification_sound()
         
+    def set_content(self, title: str, message: str):
+        """Swap the text of a (pooled) card and refresh its timestamp"""
+        self.title_label.setText(title)
+        self.message_label.setText(message)
+        self.timestamp_label.setText(datetime.now().strftime("%H:%M:%S"))
+
     def _play_notification_sound(self):
-        """Play a notification sound on ALL platforms"""
-        try:
-            if platform.system() == 'Windows':
-                import winsound
-                winsound.PlaySound("SystemExclamation", winsound.SND_ALIAS)
-            elif platform.system() == 'Darwin':  # macOS
-                import os
-                os.system('afplay /System/Library/Sounds/Glass.aiff &')
-            elif platform.system() == 'Linux':
-                import os
-                os.system('paplay /usr/share/sounds/freedesktop/stereo/message.oga &')
-        except Exception as e:
-            print(f"[Toast] Sound error: {e}")
+        play_notification_sound()
             
     def setup_animation(self):
         pass  # No longer needed for toast style
     
     def animate_in(self):
-        # Fade in (already handled in __init__)
-        pass
+        """Fade in"""
+        self._fading_out = False
+        self.fade_anim.stop()
+        self.fade_anim.setDuration(350)
+        self.fade_anim.setStartValue(self.windowOpacity())
+        self.fade_anim.setEndValue(1.0)
+        self.fade_anim.start()
     
     def animate_out(self):
-        """Fade out and close"""
-        fade = QPropertyAnimation(self, b"windowOpacity")
-        fade.setDuration(300)
-        fade.setStartValue(1.0)
-        fade.setEndValue(0.0)
-        fade.finished.connect(self.close)
-        fade.start()
+        """Fade out, then hide (the card stays alive for reuse)"""
+        self._fading_out = True
+        self.fade_anim.stop()
+        self.fade_anim.setDuration(300)
+        self.fade_anim.setStartValue(self.windowOpacity())
+        self.fade_anim.setEndValue(0.0)
+        self.fade_anim.start()
+
+    def _on_fade_finished(self):
+        if self._fading_out:
+            self.hide()
         
+    def mousePressEvent(self, event):
+        if event.button() == Qt.MouseButton.LeftButton:
+            self.clicked.emit()
+        super().mousePressEvent(event)
+
     def on_dismiss(self):
+        # Emitted right away: the manager owns the slot and its fade-out, and a
+        # delayed emit could land after the slot was reused for the next toast
         self.animate_out()
-        QTimer.singleShot(400, self.dismissed.emit)
\ No newline at end of file
+        self.dismissed.emit()
+
+
+class NotificationManager(QObject):
+    """Shows payment toasts using a fixed pool of pre-built cards.
+
+    Each screen gets ``max_visible`` cards, built once. A notification
+    occupies one "slot" (the same card index on every screen); cards are
+    stacked upwards from the bottom-right corner. When all slots are busy,
+    notifications wait in a bounded queue (oldest dropped first), so the cost
+    of a popup stays constant however fast payments arrive.
+
+    Clicking a card emits :attr:`activated` with the payload it was shown
+    with. The sound plays at most once every ``sound_interval_ms``.
+    """
+
+    activated = pyqtSignal(object)
+
+    CARD_GAP = 12
+    MARGIN = 32
+
+    def __init__(self, max_visible=3, display_ms=15000, max_queued=50, sound_interval_ms=3000, parent=None):
+        super().__init__(parent)
+        self.max_visible = max_visible
+        self.display_ms = display_ms
+        self.sound_interval_ms = sound_interval_ms
+        self._last_sound = None
+        self._queue = deque(maxlen=max_queued)
+        self._payloads = [None] * max_visible
+        self._screens = []
+        self._cards = []        # _cards[screen_index][slot]
+        self._busy = [False] * max_visible
+        # Set while a slot fades out: hiding it again or clicking it is a no-op
+        self._releasing = [False] * max_visible
+        # Bumped per display, so a release scheduled for an earlier one is ignored
+        self._shown = [0] * max_visible
+        self._timers = []
+        for slot in range(max_visible):
+            timer = QTimer(self)
+            timer.setSingleShot(True)
+            timer.timeout.connect(lambda slot=slot: self._hide_slot(slot))
+            self._timers.append(timer)
+        self._pinned = set()
+        preload_notification_sound()
+        self._build_pool()
+        app = QGuiApplication.instance()
+        if app is not None:
+            app.screenAdded.connect(lambda _screen: self._build_pool())
+            app.screenRemoved.connect(lambda _screen: self._build_pool())
+
+    def _build_pool(self):
+        """(Re)build one column of cards per screen."""
+        for column in self._cards:
+            for card in column:
+                card.hide()
+                card.deleteLater()
+        self._pinned.clear()
+        self._screens = list(QGuiApplication.screens())
+        self._cards = []
+        for _screen in self._screens:
+            column = []
+            for slot in range(self.max_visible):
+                card = PaymentNotificationCard(play_sound=False)
+                card.dismissed.connect(lambda slot=slot: self._hide_slot(slot))
+                card.clicked.connect(lambda slot=slot: self._on_card_clicked(slot))
+                column.append(card)
+            self._cards.append(column)
+        self._busy = [False] * self.max_visible
+        self._releasing = [False] * self.max_visible
+        self._shown = [n + 1 for n in self._shown]
+        log.debug("notification pool ready: %d screens x %d cards", len(self._screens), self.max_visible)
+
+    def show(self, title: str, message: str, payload=None):
+        """Show a notification now, or queue it if every slot is busy"""
+        try:
+            slot = self._busy.index(False)
+        except ValueError:
+            self._queue.append((title, message, payload))
+            return
+        self._display(slot, title, message, payload)
+
+    def queued(self):
+        return len(self._queue)
+
+    def _display(self, slot, title, message, payload=None):
+        self._busy[slot] = True
+        self._releasing[slot] = False
+        self._shown[slot] += 1
+        self._payloads[slot] = payload
+        for screen, column in zip(self._screens, self._cards):
+            card = column[slot]
+            card.set_content(title, message)
+            geo = screen.geometry()
+            x = geo.x() + geo.width() - card.width() - self.MARGIN
+            y = geo.y() + geo.height() - self.MARGIN - (slot + 1) * card.height() - slot * self.CARD_GAP
+            card.move(x, y)
+            card.show()
+            card.raise_()
+            if card not in self._pinned:
+                # Window-manager hints only need setting once per native window
+                pin_to_all_desktops(card)
+                self._pinned.add(card)
+            card.animate_in()
+        self._timers[slot].start(self.display_ms)
+        self._play_sound()
+
+    def _play_sound(self):
+        now = time.monotonic()
+        if self._last_sound is not None and (now - self._last_sound) * 1000 < self.sound_interval_ms:
+            return
+        self._last_sound = now
+        play_notification_sound()
+
+    def _on_card_clicked(self, slot):
+        if not self._busy[slot] or self._releasing[slot]:
+            return
+        payload = self._payloads[slot]
+        self._hide_slot(slot)
+        self.activated.emit(payload)
+
+    def _hide_slot(self, slot):
+        # The timer, a click and the close button can all hide the same card
+        if not self._busy[slot] or self._releasing[slot]:
+            return
+        self._releasing[slot] = True
+        self._timers[slot].stop()
+        for column in self._cards:
+            column[slot].animate_out()
+        # Free the slot once the fade-out is done, then show the next queued one
+        shown = self._shown[slot]
+        QTimer.singleShot(350, lambda: self._release_slot(slot, shown))
+
+    def _release_slot(self, slot, shown):
+        if shown != self._shown[slot]:
+            return
+        self._busy[slot] = False
+        self._releasing[slot] = False
+        self._payloads[slot] = None
+        if self._queue:
+            self._display(slot, *self._queue.popleft())
+
+
+class NotificationCoalescer(QObject):
+    """Groups bursts of payment notifications into one summary card.
+
+    The first payment after a quiet period is passed straight through. Any
+    further payments inside the next ``window_ms`` are held back and
+    released together when the window closes: a single payment as-is,
+    several as one "N payments, KES X total" card (failed or cancelled
+    payments are counted separately, not in the total). If anything was
+    released, a new window starts straight away; the window re-arms after it
+    closes rather than sliding, so a long burst produces one card per window.
+
+    :attr:`ready` carries ``(title, message, receipts)``; the receipts list
+    lets the card drill down to the matching transactions.
+    """
+
+    ready = pyqtSignal(str, str, list)
+
+    def __init__(self, window_ms=2000, parent=None):
+        super().__init__(parent)
+        self._pending = []
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(window_ms)
+        self._timer.timeout.connect(self._close_window)
+
+    def add(self, title: str, message: str, record=None):
+        """Queue one payment; ``record`` is a normalized callback dict"""
+        item = (title, message, record or {})
+        if self._timer.isActive():
+            self._pending.append(item)
+            return
+        self._emit([item])
+        self._timer.start()
+
+    def _close_window(self):
+        if not self._pending:
+            return
+        items, self._pending = self._pending, []
+        self._emit(items)
+        self._timer.start()
+
+    def _emit(self, items):
+        receipts = [rec.get('transaction_id') for _t, _m, rec in items if rec.get('transaction_id')]
+        if len(items) == 1:
+            title, message, _rec = items[0]
+            self.ready.emit(title, message, receipts)
+            return
+        paid = [rec for _t, _m, rec in items if rec.get('ok')]
+        failed = len(items) - len(paid)
+        parts = []
+        if paid:
+            total = sum(rec.get('amount') or 0 for rec in paid)
+            parts.append(f"{len(paid)} payment{'s' if len(paid) != 1 else ''}, {format_kes(total)} total")
+        if failed:
+            parts.append(f"{failed} failed")
+        title = "💰 PAYMENTS RECEIVED" if paid else "❌ PAYMENTS FAILED"
+        message = f"{', '.join(parts)}\nLatest: {items[-1][1]}\nClick to view them"
+        self.ready.emit(title, message, receipts)
@@ -1,19 +1,61 @@
-import threading
+import time
 from PyQt6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QLabel, 
-    QTableWidget, QTableWidgetItem, QHeaderView
+    QTableView, QHeaderView
 )
 from PyQt6.QtCore import QTimer
-import requests
 
 from ui.components.card_widgets import CardWidget
 from ui.components.modern_buttons import ModernButton
+from ui.components.modern_inputs import ModernLineEdit
+from ui.models.transactions_model import TransactionsTableModel
+from ui.models.frame_batcher import FrameBatcher
+from ui.models.transaction_index import TransactionIndex, TransactionQuery, parse_query
+from ui.models.local_cache import LocalTransactionCache, shop_key, save_last_context, load_last_context
+from ui.network.history_loader import HistoryLoader
+from utils.log import get_logger
+from utils.sales_stats import SalesAggregator
 from config import SERVER_URL
 
+log = get_logger(__name__)
+
 
 class TransactionsWidget(QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
+        self.model = TransactionsTableModel(parent=self)
+        # Live rows are coalesced into one insert per frame tick
+        self._live_rows = FrameBatcher(self._append_live, parent=self)
+        # History pages are fetched and parsed on the thread pool and arrive
+        # here through queued signals, so the model is only touched on the GUI thread.
+        self._loader = HistoryLoader(self)
+        self._loader.signals.page.connect(self._on_history_page)
+        self._loader.signals.delta.connect(self._on_history_delta)
+        self._loader.signals.finished.connect(self._on_history_finished)
+        self._loader.signals.failed.connect(self._on_history_failed)
+        self._index = TransactionIndex(self.model.store)
+        # Today's totals per till; reseeded from the store after each load,
+        # then updated per live payment
+        self.stats = SalesAggregator()
+        # Local per-shop cache and the shortcodes its history is fetched for;
+        # set by set_context()
+        self._cache = None
+        self._shortcodes = None
+        self._cache_shown = False
+        # While a cache delta is being fetched, live rows wait here so they
+        # end up above the (older) delta rows
+        self._syncing = False
+        self._parked = []
+        # True until the cached rows of a load have been fully streamed
+        self._loading_cache = False
+        self._query = None
+        # Receipts picked from a notification; shown while the search box is empty
+        self._pinned_query = None
+        # Keystrokes restart this timer; the search runs once typing pauses
+        self._search_timer = QTimer(self)
+        self._search_timer.setSingleShot(True)
+        self._search_timer.setInterval(250)
+        self._search_timer.timeout.connect(self._apply_search)
         self._build_ui()
 
     def _build_ui(self):
@@ -33,32 +75,54 @@ class TransactionsWidget(QWidget):
         header_layout.addWidget(title)
         header_layout.addStretch()
         
+        self.sync_label = QLabel("")
+        self.sync_label.setStyleSheet("color: #64748b; font-size: 13px;")
+        header_layout.addWidget(self.sync_label)
+
         self.refresh_btn = ModernButton("Refresh", size="small")
         self.refresh_btn.clicked.connect(self.on_refresh)
         header_layout.addWidget(self.refresh_btn)
         
         layout.addLayout(header_layout)
+
+        # Search bar
+        search_layout = QHBoxLayout()
+        self.search_edit = ModernLineEdit("Search: 0712…, *5678, KES 500, receipt, today, 10:00-12:00")
+        self.search_edit.setClearButtonEnabled(True)
+        self.search_edit.textChanged.connect(self._on_search_edited)
+        search_layout.addWidget(self.search_edit, 1)
+
+        self.search_status = QLabel("")
+        self.search_status.setStyleSheet("color: #64748b; font-size: 13px;")
+        search_layout.addWidget(self.search_status)
+
+        layout.addLayout(search_layout)
         
         # Transactions table card
         table_card = CardWidget()
         table_layout = table_card.layout()
         
-        self.table = QTableWidget(0, 5)
-        self.table.setHorizontalHeaderLabels(['Time', 'Amount', 'Phone', 'Status', 'Transaction ID'])
+        self.table = QTableView()
+        self.table.setModel(self.model)
         self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        # Fixed row heights let the view map scroll offsets to rows without
+        # measuring every row, which keeps scrolling cheap on huge histories.
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        self.table.verticalHeader().setDefaultSectionSize(34)
+        self.table.setWordWrap(False)
         
         # Style the table
         self.table.setStyleSheet("""
-            QTableWidget {
+            QTableView {
                 border: none;
                 gridline-color: #e2e8f0;
                 font-size: 13px;
             }
-            QTableWidget::item {
+            QTableView::item {
                 padding: 8px;
                 border-bottom: 1px solid #f1f5f9;
             }
-            QTableWidget::item:selected {
+            QTableView::item:selected {
                 background-color: #dbeafe;
             }
             QHeaderView::section {
@@ -77,75 +141,175 @@ class TransactionsWidget(QWidget):
     def on_refresh(self):
         self.refresh_btn.setEnabled(False)
         self.refresh_btn.setText("Refreshing...")
-        
-        def refresh_complete():
-            self.refresh_btn.setEnabled(True)
-            self.refresh_btn.setText("Refresh")
-            
-        threading.Thread(target=self._refresh_data, daemon=True).start()
-        QTimer.singleShot(2000, refresh_complete)
-
-    def _refresh_data(self):
         self.load_from_server()
 
+    def _refresh_complete(self):
+        self.refresh_btn.setEnabled(True)
+        self.refresh_btn.setText("Refresh")
+
     def add_transaction(self, time_or_text, amount=None, phone=None, status=None, txid=None):
-        row = self.table.rowCount()
-        self.table.insertRow(row)
-        
+        self._live_rows.add(self._make_row(time_or_text, amount, phone, status, txid))
+
+    def add_record(self, rec):
+        """Add a record produced by ``utils.callback_parser.normalize_notification``."""
+        self._live_rows.add(self.model.store.row_from_record(rec))
+
+    def _make_row(self, time_or_text, amount=None, phone=None, status=None, txid=None):
+        store = self.model.store
         if amount is None and isinstance(time_or_text, str) and '|' in time_or_text:
             parts = [p.strip() for p in time_or_text.split('|')]
             vals = parts + [''] * (5 - len(parts))
-        elif amount is None and isinstance(time_or_text, str):
-            vals = [time_or_text, '', '', '', '']
+            return store.make_row(*vals[:5])
+        if amount is None and isinstance(time_or_text, str):
+            # Free text (e.g. an error message) goes in the status column
+            return store.make_row(time.time(), status=time_or_text)
+        return store.make_row(time_or_text, amount, phone, status, txid)
+
+    def _append_live(self, rows):
+        if self._syncing:
+            self._parked.extend(rows)
+            return
+        store = self.model.store
+        rows = [r for r in rows if not store.contains_txid(r[5])]
+        self.model.append_rows(rows)
+        for _rid, ts, amount, _phone, _status, _txid, shortcode in rows:
+            if amount > 0:
+                self.stats.add(shortcode, amount, ts)
+
+    def set_context(self, merchant_id, shop_codes):
+        """Switch to the local cache of this merchant/shop.
+
+        Returns True if the shop changed (the table then needs a fresh load).
+        """
+        if isinstance(shop_codes, (list, tuple)):
+            self._shortcodes = [str(c) for c in shop_codes if c] or None
         else:
-            vals = [
-                str(time_or_text or ''),
-                str(amount or ''),
-                str(phone or ''),
-                str(status or ''),
-                str(txid or '')
-            ]
-
-        for c in range(5):
-            item = QTableWidgetItem(vals[c])
-            self.table.setItem(row, c, item)
-
-    def load_from_server(self, server_url=None, limit=100):
+            self._shortcodes = [str(shop_codes)] if shop_codes else None
+        key = shop_key(merchant_id, shop_codes)
+        if self._cache is not None and self._cache.key == key:
+            return False
+        try:
+            self._cache = LocalTransactionCache(key)
+        except Exception as e:
+            log.warning("local cache unavailable: %s", e)
+            self._cache = None
+        self._cache_shown = False
+        save_last_context(merchant_id, shop_codes)
+        return True
+
+    def restore_last_context(self):
+        """Show the cached history of the last used shop, without any network."""
+        ctx = load_last_context()
+        if not ctx:
+            return
+        self.set_context(*ctx)
+        if self._cache is not None:
+            self._start_load(None)
+
+    def load_from_server(self, server_url=None, limit=None):
+        """Stream history from the server; ``limit`` of None loads everything.
+
+        With a local cache only rows newer than the cache are requested, and
+        all of them (``limit`` is ignored), so the cache stays contiguous.
+        """
         if not server_url:
             server_url = SERVER_URL or "http://localhost:5000"  # Default to localhost if not configured
-            
-        print(f"[GUI Debug] Using server URL: {server_url}")
-            
-        if not server_url:
-            print("[GUI Debug] No server URL configured for transactions")
-            self.add_transaction("No server URL configured")
+
+        log.debug("loading transactions from %s/api/transactions", server_url)
+        self._start_load(server_url, limit)
+
+    def _start_load(self, server_url, limit=None):
+        store = self.model.store
+        if self._cache is not None and self._cache_shown and not self._loading_cache:
+            # Cached rows are already on screen: fetch just the delta
+            self._syncing = True
+            self._loader.start(server_url, store.make_row, shortcodes=self._shortcodes,
+                               cache=self._cache, read_cache=False)
             return
-            
-        try:
-            url = f"{server_url}/api/transactions"
-            if limit:
-                url += f"?limit={limit}"
-            print(f"[GUI Debug] Loading transactions from: {url}")
-            resp = requests.get(url, timeout=10)
-            resp.raise_for_status()
-            
-            data = resp.json()
-            print(f"[GUI Debug] Received {len(data)} transactions from server")
-            
-            self.table.setRowCount(0)
-            
-            for tx in data:
-                self.add_transaction(
-                    tx.get('time', ''),
-                    tx.get('amount', ''),
-                    tx.get('phone', ''),
-                    tx.get('status', ''),
-                    tx.get('transaction_id', '')
-                )
-            print("[GUI Debug] Transaction table updated successfully")
-                
-        except Exception as e:
-            print(f"[GUI Error] Failed to load transactions: {e}")
-            import traceback
-            print(traceback.format_exc())
-            self.add_transaction(f'Failed to load transactions: {e}')
\ No newline at end of file
+        # Start from an empty table: live rows arriving from now on go on top
+        # while history pages stream in below them; rows seen through both
+        # paths are dropped by transaction id.
+        self._live_rows.flush_now()
+        self.model.clear()
+        self._syncing = self._cache is not None and server_url is not None
+        self._cache_shown = self._cache is not None
+        self._loading_cache = self._cache is not None
+        self._loader.start(server_url, store.make_row, limit=limit, shortcodes=self._shortcodes,
+                           cache=self._cache)
+
+    def _on_history_page(self, generation, rows):
+        if generation != self._loader.generation:
+            return
+        store = self.model.store
+        self.model.extend_history([r for r in rows if not store.contains_txid(r[5])])
+
+    def _on_history_delta(self, generation, rows):
+        if generation != self._loader.generation:
+            return
+        store = self.model.store
+        self.model.append_rows([r for r in rows if not store.contains_txid(r[5])])
+
+    def _end_sync(self):
+        self._loading_cache = False
+        self._syncing = False
+        parked, self._parked = self._parked, []
+        if parked:
+            self._append_live(parked)
+
+    def _on_history_finished(self, generation, total):
+        if generation != self._loader.generation:
+            return
+        log.debug("received %d transactions from server", total)
+        self._end_sync()
+        self.sync_label.setText("")
+        self._refresh_complete()
+        self.stats.seed_columns(self.model.store.columns())
+        # Build the search index now, while the cashier is not typing
+        QTimer.singleShot(0, self._index.sync)
+        if self._query is not None:
+            self._apply_search()
+
+    def _on_search_edited(self, _text):
+        self._pinned_query = None
+        self._search_timer.start()
+
+    def show_receipts(self, receipts):
+        """Filter the table down to the given receipts (notification drill-down)."""
+        query = TransactionQuery()
+        query.receipts = frozenset(str(r).upper() for r in receipts if r)
+        if not query.receipts:
+            return
+        self._search_timer.stop()
+        self.search_edit.blockSignals(True)
+        self.search_edit.clear()
+        self.search_edit.blockSignals(False)
+        self._pinned_query = query
+        self._apply_search()
+
+    def _apply_search(self):
+        text = self.search_edit.text().strip()
+        query = parse_query(text) if text else self._pinned_query
+        if query is None or query.is_empty():
+            self._query = None
+            self.model.set_filter(None)
+            self.search_status.setText("")
+            return
+        self._query = query
+        keys = self._index.search(query)
+        self.model.set_filter(keys, lambda k, q=query: self._index.matches(q, k))
+        if query is self._pinned_query:
+            self.search_status.setText(f"{len(keys):,} payment{'s' if len(keys) != 1 else ''} from notification")
+        else:
+            self.search_status.setText(f"{len(keys):,} match{'es' if len(keys) != 1 else ''}")
+
+    def _on_history_failed(self, generation, error):
+        if generation != self._loader.generation:
+            return
+        log.warning("failed to load transactions: %s", error)
+        self._end_sync()
+        if self._cache is not None:
+            self.sync_label.setText("Offline – showing cached history")
+            self.stats.seed_columns(self.model.store.columns())
+        else:
+            self.add_transaction(f'Failed to load transactions: {error}')
+        self._refresh_complete()
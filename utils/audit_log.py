@@ -0,0 +1,211 @@
+"""Audit log for outgoing Daraja requests (STK push), as JSON lines.
+
+Callers hand a record to :meth:`AuditLog.write`, which only puts it on a
+queue. One background thread serialises, buffers and writes the records
+and rotates the file, so a GUI worker never waits on disk.
+
+Records are redacted before they are written. Credentials (``Authorization``
+headers, ``Password``, tokens, keys) are replaced with ``***`` and phone
+numbers are masked, so the log is safe to attach to a bug report.
+
+    audit = get_audit_log()
+    audit.write({'event': 'stk_push', 'phone': phone, 'token_ms': 112.4, ...})
+
+Configuration comes from the environment:
+
+ - ``AUDIT_LOG_FILE``          path (default ``stk_audit.log`` next to the app)
+ - ``AUDIT_LOG_MAX_BYTES``     rotate when the file reaches this size (default 1 MB)
+ - ``AUDIT_LOG_ROTATE_HOURS``  also rotate after this many hours (default 24, 0 = never)
+ - ``AUDIT_LOG_BACKUPS``       rotated files kept, ``.1`` newest (default 5)
+"""
+import atexit
+import json
+import os
+import queue
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+from utils.callback_parser import mask_phone
+from utils.log import get_logger
+
+log = get_logger(__name__)
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'stk_audit.log')
+
+# Keys whose values are never written (compared lower-case)
+SECRET_KEYS = {
+    'authorization', 'password', 'access_token', 'token', 'passkey',
+    'consumer_key', 'consumer_secret', 'securitycredential', 'initiatorpassword',
+}
+# Keys holding phone numbers, written masked
+PHONE_KEYS = {'phone', 'phonenumber', 'partya', 'msisdn'}
+
+_AUTH_VALUE = re.compile(r'\b(Basic|Bearer)\s+[A-Za-z0-9._~+/=-]+')
+
+_STOP = object()
+
+
+def redact(value, key=None):
+    """Copy of ``value`` with secrets replaced and phone numbers masked."""
+    name = str(key).lower() if key is not None else ''
+    if name in SECRET_KEYS and value not in (None, ''):
+        return '***'
+    if isinstance(value, dict):
+        return {k: redact(v, k) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    if name in PHONE_KEYS and value not in (None, ''):
+        return mask_phone(value)
+    if isinstance(value, str):
+        return _AUTH_VALUE.sub(r'\1 ***', value)
+    return value
+
+
+class AuditLog:
+    """Background JSON-lines writer with size and time based rotation."""
+
+    def __init__(self, path=DEFAULT_PATH, max_bytes=1_000_000, rotate_seconds=86400,
+                 backup_count=5, flush_interval=1.0, buffer_records=64):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.buffer_records = buffer_records
+        self.dropped = 0
+        self._queue = queue.SimpleQueue()
+        self._file = None
+        self._size = 0
+        self._opened_at = 0.0
+        self._thread = threading.Thread(target=self._run, name='audit-log', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, record):
+        """Queue ``record`` (a dict); ``ts`` is added if missing. Never blocks."""
+        if 'ts' not in record:
+            record = dict(record, ts=datetime.now(timezone.utc).isoformat(timespec='milliseconds'))
+        self._queue.put(record)
+
+    def close(self, timeout=2.0):
+        """Write what is queued and stop the writer thread."""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def _run(self):
+        buffered = []
+        deadline = None
+        while True:
+            wait = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                record = self._queue.get(timeout=wait)
+            except queue.Empty:
+                record = None
+            if record is _STOP:
+                self._flush(buffered)
+                if self._file is not None:
+                    self._file.close()
+                return
+            if record is not None:
+                try:
+                    buffered.append(json.dumps(redact(record), ensure_ascii=False, default=str))
+                except Exception:
+                    self.dropped += 1
+                    log.exception("could not serialise audit record")
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            if buffered and (len(buffered) >= self.buffer_records or time.monotonic() >= deadline):
+                self._flush(buffered)
+                buffered = []
+                deadline = None
+
+    def _flush(self, lines):
+        if not lines:
+            return
+        try:
+            if self._file is None:
+                self._open()
+            for line in lines:
+                if self._should_rotate():
+                    self._rotate()
+                data = line + '\n'
+                self._file.write(data)
+                self._size += len(data.encode('utf-8'))
+            self._file.flush()
+        except Exception:
+            self.dropped += len(lines)
+            log.exception("could not write %d audit records to %s", len(lines), self.path)
+
+    def _open(self):
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._size = self._file.tell()
+        # An existing file counts from its last change, so restarts do not postpone rotation
+        try:
+            self._opened_at = os.path.getmtime(self.path) if self._size else time.time()
+        except OSError:
+            self._opened_at = time.time()
+
+    def _should_rotate(self):
+        if self.max_bytes and self._size >= self.max_bytes:
+            return True
+        return bool(self.rotate_seconds) and time.time() - self._opened_at >= self.rotate_seconds
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        if self.backup_count > 0:
+            for i in range(self.backup_count - 1, 0, -1):
+                src = f'{self.path}.{i}'
+                if os.path.exists(src):
+                    os.replace(src, f'{self.path}.{i + 1}')
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._size = 0
+        self._opened_at = time.time()
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def get_audit_log():
+    """The process-wide audit log, configured from the environment on first use."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = AuditLog(
+                path=os.getenv('AUDIT_LOG_FILE') or DEFAULT_PATH,
+                max_bytes=int(os.getenv('AUDIT_LOG_MAX_BYTES', '1000000')),
+                rotate_seconds=float(os.getenv('AUDIT_LOG_ROTATE_HOURS', '24')) * 3600,
+                backup_count=int(os.getenv('AUDIT_LOG_BACKUPS', '5')),
+            )
+        return _default
+
+
+def describe_exchange(resp):
+    """Request and response fields of a ``requests.Response`` for an audit record.
+
+    Bodies are parsed as JSON when possible so their keys can be redacted.
+    """
+    out = {'status': getattr(resp, 'status_code', None)}
+    req = getattr(resp, 'request', None)
+    if req is not None:
+        body = getattr(req, 'body', None)
+        if isinstance(body, bytes):
+            body = body.decode('utf-8', 'replace')
+        out['request'] = {'url': getattr(req, 'url', ''), 'headers': dict(getattr(req, 'headers', {}) or {}),
+                          'body': _maybe_json(body)}
+    out['response'] = _maybe_json(getattr(resp, 'text', ''))
+    return out
+
+
+def _maybe_json(text):
+    try:
+        return json.loads(text)
+    except Exception:
+        return text
@@ -0,0 +1,257 @@
+"""Normalize M-Pesa callback payloads into flat transaction records.
+
+The server and the desktop clients all receive the same Daraja shapes (STK
+``Body.stkCallback`` and C2B confirmation/validation dicts). This module is the
+single place that knows how to pull amount, phone, receipt and status out of
+them so every view agrees on what a transaction looks like.
+"""
+import time
+from datetime import datetime
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _parse_mpesa_time(value):
+    """Parse ``YYYYMMDDHHmmss`` (as sent by Daraja) into an epoch timestamp."""
+    try:
+        s = str(value)
+        if len(s) >= 14:
+            return datetime.strptime(s[:14], '%Y%m%d%H%M%S').timestamp()
+    except Exception:
+        pass
+    return None
+
+
+def parse_time(value):
+    """Best-effort conversion of the time formats we see into epoch seconds.
+
+    Accepts epoch numbers, Daraja ``YYYYMMDDHHmmss`` strings, ISO timestamps
+    (``created_at`` on the server) and ``YYYY-MM-DD HH:MM:SS``. Returns None
+    when nothing matches.
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    s = str(value).strip()
+    if s.isdigit():
+        return _parse_mpesa_time(s)
+    try:
+        dt = datetime.fromisoformat(s.replace('Z', '+00:00'))
+        if dt.tzinfo is not None:
+            return dt.timestamp()
+        return time.mktime(dt.timetuple()) + dt.microsecond / 1e6
+    except Exception:
+        pass
+    for fmt in (TIME_FORMAT, '%Y-%m-%d %H:%M'):
+        try:
+            return datetime.strptime(s, fmt).timestamp()
+        except Exception:
+            continue
+    return None
+
+
+def parse_amount(value):
+    """Return the amount as a float, or None if it is missing/unparseable."""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    s = str(value).replace('KES', '').replace(',', '').strip()
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+
+def mask_phone(phone):
+    """Mask all but the last four digits of a phone number."""
+    phone = str(phone or '')
+    if len(phone) > 4:
+        return '*' * (len(phone) - 4) + phone[-4:]
+    return phone
+
+
+def display_phone(phone):
+    """The phone number as clients are sent it: masked, or '' if it is not a number."""
+    phone = str(phone or '')
+    return mask_phone(phone) if phone.isdigit() else ''
+
+
+def _empty_record(cb_type):
+    return {
+        'type': cb_type or '',
+        'timestamp': None,
+        'amount': None,
+        'phone': '',
+        'status': '',
+        'transaction_id': '',
+        'shortcode': '',
+        'name': '',
+        'bill_ref': '',
+        'ok': True,
+    }
+
+
+def _parse_stk(stk, rec):
+    res_code = stk.get('ResultCode')
+    res_desc = stk.get('ResultDesc') or ''
+    rec['ok'] = res_code in (0, '0')
+    if res_desc:
+        rec['status'] = f"{'✅' if rec['ok'] else '❌'} {res_desc}"
+    elif res_code is not None:
+        rec['status'] = f"Code {res_code}"
+    rec['transaction_id'] = (stk.get('MpesaReceiptNumber') or stk.get('CheckoutRequestID')
+                             or stk.get('MerchantRequestID') or '')
+
+    cb = stk.get('CallbackMetadata') or stk.get('Callback') or {}
+    items = cb.get('Item') if isinstance(cb, dict) else None
+    if not items and isinstance(cb, list):
+        items = cb
+    if items and isinstance(items, list):
+        for it in items:
+            if not isinstance(it, dict):
+                continue
+            name = it.get('Name') or it.get('name')
+            val = it.get('Value')
+            if not name:
+                continue
+            key = name.lower()
+            if key == 'amount':
+                rec['amount'] = parse_amount(val)
+            elif key in ('phonenumber', 'phone'):
+                # A null PhoneNumber must not become the string 'None'
+                rec['phone'] = str(val) if val is not None else rec['phone']
+            elif key == 'mpesareceiptnumber':
+                rec['transaction_id'] = val or rec['transaction_id']
+            elif key == 'transactiondate':
+                rec['timestamp'] = _parse_mpesa_time(val) or rec['timestamp']
+
+
+def normalize_callback(cb_type, data, created_at=None):
+    """Flatten a stored/received callback payload into a transaction record.
+
+    ``cb_type`` is the callback type the server stored (``stk``,
+    ``c2b_confirmation``, ``c2b_validation``, ``transaction``...). ``data`` is
+    the raw Daraja payload. ``created_at`` is used as the time when the payload
+    itself carries none.
+
+    Returns a dict with ``type``, ``timestamp`` (epoch seconds or None),
+    ``amount`` (float or None), ``phone``, ``status``, ``transaction_id``,
+    ``shortcode``, ``name``, ``bill_ref`` and ``ok``.
+    """
+    rec = _empty_record(cb_type)
+    d = data if isinstance(data, dict) else {}
+
+    stk = None
+    if d:
+        body = d.get('Body')
+        stk = (body.get('stkCallback') if isinstance(body, dict) else None) or d.get('stkCallback')
+
+    if stk and isinstance(stk, dict):
+        _parse_stk(stk, rec)
+        rec['shortcode'] = str(d.get('merchant_id') or d.get('BusinessShortCode') or '')
+    elif 'TransID' in d or 'TransAmount' in d or (cb_type or '').startswith('c2b'):
+        rec['transaction_id'] = d.get('TransID') or ''
+        rec['amount'] = parse_amount(d.get('TransAmount') or d.get('Amount'))
+        rec['phone'] = str(d.get('MSISDN') or d.get('Phone') or '')
+        rec['timestamp'] = _parse_mpesa_time(d.get('TransTime'))
+        rec['shortcode'] = str(d.get('BusinessShortCode') or d.get('ShortCode') or '')
+        rec['bill_ref'] = d.get('BillRefNumber') or ''
+        rec['name'] = ' '.join(p for p in (d.get('FirstName'), d.get('MiddleName'), d.get('LastName')) if p)
+        status = f"✅ {d.get('TransactionType', '')}".rstrip()
+        if rec['bill_ref']:
+            status += f" | Ref: {rec['bill_ref']}"
+        rec['status'] = status
+    else:
+        # Simple test payloads: {"merchant_id": ..., "amount": ..., "phone": ..., "txid": ...}
+        rec['amount'] = parse_amount(d.get('amount'))
+        rec['phone'] = str(d.get('phone') or '')
+        rec['transaction_id'] = str(d.get('txid') or d.get('transaction_id') or '')
+        rec['shortcode'] = str(d.get('merchant_id') or d.get('BusinessShortCode') or d.get('ShortCode') or '')
+        rec['status'] = str(d.get('status') or 'Received')
+
+    if rec['timestamp'] is None:
+        rec['timestamp'] = parse_time(created_at)
+    return rec
+
+
+def build_notification(rid, rec, shortcode=''):
+    """Compact ``notification`` message for a normalized record.
+
+    The server sends this instead of the raw Daraja payload: only the fields
+    clients show, with the phone masked. ``rid`` is the stored callback id.
+    """
+    return {
+        'id': rid,
+        'type': rec['type'],
+        'shortcode': rec['shortcode'] or str(shortcode or ''),
+        'amount': rec['amount'],
+        'phone': display_phone(rec['phone']),
+        'receipt': rec['transaction_id'],
+        'name': rec['name'],
+        'bill_ref': rec['bill_ref'],
+        'status': rec['status'],
+        'ok': rec['ok'],
+        'ts': rec['timestamp'],
+    }
+
+
+def _from_compact(msg):
+    rec = _empty_record(msg.get('type', ''))
+    rec['id'] = msg.get('id')
+    rec['timestamp'] = msg.get('ts')
+    rec['amount'] = parse_amount(msg.get('amount'))
+    rec['phone'] = str(msg.get('phone') or '')
+    rec['status'] = str(msg.get('status') or '')
+    rec['transaction_id'] = str(msg.get('receipt') or '')
+    rec['shortcode'] = str(msg.get('shortcode') or '')
+    rec['name'] = msg.get('name') or ''
+    rec['bill_ref'] = msg.get('bill_ref') or ''
+    rec['ok'] = bool(msg.get('ok', True))
+    return rec
+
+
+def normalize_notification(msg):
+    """Normalize a Socket.IO ``notification`` message into a transaction record.
+
+    Handles the compact messages built by :func:`build_notification` (used
+    as-is, even when the raw payload is attached under ``data``), the older
+    ``{"type": ..., "data": {...}}`` envelope and list-wrapped messages.
+    Unknown shapes yield a record whose status is the message text.
+
+    Compact records also carry the stored callback ``id``. The phone is
+    masked the same way whichever shape the message had.
+    """
+    if isinstance(msg, list):
+        for it in msg:
+            if isinstance(it, dict):
+                msg = it
+                break
+    if not isinstance(msg, dict):
+        rec = _empty_record('')
+        rec['status'] = str(msg)
+        rec['timestamp'] = time.time()
+        return rec
+
+    if 'receipt' in msg and 'ts' in msg:
+        rec = _from_compact(msg)
+    else:
+        data = msg.get('data')
+        if not isinstance(data, dict):
+            data = msg
+        rec = normalize_callback(msg.get('type', ''), data)
+        rec['phone'] = display_phone(rec['phone'])
+    if rec['timestamp'] is None:
+        rec['timestamp'] = time.time()
+    return rec
+
+
+def format_time(ts):
+    """Format an epoch timestamp for display; empty string when unknown."""
+    if ts is None:
+        return ''
+    try:
+        return datetime.fromtimestamp(ts).strftime(TIME_FORMAT)
+    except (OverflowError, OSError, ValueError):
+        return ''
@@ -0,0 +1,61 @@
+"""Client side of acknowledged notification delivery.
+
+Clients connect with ``?client_id=<id>&ack=1``. The server then keeps every
+notification it sends them until they answer with a ``notification_ack``
+event, and sends it again on timeout or after a reconnect. A notification
+can therefore arrive more than once, so clients skip ids they have already
+handled (and acknowledge them again, since the first ack was evidently lost).
+"""
+import threading
+import uuid
+from collections import deque
+
+from utils.log import get_logger
+
+log = get_logger(__name__)
+
+ACK_EVENT = 'notification_ack'
+
+
+def new_client_id():
+    """A client id that stays the same across reconnects of one client."""
+    return uuid.uuid4().hex
+
+
+def delivery_params(client_id):
+    """Query parameters that opt a connection in to acknowledged delivery."""
+    return {'client_id': client_id, 'ack': '1'}
+
+
+class SeenIds:
+    """Bounded set of the most recently seen ids (notification ids, receipts)."""
+
+    def __init__(self, capacity=2000):
+        self._order = deque()
+        self._ids = set()
+        self._capacity = capacity
+        self._lock = threading.Lock()
+
+    def add(self, nid):
+        """Remember ``nid``; False if it was already seen. ``None`` is always new."""
+        if nid is None:
+            return True
+        with self._lock:
+            if nid in self._ids:
+                return False
+            self._ids.add(nid)
+            self._order.append(nid)
+            if len(self._order) > self._capacity:
+                self._ids.discard(self._order.popleft())
+            return True
+
+
+def acknowledge(sio, *msgs):
+    """Acknowledge notification messages in one event (messages without an id are skipped)."""
+    ids = [m.get('id') for m in msgs if isinstance(m, dict) and m.get('id') is not None]
+    if not ids:
+        return
+    try:
+        sio.emit(ACK_EVENT, {'ids': ids})
+    except Exception as e:
+        log.warning("failed to acknowledge notifications %s: %s", ids, e)
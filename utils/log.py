@@ -0,0 +1,131 @@
+"""Logging setup shared by the server and the GUI clients.
+
+Records go through a ``QueueHandler`` into an in-memory queue, and a
+``QueueListener`` thread does the formatting and writing. A handler on a
+hot path therefore never blocks on stdout/stderr or a log file.
+
+Configuration comes from the environment:
+
+ - ``LOG_LEVEL``   root level (default ``INFO``)
+ - ``LOG_LEVELS``  per-logger levels, e.g. ``server=DEBUG,socketio=WARNING``
+ - ``LOG_FORMAT``  ``text`` (default) or ``json`` (one object per line)
+ - ``LOG_FILE``    also write to this file
+ - ``LOG_SAMPLE_EVERY``  default rate for :class:`Sampler` (default 100)
+
+Per-event messages (each callback, each notification) are logged at DEBUG
+and carry ids and types, never payloads. A :class:`Sampler` keeps
+high-frequency messages that are still useful at INFO down to one in N.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+# Chatty library loggers are quiet unless LOG_LEVELS says otherwise
+DEFAULT_LEVELS = {'socketio': 'WARNING', 'engineio': 'WARNING', 'werkzeug': 'WARNING', 'urllib3': 'WARNING'}
+
+TEXT_FORMAT = '%(asctime)s %(levelname)-7s %(name)s: %(message)s'
+
+_listener = None
+_setup_lock = threading.Lock()
+
+# Attributes every LogRecord has; anything else came in through ``extra=``
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, including fields passed with ``extra=``."""
+
+    def format(self, record):
+        out = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                out[key] = value if isinstance(value, (str, int, float, bool, type(None))) else str(value)
+        if record.exc_info:
+            out['exc'] = self.formatException(record.exc_info)
+        return json.dumps(out, ensure_ascii=False)
+
+
+def parse_levels(spec):
+    """``"server=DEBUG,socketio=WARNING"`` -> ``{logger name: level name}``"""
+    out = {}
+    for item in (spec or '').split(','):
+        name, _, level = item.partition('=')
+        name, level = name.strip(), level.strip().upper()
+        if name and level:
+            out[name] = level
+    return out
+
+
+def setup_logging(level=None, levels=None):
+    """Install the queue handler on the root logger (once per process).
+
+    ``level`` / ``levels`` override ``LOG_LEVEL`` / ``LOG_LEVELS``. Call this
+    before creating Socket.IO servers or clients so their loggers pick up
+    the per-logger levels.
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        formatter = JsonFormatter() if os.getenv('LOG_FORMAT', 'text') == 'json' else logging.Formatter(TEXT_FORMAT)
+        handlers = [logging.StreamHandler(sys.stderr)]
+        if os.getenv('LOG_FILE'):
+            handlers.append(logging.FileHandler(os.getenv('LOG_FILE'), encoding='utf-8'))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        log_queue = queue.SimpleQueue()
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+        root.setLevel((level or os.getenv('LOG_LEVEL', 'INFO')).upper())
+
+        per_logger = dict(DEFAULT_LEVELS)
+        per_logger.update(parse_levels(os.getenv('LOG_LEVELS')))
+        per_logger.update(levels or {})
+        for name, name_level in per_logger.items():
+            logging.getLogger(name).setLevel(name_level)
+
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+def get_logger(name):
+    return logging.getLogger(name)
+
+
+class Sampler:
+    """Let through the first of every ``every`` calls per key.
+
+        sample = Sampler(every=100)
+        if sample('broadcast'):
+            log.info('broadcast %s (%d so far)', rid, sample.count('broadcast'))
+
+    Counting is not locked; under contention a sample may be off by one,
+    which is fine for log volume control.
+    """
+
+    def __init__(self, every=None):
+        self.every = max(1, every or int(os.getenv('LOG_SAMPLE_EVERY', '100')))
+        self._counts = {}
+
+    def __call__(self, key=''):
+        n = self._counts.get(key, 0)
+        self._counts[key] = n + 1
+        return n % self.every == 0
+
+    def count(self, key=''):
+        """Calls seen for ``key`` so far."""
+        return self._counts.get(key, 0)
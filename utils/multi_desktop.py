@@ -0,0 +1,272 @@
+"""Native helpers for notification popups: show on every virtual desktop, play a chime.
+
+Both used to spawn processes for every popup (``xdotool``/``wmctrl`` per card,
+``paplay`` per sound). Here window hints are sent straight to the X server
+through libX11 and the chime is a ``QSoundEffect`` loaded once; external
+commands are only a fallback when the native route is unavailable; they are
+started without waiting for them and reaped on a later call.
+"""
+import ctypes
+import ctypes.util
+import math
+import os
+import platform
+import subprocess
+import wave
+from array import array
+
+from PyQt6.QtGui import QGuiApplication
+
+try:
+    from PyQt6.QtCore import QUrl
+    from PyQt6.QtMultimedia import QSoundEffect
+    _HAS_QTMULTIMEDIA = True
+except Exception:
+    _HAS_QTMULTIMEDIA = False
+
+from config import CACHE_DIR
+from utils.log import get_logger
+
+log = get_logger(__name__)
+
+_CHIME_FILE = 'notification.wav'
+
+# Fallback processes started by _spawn that have not been reaped yet
+_children = []
+
+
+def _spawn(args):
+    """Start ``args`` without waiting for it; returns the ``Popen``.
+
+    Finished children from earlier calls are polled here, so they do not
+    linger as zombies for the life of the GUI.
+    """
+    _children[:] = [p for p in _children if p.poll() is None]
+    proc = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _children.append(proc)
+    return proc
+
+
+# --- window pinning ---------------------------------------------------------
+
+# X11 constants (X.h / EWMH)
+_CLIENT_MESSAGE = 33
+_SUBSTRUCTURE_NOTIFY_MASK = 1 << 19
+_SUBSTRUCTURE_REDIRECT_MASK = 1 << 20
+_PROP_MODE_REPLACE = 0
+_XA_ATOM = 4
+_XA_CARDINAL = 6
+_NET_WM_STATE_ADD = 1
+_ALL_DESKTOPS = 0xFFFFFFFF
+
+
+class _XClientMessageEvent(ctypes.Structure):
+    _fields_ = [
+        ('type', ctypes.c_int),
+        ('serial', ctypes.c_ulong),
+        ('send_event', ctypes.c_int),
+        ('display', ctypes.c_void_p),
+        ('window', ctypes.c_ulong),
+        ('message_type', ctypes.c_ulong),
+        ('format', ctypes.c_int),
+        ('data', ctypes.c_long * 5),
+    ]
+
+
+class _XEvent(ctypes.Union):
+    _fields_ = [('xclient', _XClientMessageEvent), ('pad', ctypes.c_long * 24)]
+
+
+class _X11:
+    """Minimal libX11 binding: just enough to send EWMH hints."""
+
+    def __init__(self):
+        path = ctypes.util.find_library('X11')
+        if not path:
+            raise OSError('libX11 not found')
+        lib = ctypes.cdll.LoadLibrary(path)
+        lib.XOpenDisplay.restype = ctypes.c_void_p
+        lib.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        lib.XInternAtom.restype = ctypes.c_ulong
+        lib.XInternAtom.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int]
+        lib.XDefaultRootWindow.restype = ctypes.c_ulong
+        lib.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+        lib.XSendEvent.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_int, ctypes.c_long,
+                                   ctypes.POINTER(_XEvent)]
+        lib.XChangeProperty.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_ulong, ctypes.c_ulong,
+                                        ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+        lib.XFlush.argtypes = [ctypes.c_void_p]
+        self.lib = lib
+        self.display = lib.XOpenDisplay(None)
+        if not self.display:
+            raise OSError('cannot open X display')
+        self.root = lib.XDefaultRootWindow(self.display)
+        atom = lambda name: lib.XInternAtom(self.display, name, False)
+        self.wm_state = atom(b'_NET_WM_STATE')
+        self.wm_state_sticky = atom(b'_NET_WM_STATE_STICKY')
+        self.wm_state_above = atom(b'_NET_WM_STATE_ABOVE')
+        self.wm_desktop = atom(b'_NET_WM_DESKTOP')
+
+    def _client_message(self, window, message_type, *data):
+        event = _XEvent()
+        msg = event.xclient
+        msg.type = _CLIENT_MESSAGE
+        msg.send_event = 1
+        msg.display = self.display
+        msg.window = window
+        msg.message_type = message_type
+        msg.format = 32
+        for i, value in enumerate(data):
+            msg.data[i] = value
+        self.lib.XSendEvent(self.display, self.root, False,
+                            _SUBSTRUCTURE_NOTIFY_MASK | _SUBSTRUCTURE_REDIRECT_MASK, ctypes.byref(event))
+
+    def make_sticky(self, window):
+        # Properties cover windows the WM has not managed yet; client messages
+        # cover already-mapped ones (the WM owns their state from then on).
+        desktop = (ctypes.c_ulong * 1)(_ALL_DESKTOPS)
+        states = (ctypes.c_ulong * 2)(self.wm_state_sticky, self.wm_state_above)
+        self.lib.XChangeProperty(self.display, window, self.wm_desktop, _XA_CARDINAL, 32,
+                                 _PROP_MODE_REPLACE, desktop, 1)
+        self.lib.XChangeProperty(self.display, window, self.wm_state, _XA_ATOM, 32,
+                                 _PROP_MODE_REPLACE, states, 2)
+        self._client_message(window, self.wm_desktop, _ALL_DESKTOPS, 1)
+        self._client_message(window, self.wm_state, _NET_WM_STATE_ADD,
+                             self.wm_state_sticky, self.wm_state_above, 1)
+        self.lib.XFlush(self.display)
+
+
+_x11 = None
+_x11_failed = False
+
+
+def _get_x11():
+    global _x11, _x11_failed
+    if _x11 is None and not _x11_failed:
+        try:
+            _x11 = _X11()
+        except Exception as e:
+            log.info("native X11 hints unavailable, using wmctrl: %s", e)
+            _x11_failed = True
+    return _x11
+
+
+def _pin_windows(widget):
+    """Windows-specific: topmost tool window, visible on all virtual desktops"""
+    HWND_TOPMOST = -1
+    SWP_NOSIZE = 0x0001
+    SWP_NOMOVE = 0x0002
+    SWP_SHOWWINDOW = 0x0040
+    GWL_EXSTYLE = -20
+    WS_EX_TOOLWINDOW = 0x00000080
+    WS_EX_NOACTIVATE = 0x08000000
+
+    user32 = ctypes.windll.user32
+    hwnd = int(widget.winId())
+    user32.SetWindowPos(hwnd, HWND_TOPMOST, 0, 0, 0, 0, SWP_NOMOVE | SWP_NOSIZE | SWP_SHOWWINDOW)
+    style = user32.GetWindowLongW(hwnd, GWL_EXSTYLE)
+    user32.SetWindowLongW(hwnd, GWL_EXSTYLE, style | WS_EX_TOOLWINDOW | WS_EX_NOACTIVATE)
+
+
+def _pin_linux(widget):
+    """Linux-specific: sticky + above on X11; nothing to do on Wayland"""
+    if QGuiApplication.platformName() != 'xcb':
+        return
+    wid = int(widget.winId())
+    x11 = _get_x11()
+    if x11 is not None:
+        x11.make_sticky(wid)
+        return
+    # Fallback: fire and forget, never block the GUI thread
+    _spawn(['wmctrl', '-i', '-r', hex(wid), '-b', 'add,sticky,above'])
+
+
+def pin_to_all_desktops(widget):
+    """Make a top-level widget visible on every virtual desktop.
+
+    Window-manager state sticks to the native window, so call this once per
+    window (e.g. per pooled notification card), not on every show.
+    """
+    try:
+        if platform.system() == 'Windows':
+            _pin_windows(widget)
+        elif platform.system() == 'Linux':
+            _pin_linux(widget)
+    except Exception as e:
+        log.warning("pinning window to all desktops failed: %s", e)
+    widget.raise_()
+
+
+# --- sound ------------------------------------------------------------------
+
+def _write_chime(path, rate=22050):
+    """Write a short two-tone chime as 16-bit mono WAV (QSoundEffect needs WAV)."""
+    samples = array('h')
+    for freq, length in ((880.0, 0.12), (1320.0, 0.22)):
+        n = int(rate * length)
+        for i in range(n):
+            envelope = math.exp(-4.0 * i / n)
+            samples.append(int(12000 * envelope * math.sin(2 * math.pi * freq * i / rate)))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(samples.tobytes())
+
+
+class NotificationSound:
+    """Payment chime, decoded once and replayed from memory.
+
+    Windows uses the (asynchronous) system sound; elsewhere a preloaded
+    ``QSoundEffect`` plays when QtMultimedia is available, otherwise the
+    platform player is started in the background.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self._effect = None
+        self._player = None
+        if platform.system() == 'Windows' or not _HAS_QTMULTIMEDIA:
+            return
+        try:
+            path = os.path.join(cache_dir, _CHIME_FILE)
+            if not os.path.exists(path):
+                _write_chime(path)
+            self._effect = QSoundEffect()
+            self._effect.setSource(QUrl.fromLocalFile(path))
+            self._effect.setVolume(0.8)
+        except Exception as e:
+            log.warning("could not preload notification sound: %s", e)
+            self._effect = None
+
+    def play(self):
+        try:
+            system = platform.system()
+            if system == 'Windows':
+                import winsound
+                winsound.PlaySound("SystemExclamation", winsound.SND_ALIAS | winsound.SND_ASYNC)
+            elif self._effect is not None and self._effect.status() != QSoundEffect.Status.Error:
+                self._effect.play()
+            elif self._player is not None and self._player.poll() is None:
+                return  # the previous chime is still playing
+            elif system == 'Darwin':
+                self._player = _spawn(['afplay', '/System/Library/Sounds/Glass.aiff'])
+            elif system == 'Linux':
+                self._player = _spawn(['paplay', '/usr/share/sounds/freedesktop/stereo/message.oga'])
+        except Exception as e:
+            log.warning("notification sound failed: %s", e)
+
+
+_sound = None
+
+
+def preload_notification_sound():
+    """Create the shared :class:`NotificationSound` (call from the GUI thread)."""
+    global _sound
+    if _sound is None:
+        _sound = NotificationSound()
+    return _sound
+
+
+def play_notification_sound():
+    preload_notification_sound().play()
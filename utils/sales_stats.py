@@ -0,0 +1,174 @@
+"""Running sales statistics per till: today's count, gross, average ticket and rate.
+
+Every payment updates a handful of counters in O(1). Payments per minute come
+from a fixed circular array of 1440 one-minute bins (the last 24 hours); a
+bin is lazily reset when its slot is reused for a newer minute, so nothing
+ever has to be swept or expired.
+"""
+import math
+import threading
+import time
+from array import array
+from datetime import datetime
+
+MINUTES_PER_DAY = 1440
+
+# Key under which the all-tills totals are kept ('' is a payment with no till)
+ALL_TILLS = None
+
+
+def _day_start(ts):
+    d = datetime.fromtimestamp(ts)
+    return datetime(d.year, d.month, d.day).timestamp()
+
+
+class _TillStats:
+    __slots__ = ('count', 'gross', 'bin_minute', 'bin_count', 'bin_amount')
+
+    def __init__(self):
+        self.count = 0
+        self.gross = 0.0
+        # Absolute minute number each slot currently holds (-1 = empty)
+        self.bin_minute = array('q', [-1]) * MINUTES_PER_DAY
+        self.bin_count = array('l', [0]) * MINUTES_PER_DAY
+        self.bin_amount = array('d', [0.0]) * MINUTES_PER_DAY
+
+    def add(self, amount, minute, today):
+        if today:
+            self.count += 1
+            self.gross += amount
+        slot = minute % MINUTES_PER_DAY
+        if self.bin_minute[slot] != minute:
+            if self.bin_minute[slot] > minute:
+                return  # older than the 24h window
+            self.bin_minute[slot] = minute
+            self.bin_count[slot] = 0
+            self.bin_amount[slot] = 0.0
+        self.bin_count[slot] += 1
+        self.bin_amount[slot] += amount
+
+    def window(self, now_minute, minutes):
+        """(count, amount) over the last ``minutes`` minutes, current minute included."""
+        count = 0
+        amount = 0.0
+        for minute in range(now_minute - minutes + 1, now_minute + 1):
+            slot = minute % MINUTES_PER_DAY
+            if self.bin_minute[slot] == minute:
+                count += self.bin_count[slot]
+                amount += self.bin_amount[slot]
+        return count, amount
+
+
+class SalesAggregator:
+    """Incremental per-till sales totals for the current day.
+
+    Feed it successful payments with :meth:`add`; seed it once from history
+    with :meth:`seed` or :meth:`seed_columns`. Reading (:meth:`snapshot`) is
+    meant to happen on a timer, not per payment. Totals roll over at local
+    midnight. Safe to feed from a network thread while the GUI reads.
+    """
+
+    def __init__(self, rate_window=15):
+        self.rate_window = rate_window
+        self._lock = threading.Lock()
+        self.version = 0
+        self._reset(time.time())
+
+    def _reset(self, now):
+        self._tills = {ALL_TILLS: _TillStats()}
+        self._day_start = _day_start(now)
+        self._day_end = self._day_start + 86400
+
+    def _roll_day(self, ts):
+        """Start a new day when ``ts`` is past today's end (bins are kept)."""
+        if ts >= self._day_end:
+            self._day_start = _day_start(ts)
+            self._day_end = self._day_start + 86400
+            for stats in self._tills.values():
+                stats.count = 0
+                stats.gross = 0.0
+
+    def _add(self, till, amount, ts):
+        today = self._day_start <= ts < self._day_end
+        minute = int(ts // 60)
+        self._tills[ALL_TILLS].add(amount, minute, today)
+        stats = self._tills.get(till)
+        if stats is None:
+            stats = self._tills[till] = _TillStats()
+        stats.add(amount, minute, today)
+
+    def add(self, till, amount, ts=None):
+        """Count one successful payment. Missing/invalid amounts are ignored."""
+        if amount is None or amount != amount:
+            return
+        ts = time.time() if ts is None or ts != ts else ts
+        with self._lock:
+            self._roll_day(ts)
+            self._add(str(till or ''), float(amount), ts)
+            self.version += 1
+
+    def seed(self, payments, now=None):
+        """Replace the totals with ``(till, amount, timestamp)`` payments."""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._reset(now)
+            cutoff = now - 86400
+            add = self._add
+            for till, amount, ts in payments:
+                if amount is None or amount != amount or ts is None or ts != ts or ts < cutoff:
+                    continue
+                add(str(till or ''), float(amount), ts)
+            self.version += 1
+
+    def seed_columns(self, columns, now=None):
+        """Seed straight from :meth:`TransactionStore.columns` in one pass.
+
+        Rows without an amount (failed/cancelled pushes) are skipped; the
+        comparisons double as NaN checks since NaN compares false.
+        """
+        now = time.time() if now is None else now
+        cutoff = now - 86400
+        payments = (
+            (till, amount, ts)
+            for _ids, ts_col, amount_col, _phone, _status, _txid, till_col in columns
+            for ts, amount, till in zip(ts_col, amount_col, till_col)
+            if ts >= cutoff and amount > 0
+        )
+        self.seed(payments, now=now)
+
+    def tills(self):
+        with self._lock:
+            return sorted(t for t in self._tills if t is not ALL_TILLS)
+
+    def snapshot(self, now=None):
+        """Return ``{till: {...}}`` (``ALL_TILLS`` for the overall totals).
+
+        Each entry has ``count``, ``gross``, ``average`` (ticket size),
+        ``per_minute`` (payments per minute over ``rate_window``) and
+        ``last_hour`` (payments in the last 60 minutes).
+        """
+        now = time.time() if now is None else now
+        now_minute = int(now // 60)
+        with self._lock:
+            self._roll_day(now)
+            out = {}
+            for till, stats in self._tills.items():
+                recent, _amount = stats.window(now_minute, self.rate_window)
+                last_hour, _amount = stats.window(now_minute, 60)
+                out[till] = {
+                    'count': stats.count,
+                    'gross': stats.gross,
+                    'average': stats.gross / stats.count if stats.count else 0.0,
+                    'per_minute': recent / self.rate_window,
+                    'last_hour': last_hour,
+                }
+            return out
+
+
+def format_kes(amount):
+    """``KES 14,350`` / ``KES 14,350.50``"""
+    if not math.isfinite(amount):
+        return 'KES 0'
+    if amount == int(amount):
+        return f"KES {int(amount):,}"
+    return f"KES {amount:,.2f}"
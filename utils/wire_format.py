@@ -0,0 +1,64 @@
+"""Packet serializer negotiation for the Socket.IO notification channel.
+
+Packets are JSON text by default. A client that has msgpack installed
+connects with ``?codec=msgpack`` and uses :func:`client_serializer`; if the
+server has msgpack too, it sends that client's notifications as MessagePack
+binary packets (python-socketio's ``msgpack`` serializer format) instead of
+JSON. Anything else — the connect handshake, other events, everything the
+client sends — stays JSON, so the server keeps one serializer for all
+clients and a client without msgpack (or talking to a server without it)
+simply gets JSON.
+
+``bench_serializers.py`` compares the two on typical STK and C2B events.
+"""
+try:
+    # Needs both python-socketio and msgpack
+    from socketio.msgpack_packet import MsgPackPacket
+    _HAS_MSGPACK = True
+except Exception:
+    _HAS_MSGPACK = False
+
+JSON = 'json'
+MSGPACK = 'msgpack'
+
+_client_packet_class = None
+
+
+def negotiate(requested):
+    """Server side: the codec to use for a client that asked for ``requested``."""
+    return MSGPACK if requested == MSGPACK and _HAS_MSGPACK else JSON
+
+
+def codec_params():
+    """Connect query parameters that request the best codec this side supports."""
+    return {'codec': MSGPACK} if _HAS_MSGPACK else {}
+
+
+def packet_class(codec):
+    """python-socketio packet class the server encodes ``codec`` packets with (None for JSON)."""
+    if codec == MSGPACK:
+        return MsgPackPacket
+    return None
+
+
+def client_serializer():
+    """``serializer`` argument for ``socketio.Client``.
+
+    Decodes binary messages as MessagePack packets and text as JSON; sends
+    JSON. Plain ``'default'`` when msgpack is not installed.
+    """
+    global _client_packet_class
+    if not _HAS_MSGPACK:
+        return 'default'
+    if _client_packet_class is None:
+        from socketio import packet
+
+        class NegotiatedPacket(packet.Packet):
+            def decode(self, encoded_packet):
+                if isinstance(encoded_packet, (bytes, bytearray)):
+                    MsgPackPacket.decode(self, encoded_packet)
+                    return 0
+                return super().decode(encoded_packet)
+
+        _client_packet_class = NegotiatedPacket
+    return _client_packet_class